@@ -0,0 +1,238 @@
+"""Benchmarks the overhead of the tester itself.
+
+A stand-in HTTP server is started in a subprocess, and the Runner is
+driven against it in this process to measure how many hits per second
+the tester generates, the CPU time it spends per hit, its memory growth
+and the time spent streaming the results.
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from loadstester.case import TestCase
+from loadstester.runner import Runner
+from loadstester.util import monotonic_ns
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    """Answers with a small body on:
+
+    - /fast: right away.
+    - /slow?ms=10: after the given number of milliseconds.
+    - /close: right away, closing the connection.
+    """
+    protocol_version = 'HTTP/1.1'
+    body = 'OK'
+    # send each response in one packet, not to wait for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parts = urlparse.urlparse(self.path)
+        if parts.path == '/slow':
+            query = urlparse.parse_qs(parts.query)
+            time.sleep(int(query.get('ms', ['10'])[0]) / 1000.)
+        elif parts.path not in ('/fast', '/close'):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(self.body)))
+        if parts.path == '/close':
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(port=0):
+    server = BenchServer(('127.0.0.1', port), BenchHandler)
+    # the parent process reads the port on the first line
+    print(server.server_port)
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+def start_server():
+    """Starts the stand-in server in a subprocess.
+
+    Returns the process and the url of the server.
+    """
+    process = subprocess.Popen([sys.executable, '-m', 'loadstester.bench',
+                                '--serve'], stdout=subprocess.PIPE)
+    port = int(process.stdout.readline())
+    return process, 'http://127.0.0.1:%d' % port
+
+
+class BenchCase(TestCase):
+    def test_fast(self):
+        self.session.get(self.server_url + '/fast')
+
+    def test_slow(self):
+        self.session.get(self.server_url + '/slow?ms=%d' %
+                         self.config.get('latency', 10))
+
+    def test_close(self):
+        self.session.get(self.server_url + '/close')
+
+
+class _NullStream(object):
+    """Counts and discards what the runner writes on stdout."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+
+class _Timer(object):
+    """Wraps a method to count its calls and the time spent in it."""
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.elapsed = 0
+
+    def __call__(self, *args, **kwargs):
+        start = monotonic_ns()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.elapsed += monotonic_ns() - start
+            self.calls += 1
+
+
+def _rss_kb():
+    """Returns the current resident memory of the process in kilobytes,
+    or its peak one where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        # in kilobytes on Linux, but in bytes on OS X
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            rss //= 1024
+        return rss
+    return pages * resource.getpagesize() // 1024
+
+
+def run_bench(options, server_url):
+    """Runs the tester against :param server_url: and returns the report.
+
+    The :param options: are the runner ones, plus *endpoint* to pick the
+    BenchCase test.
+    """
+    args = dict(options)
+    endpoint = args.pop('endpoint', 'fast')
+    args['fqn'] = 'loadstester.bench.BenchCase.test_%s' % endpoint
+    args['server_url'] = server_url
+    runner = Runner(args)
+
+    result = runner.test_result
+    hits = result.add_hit_record = _Timer(result.add_hit_record)
+    if result.streamer is not None:
+        push = result.streamer.push = _Timer(result.streamer.push)
+        push_hit = result.streamer.push_hit = _Timer(
+            result.streamer.push_hit)
+    else:
+        push = push_hit = _Timer(None)
+
+    gc.collect()
+    rss = _rss_kb()
+    cpu = sum(os.times()[:2])
+    old_stream, sys.stdout = sys.stdout, _NullStream()
+    start = monotonic_ns()
+    try:
+        runner.execute()
+    finally:
+        elapsed = (monotonic_ns() - start) / 1e9
+        output, sys.stdout = sys.stdout, old_stream
+    cpu = sum(os.times()[:2]) - cpu
+    rss_growth = _rss_kb() - rss
+
+    nb_hits = hits.calls
+    return {'hits': nb_hits,
+            'errors': result.nb_errors + result.nb_failures,
+            'duration': elapsed,
+            'hits_per_second': nb_hits / elapsed,
+            'cpu': cpu,
+            'cpu_per_hit': nb_hits and cpu / nb_hits,
+            'rss_growth_kb': rss_growth,
+            'add_hit_time': hits.elapsed / 1e9,
+            'streamer_time': (push.elapsed + push_hit.elapsed) / 1e9,
+            'streamer_events': push.calls + push_hit.calls,
+            'streamer_share': cpu and (push.elapsed +
+                                       push_hit.elapsed) / 1e9 / cpu,
+            'output_bytes': output.size}
+
+
+def main(sysargs=sys.argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the tester's own overhead.")
+    parser.add_argument('--serve', action='store_true',
+                        help='Only run the stand-in HTTP server')
+    parser.add_argument('--port', type=int, default=0,
+                        help='Port of the stand-in HTTP server')
+    parser.add_argument('--endpoint', default='fast',
+                        choices=('fast', 'slow', 'close'))
+    parser.add_argument('--latency', type=int, default=10,
+                        help='Latency of the slow endpoint, in ms')
+    parser.add_argument('--users', default='10')
+    parser.add_argument('--hits', default=None)
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--streamer', default='json')
+    parser.add_argument('--engine', default='gevent',
+                        choices=('gevent', 'threads'))
+    parser.add_argument('--options', default='{}',
+                        help='Other runner options, in JSON')
+    args = parser.parse_args(sysargs[1:])
+
+    if args.serve:
+        return serve(args.port)
+
+    options = json.loads(args.options)
+    options.update({'users': args.users, 'endpoint': args.endpoint,
+                    'latency': args.latency, 'streamer': args.streamer,
+                    'engine': args.engine})
+    if args.duration is not None:
+        options['duration'] = args.duration
+    elif args.hits is not None:
+        options['hits'] = args.hits
+    else:
+        options['hits'] = '100'
+
+    process, server_url = start_server()
+    try:
+        report = run_bench(options, server_url)
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
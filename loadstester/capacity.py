@@ -0,0 +1,161 @@
+"""Search of the capacity of the target, with the *capacity* option.
+
+Instead of running a fixed load, the runner looks for the highest load the
+target sustains while meeting the *capacity_slo* thresholds, given like
+the ones of :mod:`loadstester.thresholds`: ``p95<500,error_rate<1`` by
+default. The load is either a number of users, with ``"capacity":
+"users"``, or an arrival rate in requests per second, with ``"capacity":
+"rate"``.
+
+Each step holds a level for *capacity_warmup* seconds, 2 by default, then
+measures it during *capacity_step* seconds, 10 by default. The levels start
+at *capacity_start* and are multiplied by *capacity_factor*, 2 by default,
+until a step misses the SLO or *capacity_max* is reached. The search then
+bisects between the last level passing and the first one failing, until
+they're within *capacity_precision*, 5% by default, of each other. At most
+*capacity_steps* steps are run, 20 by default. When even the first level
+fails, the search goes down to *capacity_start* divided by the factor
+three times, or one hit per step in rate mode, then reports no sustainable
+level.
+
+In rate mode a step also fails when the target serves less than 90% of the
+arrivals: the pool of *pool_size* users can't keep up.
+
+The users, and their connections, are kept from one step to the next. The
+report of the search is sent in a ``capacity`` event: the best level, the
+max RPS of the steps passing, and the RPS, latencies and error rate of each
+step.
+"""
+import math
+import time
+
+from loadstester.results import _elapsed_us
+from loadstester.thresholds import Totals, parse_thresholds
+
+
+DEFAULT_SLO = 'p95<500,error_rate<1'
+
+# the rate mode steps serving less than this share of their rate fail
+MIN_THROUGHPUT = .9
+
+
+class CapacitySearch(object):
+    """Picks the levels of the steps: *start*, then multiplied by *factor*
+    until a step fails, then bisecting. The levels are integers when
+    *integer* is true, and not tried under *floor*.
+    """
+    def __init__(self, start=1, factor=2., maximum=None, precision=.05,
+                 integer=True, floor=None):
+        if start <= 0 or factor <= 1:
+            raise ValueError('The capacity search needs a start > 0 and a '
+                             'factor > 1')
+        if integer and maximum is not None:
+            maximum = int(maximum)
+        self.start = start
+        self.factor = float(factor)
+        self.maximum = maximum
+        self.precision = precision
+        self.integer = integer
+        if floor is None:
+            floor = start / self.factor ** 3
+        self.floor = floor
+        self.passed = None      # the highest level passing
+        self.failed = None      # the lowest level failing
+        self._tried = set()
+
+    def _round(self, level):
+        if self.integer:
+            return int(math.ceil(level))
+        return level
+
+    def next_level(self):
+        """Returns the level of the next step, or None when it's found."""
+        if self.passed is None and self.failed is None:
+            level = self._round(self.start)
+        elif self.failed is None:
+            if self.maximum is not None and self.passed >= self.maximum:
+                return None
+            level = self._round(self.passed * self.factor)
+            if level <= self.passed:
+                level = self.passed + 1
+            if self.maximum is not None:
+                level = min(level, self.maximum)
+        else:
+            low = self.passed or 0
+            tolerance = (low or self.failed) * self.precision
+            if self.failed - low <= max(tolerance, self.integer and 1 or 0):
+                return None
+            level = (low + self.failed) / 2.
+            if self.integer:
+                level = int(level)
+                if level <= low:
+                    return None
+            if level < self.floor:
+                return None
+        if level in self._tried:
+            return None
+        self._tried.add(level)
+        return level
+
+    def record(self, level, passed):
+        if passed:
+            if self.passed is None or level > self.passed:
+                self.passed = level
+        elif self.failed is None or level < self.failed:
+            self.failed = level
+
+
+class CapacityProbe(object):
+    """Measures the hits of the current step, a results observer."""
+
+    def __init__(self, slo=DEFAULT_SLO):
+        self.slo = parse_thresholds(slo)
+        if not self.slo:
+            raise ValueError('The capacity search needs a SLO')
+        self.totals = None
+
+    def add_hit(self, hit):
+        if self.totals is not None:
+            self.totals.add(_elapsed_us(hit.elapsed),
+                            hit.status is None or hit.status >= 400)
+
+    def add_event(self, action):
+        pass
+
+    def start(self):
+        self.totals = Totals()
+
+    def stop(self, level, rate=None):
+        """Ends the step at *level*, and returns its results. *rate* is the
+        arrival rate of the step, in rate mode.
+        """
+        totals, self.totals = self.totals, None
+        totals.end = time.time()
+        histogram = totals.histogram
+        rps = totals.rate()
+        failed = [str(threshold) for threshold in self.slo
+                  if not threshold.passes(threshold.measured(totals))]
+        if not histogram.count:
+            failed.append('no hits')
+        elif rate is not None and rps < rate * MIN_THROUGHPUT:
+            failed.append('rps>%g' % (rate * MIN_THROUGHPUT))
+
+        step = {'level': level, 'rps': rps, 'hits': histogram.count,
+                'error_rate': totals.error_ratio() * 100,
+                'passed': not failed, 'failed': failed}
+        for percent, value in zip((50, 90, 95, 99),
+                                  histogram.percentiles(50, 90, 95, 99)):
+            if value is not None:
+                value /= 1000.
+            step['p%d' % percent] = value
+        return step
+
+
+def report(mode, steps):
+    """Returns the capacity report of the *steps*."""
+    passed = [step for step in steps if step['passed']]
+    best = passed and max(passed, key=lambda step: step['level']) or None
+    return {'mode': mode,
+            'level': best and best['level'],
+            'max_rps': passed and max([step['rps'] for step in passed]) or 0,
+            'steps': steps}
@@ -1,8 +1,9 @@
 import unittest
-from requests.adapters import HTTPAdapter
 
+from loadstester.connections import get_strategy, MAX_CON  # NOQA
 from loadstester.measure import Session, TestApp
 from loadstester.results import Results
+from loadstester.util import get_resolver
 
 
 class FakeTestApp(object):
@@ -15,9 +16,6 @@ class FakeTestApp(object):
         return wrapper
 
 
-MAX_CON = 1000
-
-
 class TestCase(unittest.TestCase):
 
     server_url = None
@@ -33,11 +31,14 @@ class TestCase(unittest.TestCase):
             test_result = Results()
         self._test_result = test_result
         dns_resolve = not config.get('no_dns_resolve', False)
+        resolver = get_resolver(ttl=config.get('dns_ttl', 300),
+                                selection=config.get('dns_selection',
+                                                     'round-robin'))
         self.session = Session(test=self,
                                test_result=self._test_result,
-                               dns_resolve=dns_resolve)
-        http_adapter = HTTPAdapter(pool_maxsize=MAX_CON,
-                                   pool_connections=MAX_CON)
+                               dns_resolve=dns_resolve,
+                               resolver=resolver)
+        http_adapter = get_strategy(config).get_adapter()
         self.session.mount('http://', http_adapter)
         self.session.mount('https://', http_adapter)
 
@@ -0,0 +1,228 @@
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import (HTTPConnection,
+                                                  HTTPSConnection)
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+
+from loadstester.util import monotonic_ns, resolve_name
+
+
+MAX_CON = 1000
+
+
+class ConnectionStats(object):
+    """Counts the connections opened and reused by a strategy."""
+
+    def __init__(self):
+        self.connections = 0
+        self.reused = 0
+
+    def as_dict(self):
+        return {'connections': self.connections,
+                'reused': self.reused,
+                'requests': self.connections + self.reused}
+
+
+class _TimingHTTPConnection(HTTPConnection):
+    """Records how long establishing the TCP connection took."""
+    loads_connect_ns = loads_tls_ns = 0
+
+    def _new_conn(self):
+        start = monotonic_ns()
+        conn = HTTPConnection._new_conn(self)
+        self.loads_connect_ns = monotonic_ns() - start
+        return conn
+
+
+class _TimingHTTPSConnection(HTTPSConnection):
+    """Records how long establishing the TCP connection and the TLS
+    handshake took.
+    """
+    loads_connect_ns = loads_tls_ns = 0
+
+    def _new_conn(self):
+        start = monotonic_ns()
+        conn = HTTPSConnection._new_conn(self)
+        self.loads_connect_ns = monotonic_ns() - start
+        return conn
+
+    def connect(self):
+        start = monotonic_ns()
+        HTTPSConnection.connect(self)
+        elapsed = monotonic_ns() - start
+        self.loads_tls_ns = max(elapsed - self.loads_connect_ns, 0)
+
+
+class _CountingPoolMixin(object):
+    """Counts the new and reused connections handed out by the pool, and
+    closes the connections that served *max_requests* requests.
+    """
+    stats = None
+    max_requests = None
+
+    def _get_conn(self, timeout=None):
+        conn = super(_CountingPoolMixin, self)._get_conn(timeout=timeout)
+        # a connection without a socket (new, dropped or closed) will
+        # connect on its next request.
+        if getattr(conn, 'sock', None) is None:
+            self.stats.connections += 1
+            conn.loads_requests = 1
+        else:
+            self.stats.reused += 1
+            conn.loads_requests = getattr(conn, 'loads_requests', 0) + 1
+        conn.loads_connect_ns = conn.loads_tls_ns = 0
+        return conn
+
+    def _put_conn(self, conn):
+        if (conn is not None and self.max_requests and
+                getattr(conn, 'loads_requests', 0) >= self.max_requests):
+            conn.close()
+        super(_CountingPoolMixin, self)._put_conn(conn)
+
+
+class LoadsHTTPAdapter(HTTPAdapter):
+    """A HTTPAdapter using the given connection pool classes."""
+
+    def __init__(self, pool_classes, *args, **kwargs):
+        self.pool_classes = pool_classes
+        super(LoadsHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(LoadsHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes
+
+    def send(self, request, **kwargs):
+        """Sends the request, and sets on the response a *loads_timing*
+        tuple giving in nanoseconds the time spent connecting, doing the
+        TLS handshake and waiting for the response headers.
+        """
+        start = monotonic_ns()
+        response = super(LoadsHTTPAdapter, self).send(request, **kwargs)
+        elapsed = monotonic_ns() - start
+        conn = getattr(response.raw, '_connection', None)
+        connect = getattr(conn, 'loads_connect_ns', 0)
+        tls = getattr(conn, 'loads_tls_ns', 0)
+        response.loads_timing = connect, tls, max(elapsed - connect - tls, 0)
+        return response
+
+
+class ConnectionStrategy(object):
+    """Decides which HTTP adapter, and so which connection pool, the session
+    of each test case uses.
+    """
+    name = None
+
+    def __init__(self, pool_size=MAX_CON, max_requests=None):
+        self.pool_size = pool_size
+        self.max_requests = max_requests
+        self.stats = ConnectionStats()
+        attrs = {'stats': self.stats, 'max_requests': max_requests}
+        self.pool_classes = {
+            'http': type('LoadsHTTPConnectionPool',
+                         (_CountingPoolMixin, HTTPConnectionPool),
+                         dict(attrs, ConnectionCls=_TimingHTTPConnection)),
+            'https': type('LoadsHTTPSConnectionPool',
+                          (_CountingPoolMixin, HTTPSConnectionPool),
+                          dict(attrs, ConnectionCls=_TimingHTTPSConnection))}
+
+    def _create_adapter(self, block=False):
+        return LoadsHTTPAdapter(self.pool_classes,
+                                pool_connections=self.pool_size,
+                                pool_maxsize=self.pool_size,
+                                pool_block=block)
+
+    def get_adapter(self):
+        """Returns the adapter of a new session, a new one by default."""
+        return self._create_adapter()
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        stats['strategy'] = self.name
+        return stats
+
+
+class PerUserStrategy(ConnectionStrategy):
+    """Each test case has its own pool, like a browser would."""
+    name = 'user'
+
+
+class SharedStrategy(ConnectionStrategy):
+    """All the test cases of the process share the same pool."""
+    name = 'process'
+
+    def __init__(self, *args, **kwargs):
+        super(SharedStrategy, self).__init__(*args, **kwargs)
+        self._adapter = None
+
+    def get_adapter(self):
+        if self._adapter is None:
+            self._adapter = self._create_adapter()
+        return self._adapter
+
+
+class FixedPoolStrategy(SharedStrategy):
+    """All the test cases of the process share a pool of at most
+    *pool_size* connections per host, waiting for a free one when they are
+    all busy. Each connection is closed after *max_requests* requests.
+    """
+    name = 'fixed'
+
+    def get_adapter(self):
+        if self._adapter is None:
+            self._adapter = self._create_adapter(block=True)
+        return self._adapter
+
+
+# the strategies needing an optional library are imported when used
+STRATEGIES = {'user': PerUserStrategy,
+              'process': SharedStrategy,
+              'fixed': FixedPoolStrategy,
+              'http2': 'loadstester.http2.HTTP2Strategy'}
+
+_REQUIRES = {'http2': 'hyper'}
+
+_STRATEGIES = {}
+
+
+def reset_strategies():
+    """Forgets the strategies of the process, so that a new run starts
+    with new pools and stats.
+    """
+    _STRATEGIES.clear()
+
+
+def get_strategy(config):
+    """Returns the connection strategy of the run for the given config.
+
+    The strategy is picked with the *connection_strategy* option, and
+    configured with the *connection_pool_size* and
+    *connection_max_requests* ones.
+    """
+    name = config.get('connection_strategy', 'user')
+    pool_size = config.get('connection_pool_size')
+    max_requests = config.get('connection_max_requests')
+    key = name, pool_size, max_requests
+
+    strategy = _STRATEGIES.get(key)
+    if strategy is None:
+        try:
+            klass = STRATEGIES[name]
+        except KeyError:
+            raise ValueError('Unknown connection strategy %r, choose one '
+                             'of %s' % (name, ', '.join(sorted(STRATEGIES))))
+        if isinstance(klass, basestring):
+            try:
+                klass = resolve_name(klass)
+            except ImportError:
+                raise ValueError('The %r connection strategy needs the %s '
+                                 'library' % (name, _REQUIRES[name]))
+        if pool_size is None:
+            if name == 'fixed':
+                pool_size = 10
+            elif name == 'http2':
+                pool_size = 1
+            else:
+                pool_size = MAX_CON
+        strategy = klass(pool_size=pool_size, max_requests=max_requests)
+        _STRATEGIES[key] = strategy
+    return strategy
@@ -0,0 +1,139 @@
+"""Caches the environments of the python dependencies of the tests.
+
+Each list of dependencies is installed once, into a directory of the
+cache named after the hash of the list and of the interpreter, and that
+directory is then reused by the next runs and the other workers. The
+dependencies are installed in their order into that directory, the later
+ones overriding the earlier ones, and the environment is made read-only
+once complete.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+
+from loadstester.util import logger, private_makedirs, user_cache_dir
+
+
+def parse_deps(deps):
+    """Returns the requirements of a list of comma-separated values, in
+    their order and without the duplicates.
+    """
+    pydeps = []
+    for dep in deps:
+        for d in dep.split(','):
+            d = d.strip()
+            if d != '' and d not in pydeps:
+                pydeps.append(d)
+    return pydeps
+
+
+def deps_key(pydeps):
+    """Returns the key of a list of requirements for this interpreter."""
+    digest = hashlib.sha1(sys.executable)
+    digest.update(sys.version)
+    for dep in pydeps:
+        digest.update('\n' + dep)
+    return digest.hexdigest()
+
+
+def _make_readonly(path):
+    readonly = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    for root, dirnames, filenames in os.walk(path, topdown=False):
+        for name in filenames + dirnames:
+            name = os.path.join(root, name)
+            if not os.path.islink(name):
+                os.chmod(name, os.stat(name).st_mode & readonly)
+    os.chmod(path, os.stat(path).st_mode & readonly)
+
+
+class DepsCache(object):
+    """Installs the lists of requirements into :param cache_dir:,
+    ``~/.cache/loads-deps`` by default. As its content is imported, it must
+    belong to the current user and be writable by no one else.
+    """
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = user_cache_dir('loads-deps')
+        self.cache_dir = cache_dir
+
+    def _install(self, dep, target, build_dir):
+        """Installs :param dep: into :param target:."""
+        # XXX pip hack to avoid uninstall
+        nil = "lambda *args, **kw: None"
+        code = ["from pip.req import InstallRequirement",
+                "InstallRequirement.uninstall = %s" % nil,
+                "InstallRequirement.commit_uninstall = %s" % nil,
+                "import pip", "pip.main()"]
+
+        cmd = [sys.executable, '-c', '"%s"' % ';'.join(code),
+               'install', '-t', target, '-I', '-b', build_dir, dep]
+
+        logger.debug('Deploying %r in %r' % (dep, target))
+        process = subprocess.Popen(' '.join(cmd), shell=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+
+        # XXX see https://github.com/mozilla-services/loads/issues/253
+        if 'Successfully installed' not in stdout:
+            logger.debug('Failed to deploy %r' % dep)
+            logger.debug('Error: %s' % str(stderr))
+            logger.debug('Stdout: %s' % str(stdout))
+            logger.debug("Command used: %s" % str(' '.join(cmd)))
+            raise Exception(stderr)
+        logger.debug('Successfully deployed %r' % dep)
+
+    def _install_all(self, pydeps, location):
+        """Installs the requirements in their order, into the ``deps``
+        directory of :param location:.
+        """
+        target = os.path.join(location, 'deps')
+        build_dir = os.path.join(location, 'build')
+        try:
+            for dep in pydeps:
+                self._install(dep, target, build_dir)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def paths(self, location):
+        """Returns the directories to put in sys.path for an environment.
+        """
+        return [os.path.join(location, 'deps')]
+
+    def get(self, pydeps):
+        """Returns the directories of the environment of :param pydeps:,
+        and whether it was already in the cache.
+
+        Concurrent workers asking for the same set wait for the first one
+        to install it.
+        """
+        private_makedirs(self.cache_dir)
+        key = deps_key(pydeps)
+        location = os.path.join(self.cache_dir, key)
+        if os.path.isdir(location):
+            return self.paths(location), True
+
+        with open(location + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.isdir(location):
+                    return self.paths(location), True
+
+                tmp = tempfile.mkdtemp(prefix=key + '.', dir=self.cache_dir)
+                try:
+                    self._install_all(pydeps, tmp)
+                    os.chmod(tmp, 0755)
+                    # complete environments only appear under their key
+                    os.rename(tmp, location)
+                except Exception:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    raise
+                _make_readonly(location)
+                return self.paths(location), False
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
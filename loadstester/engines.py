@@ -0,0 +1,163 @@
+"""The engines running the users, picked with the *engine* option.
+
+- ``gevent``, the default: each user is a greenlet, and the standard
+  library is monkey patched unless *no_patching* is given.
+- ``threads``: each user is a native thread, and nothing is patched. It's
+  meant for the client libraries that do not work with gevent. The threads
+  cost more memory and switches than greenlets, and the ones still running
+  past the grace period can't be killed: they're left to finish, without
+  writing in the results once the run is over. The results are written
+  under a lock.
+
+The ``threads`` engine only runs groups of users: the arrival rate, users
+profile and replay modes need gevent. It also needs a process gevent did
+not patch already.
+"""
+import threading
+import time
+
+import gevent
+from gevent import monkey
+
+from loadstester.util import logger
+
+
+class GeventEngine(object):
+    name = 'gevent'
+
+    def setup(self, args):
+        if not args.get('no_patching', False):
+            logger.debug('Gevent monkey patches the stdlib')
+            monkey.patch_all()
+
+    def shutdown(self):
+        pass
+
+    def spawn(self, func, *args):
+        return gevent.spawn(func, *args)
+
+    def spawn_later(self, seconds, func, *args):
+        return gevent.spawn_later(seconds, func, *args)
+
+    def sleep(self, seconds):
+        gevent.sleep(seconds)
+
+    def join(self, tasks, timeout=None):
+        gevent.joinall(tasks, timeout=timeout)
+
+    def running(self, tasks):
+        return [task for task in tasks if not task.dead]
+
+    def kill(self, tasks):
+        gevent.killall(tasks)
+
+    def synchronize(self, results):
+        return results
+
+    def close(self, results):
+        pass
+
+
+class _Synchronized(object):
+    """Calls the methods of *target* holding *lock*. Once closed, the calls
+    of the other threads than the closing one are dropped.
+    """
+
+    def __init__(self, target, lock):
+        self.__dict__['_target'] = target
+        self.__dict__['_lock'] = lock
+        self.__dict__['_owner'] = None
+
+    def _close(self):
+        with self._lock:
+            self.__dict__['_owner'] = threading.current_thread()
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        lock = self._lock
+
+        def locked(*args, **kwargs):
+            with lock:
+                owner = self._owner
+                if owner is not None and \
+                        owner is not threading.current_thread():
+                    return None
+                return value(*args, **kwargs)
+        return locked
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+class ThreadEngine(object):
+    name = 'threads'
+
+    def __init__(self):
+        self._timers = []
+        self._closed = False
+
+    def setup(self, args):
+        self._closed = False
+
+    def shutdown(self):
+        self._closed = True
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+    def spawn(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def spawn_later(self, seconds, func, *args):
+        if self._closed:
+            return None
+        self._timers = [timer for timer in self._timers if timer.is_alive()]
+        timer = threading.Timer(seconds, func, args)
+        timer.daemon = True
+        timer.start()
+        self._timers.append(timer)
+        return timer
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def join(self, tasks, timeout=None):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for task in tasks:
+            if deadline is None:
+                task.join()
+            else:
+                task.join(max(deadline - time.time(), 0))
+
+    def running(self, tasks):
+        return [task for task in tasks if task.is_alive()]
+
+    def kill(self, tasks):
+        logger.debug('%d threads can not be killed, they are left to '
+                     'finish' % len(tasks))
+
+    def synchronize(self, results):
+        return _Synchronized(results, threading.RLock())
+
+    def close(self, results):
+        # the threads left running don't write past the final events
+        results._close()
+
+
+ENGINES = {'gevent': GeventEngine,
+           'threads': ThreadEngine}
+
+
+def get_engine(name):
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError('Unknown engine %r, choose one of %s' %
+                         (name, ', '.join(sorted(ENGINES))))
@@ -0,0 +1,192 @@
+"""A HTTP/2 transport, picked with the ``http2`` connection strategy.
+
+The requests of all the test cases of the process are multiplexed as
+streams over *connection_pool_size* connections per host, one by default,
+instead of needing a connection per request in flight. The hits are
+measured like with the HTTP/1.1 strategies, the TLS handshake being
+counted in the connection time.
+
+The plain http urls are sent in HTTP/2 directly, without an upgrade, and
+the https ones negotiate it with ALPN, checking the certificates as told by
+*verify*. The *timeout* of a request applies to the reads of its
+connection: hyper doesn't time out the connection itself, nor takes a
+timeout before its 0.8 versions.
+
+It needs the hyper library.
+"""
+import inspect
+import socket
+import ssl
+import threading
+import urlparse
+
+from hyper import HTTP20Connection
+from hyper.contrib import HTTP20Adapter
+from hyper.http20.exceptions import HTTP20Error
+from hyper.tls import init_context
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from loadstester.connections import ConnectionStrategy
+from loadstester.util import monotonic_ns
+
+
+_HAS_TIMEOUT = 'timeout' in inspect.getargspec(HTTP20Connection.__init__)[0]
+
+
+def _connect(host, port, secure, ssl_context, timeout):
+    """Returns a new connection to the host, connected, whose reads time
+    out after *timeout* seconds.
+    """
+    if _HAS_TIMEOUT:
+        conn = HTTP20Connection(host, port, secure=secure,
+                                ssl_context=ssl_context, timeout=timeout)
+    else:
+        conn = HTTP20Connection(host, port, secure=secure,
+                                ssl_context=ssl_context)
+    try:
+        conn.connect()
+        if not _HAS_TIMEOUT:
+            # the older versions only give the socket of their buffer
+            sock = getattr(getattr(conn, '_sock', None), '_sck', None)
+            if sock is not None:
+                sock.settimeout(timeout)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _ssl_context(cert, verify):
+    """Returns the SSL context of the connections with the *cert* and
+    *verify* options of requests, or None for the default one.
+    """
+    if cert is None and verify is True:
+        return None
+    cert_path = None
+    if isinstance(verify, basestring):
+        cert_path = verify
+    context = init_context(cert_path=cert_path, cert=cert)
+    if verify is False:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class HTTP2Adapter(HTTP20Adapter):
+    """Sends the requests on at most *size* HTTP/2 connections per host,
+    used in turn, and counts them in *stats*.
+    """
+    def __init__(self, stats, size=1):
+        super(HTTP2Adapter, self).__init__()
+        self.stats = stats
+        self.size = size
+        self.pools = {}
+        self._turns = {}
+        self._lock = threading.Lock()
+
+    def get_connection(self, host, port, scheme, cert=None, verify=True,
+                       timeout=None):
+        """Returns a connection to the host, and the nanoseconds spent
+        connecting it if it's a new one.
+
+        The new connections are connected before any stream uses them:
+        hyper can deadlock when a request is sent on a connection that's
+        still connecting.
+        """
+        with self._lock:
+            return self._get_connection(host, port, scheme, cert, verify,
+                                        timeout)
+
+    def _get_connection(self, host, port, scheme, cert, verify, timeout):
+        secure = scheme == 'https'
+        if port is None:
+            port = secure and 443 or 80
+        if isinstance(timeout, tuple):
+            timeout = timeout[1]
+        key = host, port, scheme, cert, verify, timeout
+
+        pool = self.pools.setdefault(key, [])
+        if len(pool) < self.size:
+            start = monotonic_ns()
+            conn = _connect(host, port, secure, _ssl_context(cert, verify),
+                            timeout)
+            pool.append(conn)
+            self.stats.connections += 1
+            return conn, monotonic_ns() - start
+
+        turn = self._turns.get(key, 0)
+        self._turns[key] = turn + 1
+        self.stats.reused += 1
+        return pool[turn % len(pool)], 0
+
+    def _drop(self, conn):
+        for pool in self.pools.values():
+            if conn in pool:
+                pool.remove(conn)
+        conn.close()
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, **kwargs):
+        """Sends the request on its own stream, and sets the *loads_timing*
+        of the response like :class:`loadstester.connections.LoadsHTTPAdapter`
+        does.
+        """
+        parsed = urlparse.urlparse(request.url)
+        selector = parsed.path or '/'
+        if parsed.query:
+            selector += '?' + parsed.query
+
+        # the Host header set by the DNS resolution is the authority
+        headers = dict(request.headers)
+        for name in headers.keys():
+            if name.lower() == 'host':
+                headers[':authority'] = headers.pop(name)
+
+        start = monotonic_ns()
+        try:
+            conn, connect = self.get_connection(parsed.hostname, parsed.port,
+                                                parsed.scheme, cert=cert,
+                                                verify=verify,
+                                                timeout=timeout)
+        except (socket.error, HTTP20Error), exc:
+            raise ConnectionError(exc, request=request)
+        try:
+            stream_id = conn.request(request.method, selector, request.body,
+                                     headers)
+            resp = conn.get_response(stream_id)
+        except socket.timeout, exc:
+            self._drop(conn)
+            raise ReadTimeout(exc, request=request)
+        except (socket.error, HTTP20Error), exc:
+            self._drop(conn)
+            raise ConnectionError(exc, request=request)
+        elapsed = monotonic_ns() - start
+
+        response = self.build_response(request, resp)
+        response.loads_timing = connect, 0, max(elapsed - connect, 0)
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        for pool in self.pools.values():
+            for conn in pool:
+                conn.close()
+        self.pools.clear()
+
+
+class HTTP2Strategy(ConnectionStrategy):
+    """All the test cases of the process share *pool_size* HTTP/2
+    connections per host. *max_requests* is not supported: a connection
+    can't be closed while other streams use it.
+    """
+    name = 'http2'
+
+    def __init__(self, *args, **kwargs):
+        super(HTTP2Strategy, self).__init__(*args, **kwargs)
+        self._adapter = None
+
+    def get_adapter(self):
+        if self._adapter is None:
+            self._adapter = HTTP2Adapter(self.stats, size=self.pool_size)
+        return self._adapter
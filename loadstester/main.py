@@ -10,9 +10,29 @@ def main(sysargs=sys.argv):
     parser = argparse.ArgumentParser(description='Runs a load test.')
     parser.add_argument('options', help='Running options', type=str,
                         default='', nargs='?')
+    parser.add_argument('--serve', metavar='SOCKET', default=None,
+                        help='Run as a warm worker on this Unix socket')
+    parser.add_argument('--preload', default=None,
+                        help='Comma-separated modules the warm worker '
+                             'imports when it starts')
+    parser.add_argument('--connect', metavar='SOCKET', default=None,
+                        help='Run the test on the warm worker listening on '
+                             'this Unix socket')
 
     args = parser.parse_args(sysargs[1:])
 
+    if args.serve:
+        from loadstester.server import WarmServer, DEFAULT_PRELOAD
+        preload = list(DEFAULT_PRELOAD)
+        if args.preload:
+            preload.extend([name.strip() for name in args.preload.split(',')
+                            if name.strip()])
+        server = WarmServer(args.serve, preload=preload)
+        for timing in server.import_profile:
+            sys.stderr.write('%(self).4fs %(total).4fs %(module)s\n' %
+                             timing)
+        return server.serve_forever()
+
     if not args.options:
         options = {}
     else:
@@ -22,5 +42,9 @@ def main(sysargs=sys.argv):
             print('Could not load options')
             raise
 
+    if args.connect:
+        from loadstester.server import run_remote
+        return run_remote(args.connect, options)
+
     # XXX todo - control the options
     return Runner(options).execute()
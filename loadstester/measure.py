@@ -1,4 +1,3 @@
-import datetime
 import urlparse
 
 from requests.sessions import Session as _Session
@@ -6,7 +5,8 @@ from webtest.app import TestApp as _TestApp
 from wsgiproxy.proxies import HostProxy as _HostProxy
 from wsgiproxy.requests_client import HttpClient
 
-from loadstester.util import dns_resolve
+from loadstester.records import Hit
+from loadstester.util import get_resolver, monotonic_ns, wall_ns
 
 
 class TestApp(_TestApp):
@@ -61,18 +61,28 @@ class HostProxy(_HostProxy):
 class Session(_Session):
     """Extends Requests' Session object in order to send information to the
     test_result.
+
+    Each hit is timed with a monotonic clock, and broken down in phases:
+    DNS resolution, TCP connection, TLS handshake, time to the first byte
+    of the response and body download.
     """
 
-    def __init__(self, test, test_result, dns_resolve=True):
+    def __init__(self, test, test_result, dns_resolve=True, resolver=None):
         _Session.__init__(self)
         self.test = test
         self.test_result = test_result
         self.loads_status = None, None, None, None
         self.dns_resolve = dns_resolve
+        if resolver is None:
+            resolver = get_resolver()
+        self.resolver = resolver
+        self._dns_ns = 0
 
     def request(self, method, url, headers=None, **kwargs):
         if not url.startswith('https://') and self.dns_resolve:
-            url, original, resolved = dns_resolve(url)
+            start = monotonic_ns()
+            url, original, resolved = self.resolver.resolve(url)
+            self._dns_ns = monotonic_ns() - start
             if headers is None:
                 headers = {}
             headers['Host'] = original
@@ -83,11 +93,32 @@ class Session(_Session):
         """Do the actual request from within the session, doing some
         measures at the same time about the request (duration, status, etc).
         """
+        # the body is read here, to time its download apart.
+        stream = kwargs.get('stream', False)
+        kwargs['stream'] = True
+        dns, self._dns_ns = self._dns_ns, 0
+
+        started = wall_ns()
+        start = monotonic_ns()
+        if self.test_result is not None:
+            self.test_result.request_started()
+        try:
+            res = _Session.send(self, request, **kwargs)
+            headers = monotonic_ns()
+            if not stream:
+                res.content
+            end = monotonic_ns()
+        finally:
+            if self.test_result is not None:
+                self.test_result.request_finished()
+
         # attach some information to the request object for later use.
-        start = datetime.datetime.utcnow()
-        res = _Session.send(self, request, **kwargs)
-        res.started = start
+        connect, tls, ttfb = getattr(res, 'loads_timing',
+                                     (0, 0, headers - start))
+        res.started = started
         res.method = request.method
+        res.loads_elapsed = end - start
+        res.loads_phases = [dns, connect, tls, ttfb, end - headers]
         self._analyse_request(res)
         return res
 
@@ -98,9 +129,6 @@ class Session(_Session):
         :param req: the request to analyse.
         """
         if self.test_result is not None:
-            self.test_result.add_hit(elapsed=req.elapsed,
-                                     started=req.started,
-                                     status=req.status_code,
-                                     url=req.url,
-                                     method=req.method,
-                                     loads_status=self.loads_status)
+            self.test_result.add_hit_record(
+                Hit(req.started, req.loads_elapsed, req.status_code, req.url,
+                    req.method, req.loads_phases, self.loads_status))
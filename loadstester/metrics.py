@@ -0,0 +1,166 @@
+"""Live metrics of a run, served in the Prometheus text format.
+
+With the *metrics_port* option, the runner serves on
+``http://<metrics_host>:<metrics_port>/metrics``:
+
+- ``loads_hits_total``, ``loads_hit_errors_total``: the hits, and the ones
+  without a status or with a status >= 400.
+- ``loads_tests_total{result=...}``: the successes, errors and failures.
+- ``loads_requests_per_second``, ``loads_error_ratio`` and
+  ``loads_latency_seconds{quantile=...}``: over the last *metrics_window*
+  seconds, 10 by default.
+- ``loads_requests_in_flight`` and ``loads_active_users``.
+- ``process_cpu_seconds_total``, ``process_max_resident_memory_bytes`` and
+  ``python_gc_objects_pending{generation=...}``: the runner's own load.
+
+The hits are counted as they are recorded, in histograms of one second
+each. The refresh tick of the runner rotates them and renders the page,
+so serving it costs nothing to the users. With several processes, each
+worker serves its own metrics on *metrics_port* plus its index.
+"""
+import gc
+import os
+import resource
+import socket
+
+from gevent import monkey
+
+from loadstester.results import _elapsed_us
+from loadstester.stats import RollingHistogram
+
+
+# the server is a real thread, with the original sockets, so it answers
+# even when the users keep the gevent hub busy
+_start_thread = monkey.get_original('thread', 'start_new_thread')
+_socket = monkey.get_original('socket', 'socket')
+_select = monkey.get_original('select', 'select')
+
+_TESTS = {'addSuccess': 'success', 'addError': 'error',
+          'addFailure': 'failure'}
+
+
+class LiveMetrics(object):
+    """Keeps the live metrics of the *runner*, see the module documentation.
+    """
+    quantiles = (50, 90, 95, 99)
+
+    def __init__(self, runner, window=10):
+        self.runner = runner
+        self.hits = self.errors = 0
+        self.tests = dict([(name, 0) for name in _TESTS.values()])
+        self.rolling = RollingHistogram(window)
+        self.text = ''
+        self.port = None
+        self._running = False
+
+    def add_hit(self, hit):
+        error = hit.status is None or hit.status >= 400
+        self.rolling.add(_elapsed_us(hit.elapsed), error)
+        self.hits += 1
+        if error:
+            self.errors += 1
+
+    def add_event(self, action):
+        result = _TESTS.get(action)
+        if result is not None:
+            self.tests[result] += 1
+
+    def refresh(self, run_id=None):
+        self.rolling.tick()
+        self.text = self.render()
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, value, labels=None):
+            if kind is not None:
+                lines.append('# TYPE %s %s' % (name, kind))
+            if labels:
+                name += '{%s}' % ','.join(['%s="%s"' % label
+                                           for label in labels])
+            lines.append('%s %s' % (name, _format(value)))
+
+        rolling = self.rolling
+        metric('loads_hits_total', 'counter', self.hits)
+        metric('loads_hit_errors_total', 'counter', self.errors)
+        lines.append('# TYPE loads_tests_total counter')
+        for result, count in sorted(self.tests.items()):
+            metric('loads_tests_total', None, count, [('result', result)])
+        metric('loads_requests_per_second', 'gauge', rolling.rate())
+        metric('loads_error_ratio', 'gauge', rolling.error_ratio())
+        lines.append('# TYPE loads_latency_seconds gauge')
+        values = rolling.histogram.percentiles(*self.quantiles)
+        for percent, value in zip(self.quantiles, values):
+            if value is not None:
+                metric('loads_latency_seconds', None, value / 1e6,
+                       [('quantile', '%g' % (percent / 100.))])
+        metric('loads_requests_in_flight', 'gauge',
+               self.runner.test_result.in_flight)
+        metric('loads_active_users', 'gauge', self.runner.active_users)
+
+        cpu = os.times()
+        metric('process_cpu_seconds_total', 'counter', cpu[0] + cpu[1])
+        # ru_maxrss is in kilobytes on Linux
+        metric('process_max_resident_memory_bytes', 'gauge',
+               resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        lines.append('# TYPE python_gc_objects_pending gauge')
+        for generation, count in enumerate(gc.get_count()):
+            metric('python_gc_objects_pending', None, count,
+                   [('generation', generation)])
+        return '\n'.join(lines) + '\n'
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serves the metrics, and returns the port they're served on."""
+        self.text = self.render()
+        sock = _socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(16)
+        self._running = True
+        _start_thread(self._serve, (sock,))
+        self.port = sock.getsockname()[1]
+        return self.port
+
+    def _serve(self, sock):
+        try:
+            while self._running:
+                if not _select([sock], [], [], .1)[0]:
+                    continue
+                conn = sock.accept()[0]
+                try:
+                    self._answer(conn)
+                except socket.error:
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            sock.close()
+
+    def _answer(self, conn):
+        conn.settimeout(1)
+        request = ''
+        while '\r\n\r\n' not in request and '\n\n' not in request:
+            data = conn.recv(4096)
+            if not data:
+                return
+            request += data
+            if len(request) > 65536:
+                return
+        path = (request.split(' ') + ['', ''])[1]
+        if path.split('?')[0] in ('/', '/metrics'):
+            status, body = '200 OK', self.text
+        else:
+            status, body = '404 Not Found', 'Not Found\n'
+        conn.sendall('HTTP/1.0 %s\r\n'
+                     'Content-Type: text/plain; version=0.0.4\r\n'
+                     'Content-Length: %d\r\n\r\n%s' % (status, len(body),
+                                                       body))
+
+    def stop(self):
+        self._running = False
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,171 @@
+"""A sampling profiler of the runner itself, with the *profile* option.
+
+When a run plateaus, it tells if the time goes to the target or to the
+runner: the streamers, the DNS resolution, the test cases... A thread
+samples the stacks of the process every *profile_interval* ms, 5 by
+default, and counts them. Their first frame is ``hub`` for the gevent
+loop, ``greenlet`` for the users and the others, or ``thread`` for the
+native threads, like the ones of the ``threads`` engine.
+
+It also watches the greenlet switches: a greenlet running for more than
+*profile_block* ms, 100 by default, blocks the loop and all the other
+users. The stacks blocking it are counted, and logged at the end of the
+run.
+
+At the end of the run the samples are written in *profile*, and the
+blocking stacks weighted by the milliseconds they blocked in *profile*
+``.blocking``, both in the collapsed format of the flamegraph tools. With
+several processes, each one writes its files with its index appended to
+the path.
+"""
+import sys
+
+import greenlet
+from gevent import monkey
+from gevent.hub import get_hub
+
+from loadstester.util import logger
+
+
+# the sampler is a real thread, which runs while a greenlet blocks the loop
+_start_thread = monkey.get_original('thread', 'start_new_thread')
+_get_ident = monkey.get_original('thread', 'get_ident')
+_sleep = monkey.get_original('time', 'sleep')
+_time = monkey.get_original('time', 'time')
+
+MAX_DEPTH = 100
+
+
+def _frame_name(code, module):
+    return '%s:%s' % (module, code.co_name)
+
+
+class SamplingProfiler(object):
+    """Samples the stacks every *interval* seconds, and the greenlets
+    running for more than *block_threshold* seconds.
+    """
+    def __init__(self, interval=.005, block_threshold=.1):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.samples = {}
+        self.blocks = {}
+        self.nb_samples = self.nb_blocks = 0
+        self._names = {}
+        self._running = False
+        self._stopped = True
+        self._main = None
+        self._hub = None
+        self._old_trace = None
+        # the greenlet running, since when, and the stack it blocks on
+        self._current = None
+        self._switched = 0
+        self._blocking = None
+
+    def start(self):
+        self._main = _get_ident()
+        self._hub = get_hub()
+        self._current = greenlet.getcurrent()
+        self._switched = _time()
+        self._old_trace = greenlet.settrace(self._trace)
+        self._running = True
+        self._stopped = False
+        _start_thread(self._sample, ())
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        greenlet.settrace(self._old_trace)
+        while not self._stopped:
+            _sleep(self.interval)
+        if self._blocking is not None:
+            self._add_block(self._blocking, _time() - self._switched)
+            self._blocking = None
+
+        worst = sorted(self.blocks.items(), key=lambda item: -item[1][1])
+        for stack, (count, ms) in worst[:10]:
+            logger.warning('%d blocks of the loop for %dms in %s' %
+                           (count, ms, self._format(stack[-3:])))
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            now = _time()
+            blocking = self._blocking
+            if blocking is not None:
+                self._blocking = None
+                self._add_block(blocking, now - self._switched)
+            self._current = args[1]
+            self._switched = now
+        if self._old_trace is not None:
+            self._old_trace(event, args)
+
+    def _add_block(self, stack, elapsed):
+        # called in the trace function: no logging, it could switch
+        count, ms = self.blocks.get(stack, (0, 0))
+        self.blocks[stack] = count + 1, ms + int(elapsed * 1000)
+        self.nb_blocks += 1
+
+    def _stack(self, frame, label):
+        """Returns the stack of *frame* as a tuple of names, from its root.
+        """
+        stack = []
+        names = self._names
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            name = names.get(code)
+            if name is None:
+                module = frame.f_globals.get('__name__', '?')
+                name = names[code] = _frame_name(code, module)
+            stack.append(name)
+            frame = frame.f_back
+        stack.append(label)
+        stack.reverse()
+        return tuple(stack)
+
+    def _label(self, ident):
+        if ident != self._main:
+            return 'thread'
+        if self._current is self._hub:
+            return 'hub'
+        return 'greenlet'
+
+    def _sample(self):
+        me = _get_ident()
+        try:
+            while self._running:
+                _sleep(self.interval)
+                self.sample(me)
+        finally:
+            self._stopped = True
+
+    def sample(self, ignored=None):
+        """Counts the current stack of each thread, but *ignored*."""
+        current, switched = self._current, self._switched
+        for ident, frame in sys._current_frames().items():
+            if ident == ignored:
+                continue
+            stack = self._stack(frame, self._label(ident))
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+            self.nb_samples += 1
+
+            if (ident == self._main and current is not self._hub and
+                    self._blocking is None and switched == self._switched and
+                    _time() - switched > self.block_threshold):
+                self._blocking = stack
+
+    def _format(self, stack):
+        return ';'.join(stack)
+
+    def write(self, path):
+        """Writes the samples in *path* and the blocking stacks in *path*
+        ``.blocking``, in the collapsed stacks format.
+        """
+        blocks = dict([(stack, ms) for stack, (count, ms)
+                       in self.blocks.items()])
+        for filename, stacks in ((path, self.samples),
+                                 (path + '.blocking', blocks)):
+            with open(filename, 'w') as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write('%s %d\n' % (self._format(stack), count))
+        logger.info('%d samples written in %s, %d blocks of the loop' %
+                    (self.nb_samples, path, self.nb_blocks))
@@ -0,0 +1,189 @@
+"""Compact records of the status of the users and of their hits.
+
+Both are slotted classes instead of dicts, so the millions of them created
+in a long run cost less memory and allocations. Their times are integer
+nanoseconds. They are only turned into dicts, dates and seconds by the
+streamers, when they are written.
+"""
+import time
+
+
+class LoadsStatus(object):
+    """The status of a user, sent with each of its events.
+
+    It's used like the dict it replaces: ``status['current_hit'] += 1``.
+    The *lag* and *scenario* fields are only given when set, and the keys
+    it doesn't know are kept in an extra dict.
+    """
+    __slots__ = ('current_hit', 'nb_hits', 'current_user', 'nb_users',
+                 'lag', 'scenario', 'extra')
+
+    _fields = ('current_hit', 'nb_hits', 'current_user', 'nb_users')
+    _optional = ('lag', 'scenario')
+
+    def __init__(self, current_hit=0, nb_hits=0, current_user=0, nb_users=0,
+                 lag=None, scenario=None):
+        self.current_hit = current_hit
+        self.nb_hits = nb_hits
+        self.current_user = current_user
+        self.nb_users = nb_users
+        self.lag = lag
+        self.scenario = scenario
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, data):
+        status = cls()
+        status.update(data)
+        return status
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        if key in self._optional:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._fields or key in self._optional:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = list(self._fields)
+        for key in self._optional:
+            if getattr(self, key) is not None:
+                keys.append(key)
+        if self.extra is not None:
+            keys.extend(self.extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def update(self, other):
+        for key in other.keys():
+            self[key] = other[key]
+
+    def merge_into(self, data):
+        """Sets the fields of the status in the *data* dict."""
+        data['current_hit'] = self.current_hit
+        data['nb_hits'] = self.nb_hits
+        data['current_user'] = self.current_user
+        data['nb_users'] = self.nb_users
+        if self.lag is not None:
+            data['lag'] = self.lag
+        if self.scenario is not None:
+            data['scenario'] = self.scenario
+        if self.extra is not None:
+            data.update(self.extra)
+        return data
+
+    def as_dict(self):
+        return self.merge_into({})
+
+    def copy(self):
+        status = LoadsStatus(self.current_hit, self.nb_hits,
+                             self.current_user, self.nb_users, self.lag,
+                             self.scenario)
+        if self.extra is not None:
+            status.extra = dict(self.extra)
+        return status
+
+    def __eq__(self, other):
+        if isinstance(other, (LoadsStatus, dict)):
+            return self.as_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return '<LoadsStatus %r>' % self.as_dict()
+
+
+def merge_status(status, data):
+    """Sets the fields of *status*, a :class:`LoadsStatus`, a dict or None,
+    in the *data* dict.
+    """
+    if isinstance(status, LoadsStatus):
+        status.merge_into(data)
+    elif status is not None:
+        data.update(status)
+    return data
+
+
+class Hit(object):
+    """A request made by a test.
+
+    *started* is the wall clock time it started at, and *elapsed* its
+    duration, in nanoseconds. *phases* gives the nanoseconds spent in DNS
+    resolution, connection, TLS handshake, waiting for the first byte and
+    reading the body. *time* is when it was recorded, in seconds since the
+    epoch, and *weight* the number of hits it stands for when sampled.
+    """
+    __slots__ = ('started', 'elapsed', 'status', 'url', 'method', 'phases',
+                 'loads_status', 'time', 'weight')
+
+    def __init__(self, started, elapsed, status, url, method, phases=None,
+                 loads_status=None, weight=None):
+        self.started = started
+        self.elapsed = elapsed
+        self.status = status
+        self.url = url
+        self.method = method
+        self.phases = phases
+        self.loads_status = loads_status
+        self.time = None
+        self.weight = weight
+
+    def as_dict(self):
+        """Returns the fields of the hit event, as pushed to the streamers.
+        """
+        status = self.loads_status
+        if isinstance(status, LoadsStatus):
+            status = status.as_dict()
+        data = {'started': self.started, 'elapsed': self.elapsed,
+                'status': self.status, 'url': self.url,
+                'method': self.method, 'loads_status': status}
+        if self.phases is not None:
+            data['phases'] = self.phases
+        if self.time is not None:
+            data['time'] = self.time
+        if self.weight is not None:
+            data['weight'] = self.weight
+        return data
+
+    def stamp(self):
+        """Records the time the hit is streamed at."""
+        self.time = time.time()
+        return self
@@ -0,0 +1,171 @@
+"""Replay of recorded traffic.
+
+With the *replay* option, the users do not run a test method over and over
+but send the requests recorded in a JSON lines file, gzipped or not. Each
+line is one request::
+
+    {"method": "POST", "url": "/basket", "headers": {"Cookie": "id=f1a3"},
+     "body": "item=42", "time": 1380000001.25, "session": "f1a3"}
+
+Only the *url* is required, and the relative ones are sent to the
+*server_url*.
+
+The file is read lazily, by a reader that hands the records to the users
+through small queues. The requests of a *session* all go to the same user,
+so each user replays whole sessions, in order. The requests without a
+session are dealt to the users in turn.
+
+The requests are sent at their recorded *time*, the intervals divided by
+the *replay_speed*: 2 replays twice as fast. With a speed of 0, or without
+times, they are sent as fast as the users can. The delay of each request
+on its recorded time is given in its loads status as *lag*.
+
+To change the requests before they're sent, like to add a token, subclass
+:class:`ReplayCase` and give its *test_replay* method as the *fqn*.
+"""
+import gzip
+import json
+import time
+import zlib
+
+import gevent
+from gevent.queue import Queue, Full
+
+from loadstester.case import TestCase
+
+
+REPLAY_FQN = 'loadstester.replay.ReplayCase.test_replay'
+
+_GZIP_MAGIC = '\x1f\x8b'
+
+
+def read_records(path):
+    """Yields the requests recorded in the file at *path*, one at a time."""
+    with open(path, 'rb') as f:
+        gzipped = f.read(2) == _GZIP_MAGIC
+    if gzipped:
+        records = gzip.open(path, 'rb')
+    else:
+        records = open(path, 'rb')
+    try:
+        for lineno, line in enumerate(records):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ValueError('Invalid record at %s:%d' %
+                                 (path, lineno + 1))
+            if not isinstance(record, dict) or 'url' not in record:
+                raise ValueError('No url in the record at %s:%d' %
+                                 (path, lineno + 1))
+            yield record
+    finally:
+        records.close()
+
+
+def shard(record, index, nb_users):
+    """Returns the user, counted from 0, replaying the *index* th record.
+
+    The users of a session are picked with a CRC of its id, so all the
+    processes of a run agree on them.
+    """
+    session = record.get('session')
+    if session is None:
+        return index % nb_users
+    if isinstance(session, unicode):
+        session = session.encode('utf8')
+    return (zlib.crc32(str(session)) & 0xffffffff) % nb_users
+
+
+class Replayer(object):
+    """Reads the records of *path* and puts them in the queues of the
+    *users*, the ones of this process out of *nb_users*.
+
+    Each queue holds at most *queue_size* records: the reader waits for
+    the users instead of loading the file in memory.
+    """
+    def __init__(self, path, users, nb_users, speed=1., queue_size=100):
+        self.path = path
+        self.nb_users = nb_users
+        self.speed = speed
+        self.queues = dict([(user, Queue(queue_size)) for user in users])
+        self.records = 0
+
+    def _put(self, queue, item, stopped):
+        while True:
+            try:
+                queue.put(item, timeout=.1)
+                return True
+            except Full:
+                if stopped():
+                    return False
+
+    def run(self, deadline=None, stopped=lambda: False):
+        """Dispatches the records, each one at its time, until the end of
+        the file, the *deadline* or *stopped* returns True.
+        """
+        start = time.time()
+        first = None
+        try:
+            for index, record in enumerate(read_records(self.path)):
+                if stopped() or (deadline is not None and
+                                 time.time() >= deadline):
+                    break
+
+                # the first record of the file is the time origin, the
+                # same one in every process
+                recorded = None
+                if self.speed:
+                    recorded = record.get('time')
+                if recorded is not None and first is None:
+                    first = recorded
+
+                queue = self.queues.get(shard(record, index, self.nb_users))
+                if queue is None:
+                    continue
+
+                intended = None
+                if recorded is not None:
+                    intended = start + (recorded - first) / self.speed
+                    delay = intended - time.time()
+                    if deadline is not None:
+                        delay = min(delay, deadline - time.time())
+                    if delay > 0:
+                        gevent.sleep(delay)
+                    if deadline is not None and time.time() >= deadline:
+                        break
+
+                if not self._put(queue, (record, intended), stopped):
+                    break
+                self.records += 1
+        finally:
+            for queue in self.queues.values():
+                self._put(queue, None, stopped)
+
+
+class ReplayCase(TestCase):
+    """Sends the recorded request the runner sets in *replay_record*."""
+
+    replay_record = None
+
+    def test_replay(self):
+        self.replay(self.replay_record)
+
+    def replay(self, record):
+        """Sends the request of *record* with the session of the test."""
+        url = record['url']
+        if '://' not in url:
+            if self.server_url is None:
+                raise ValueError('The recorded url %r is relative, but '
+                                 'there is no server_url' % url)
+            url = self.server_url.rstrip('/') + '/' + url.lstrip('/')
+
+        headers = dict([(str(name), value) for name, value
+                        in (record.get('headers') or {}).items()])
+        body = record.get('body')
+        if isinstance(body, unicode):
+            body = body.encode('utf8')
+        return self.session.request(record.get('method', 'GET').upper(), url,
+                                    headers=headers or None, data=body)
@@ -1,6 +1,20 @@
+import datetime
 import unittest
 import time
 
+from loadstester.records import Hit, LoadsStatus, merge_status
+from loadstester.stats import HitAggregator, HitSampler
+
+
+def _elapsed_us(elapsed):
+    """Converts the elapsed time of a hit, a timedelta or nanoseconds, to
+    microseconds.
+    """
+    if isinstance(elapsed, datetime.timedelta):
+        return ((elapsed.days * 86400 + elapsed.seconds) * 10 ** 6 +
+                elapsed.microseconds)
+    return elapsed // 1000
+
 
 class Results(unittest.TestResult):
     """The Results class does two things:
@@ -8,31 +22,130 @@ class Results(unittest.TestResult):
     - emit the event in a json stream
     - call the usual unittest API so the tests work with Nose or Unittest(2).
 
+    With the *aggregate* option, the hits are not streamed one by one but
+    recorded in latency histograms, streamed as *histogram* events every
+    *snapshot_interval* seconds.
+
+    With the *sample_budget* option, only about that many hits per second
+    are streamed, each one with the *weight* of the hits it stands for.
+    See :class:`loadstester.stats.HitSampler`.
     """
     def __init__(self, streamer=None, args=None):
         self.streamer = streamer
         self.args = args
+        # the objects following the hits and events as they're added, like
+        # the live metrics: they have add_hit and add_event methods
+        self.observers = []
+        self.in_flight = 0
         self.nb_errors = self.nb_failures = 0
         unittest.TestResult.__init__(self)
 
+        if args is None:
+            args = {}
+        if args.get('aggregate'):
+            self.aggregator = HitAggregator()
+        else:
+            self.aggregator = None
+        self.snapshot_interval = args.get('snapshot_interval', 1.)
+        self._next_snapshot = time.time() + self.snapshot_interval
+
+        budget = args.get('sample_budget')
+        if budget and self.aggregator is None:
+            self.sampler = HitSampler(
+                budget, outlier_percentile=args.get('outlier_percentile',
+                                                    99))
+        else:
+            self.sampler = None
+
+    def _test_status(self, test):
+        return test.loads_status
+
     def _stream(self, action, test, kw):
+        for observer in self.observers:
+            observer.add_event(action)
         if not self.streamer:
             return
         data = kw
-        if test is not None and test.loads_status is not None:
-            data.update(test.loads_status)
         data['time'] = time.time()
-        self.streamer.push(action, **data)
+        status = None
+        if test is not None:
+            status = self._test_status(test)
+        push_event = getattr(self.streamer, 'push_event', None)
+        if push_event is not None:
+            push_event(action, status, **data)
+        else:
+            self.streamer.push(action, **merge_status(status, data))
 
     def add_hit(self, **hit):
-        self._stream('hit', None, hit)
+        """Adds a hit. Its *started* and *elapsed* times are given in
+        nanoseconds, *phases* lists the nanoseconds spent in DNS resolution,
+        connection, TLS handshake, waiting for the first byte and reading
+        the body.
+        """
+        self.add_hit_record(Hit(**hit))
+
+    def add_hit_record(self, hit):
+        """Adds a :class:`loadstester.records.Hit`."""
+        for observer in self.observers:
+            observer.add_hit(hit)
+        if self.aggregator is None:
+            if self.sampler is not None:
+                weight = self.sampler.sample(hit.status,
+                                             _elapsed_us(hit.elapsed),
+                                             time.time())
+                if not weight:
+                    return
+                hit.weight = weight
+            if not self.streamer:
+                return
+            push_hit = getattr(self.streamer, 'push_hit', None)
+            if push_hit is not None:
+                push_hit(hit.stamp())
+            else:
+                self.streamer.push('hit', **hit.stamp().as_dict())
+            return
+
+        status = hit.loads_status
+        if isinstance(status, (dict, LoadsStatus)):
+            scenario = status.get('scenario')
+        else:
+            scenario = None
+        self.aggregator.add(hit.method, hit.url, hit.status,
+                            _elapsed_us(hit.elapsed), scenario)
+        self.refresh()
+
+    def request_started(self):
+        """Counts a request in flight, until :meth:`request_finished`."""
+        self.in_flight += 1
+
+    def request_finished(self):
+        self.in_flight -= 1
+
+    def refresh(self, force=False):
+        """Streams the histogram snapshots if the interval is over."""
+        if self.aggregator is None:
+            return
+        now = time.time()
+        if not force and now < self._next_snapshot:
+            return
+        interval = now - self._next_snapshot + self.snapshot_interval
+        self._next_snapshot = now + self.snapshot_interval
+        for snapshot in self.aggregator.snapshot():
+            snapshot['interval'] = interval
+            self._stream('histogram', None, snapshot)
 
     def startTestRun(self, agent_id, *args, **kw):
         kw['agent_id'] = agent_id
         self._stream('startTestRun', None, kw)
 
     def stopTestRun(self, agent_id, *args, **kw):
+        self.refresh(force=True)
         kw['agent_id'] = agent_id
+        dropped = getattr(self.streamer, 'dropped', None)
+        if dropped is not None:
+            kw['dropped_events'] = dropped
+        if self.sampler is not None:
+            kw['sampled_out_hits'] = self.sampler.dropped
         self._stream('stopTestRun', None, kw)
 
     def startTest(self, test, *args, **kw):
@@ -59,3 +172,133 @@ class Results(unittest.TestResult):
 
     def incr_counter(self, test, *args, **kw):
         self._stream('incr', test, kw)
+
+    def add_connection_stats(self, **stats):
+        self._stream('connections', None, stats)
+
+    def add_threshold_results(self, results):
+        """Streams the results of the thresholds of the run."""
+        self._stream('thresholds', None, {'thresholds': results})
+
+    def add_capacity_report(self, report):
+        """Streams the report of a capacity search."""
+        self._stream('capacity', None, report)
+
+    def add_error_summary(self):
+        """Streams the summary of the errors, for the runs without a
+        stopTestRun event. Only :class:`LoadResults` has one.
+        """
+
+    def merge_error_summary(self, summary):
+        """Adds the errors of another summary to the one of the run."""
+
+    def add_queue_stats(self):
+        """Streams the number of events the streamer dropped, if it can."""
+        dropped = getattr(self.streamer, 'dropped', None)
+        if dropped is not None:
+            self._stream('queue', None, {'dropped_events': dropped})
+
+    def flush(self):
+        self.refresh(force=True)
+        if self.streamer:
+            self.streamer.flush()
+
+
+class LoadResults(Results):
+    """A Results class for long load runs, whose memory stays bounded.
+
+    - the errors and failures are deduplicated by exception type and the
+      place where they were raised. Each of them is counted, but only the
+      tracebacks of its first *max_samples* occurrences are kept in the
+      usual unittest *errors* and *failures* lists. Past *max_signatures*
+      different ones, the others are only counted.
+    - the loads status of a test is copied once when it starts, and that
+      copy is used for all its events.
+
+    The deduplicated errors are sent in the stopTestRun event or, in the
+    runs managed externally like the worker processes, in an
+    ``error_summary`` event. The parent of the workers merges theirs in
+    its stopTestRun event.
+    """
+    def __init__(self, streamer=None, args=None, max_samples=3,
+                 max_signatures=100):
+        super(LoadResults, self).__init__(streamer=streamer, args=args)
+        self.max_samples = max_samples
+        self.max_signatures = max_signatures
+        self.error_summary = {}
+
+    def _test_status(self, test):
+        snapshot = getattr(test, 'loads_snapshot', None)
+        if snapshot is not None:
+            return snapshot
+        return test.loads_status
+
+    def _keep_sample(self, kind, exc_info):
+        """Counts the error, and tells if its traceback should be kept."""
+        exc_type, exc, tb = exc_info
+        filename = lineno = None
+        if tb is not None:
+            while tb.tb_next is not None:
+                tb = tb.tb_next
+            filename, lineno = tb.tb_frame.f_code.co_filename, tb.tb_lineno
+        name = getattr(exc_type, '__name__', str(exc_type))
+        key = kind, name, filename, lineno
+
+        overflow = (key not in self.error_summary and
+                    len(self.error_summary) >= self.max_signatures)
+        if overflow:
+            key = kind, None, None, None
+        count = self.error_summary.get(key, 0)
+        self.error_summary[key] = count + 1
+        return not overflow and count < self.max_samples
+
+    def get_error_summary(self):
+        return [{'kind': kind, 'type': type_, 'filename': filename,
+                 'lineno': lineno, 'count': count}
+                for (kind, type_, filename, lineno), count
+                in self.error_summary.items()]
+
+    def stopTestRun(self, agent_id, *args, **kw):
+        kw['error_summary'] = self.get_error_summary()
+        super(LoadResults, self).stopTestRun(agent_id, *args, **kw)
+
+    def add_error_summary(self):
+        self._stream('error_summary', None,
+                     {'error_summary': self.get_error_summary()})
+
+    def merge_error_summary(self, summary):
+        for error in summary:
+            key = (error['kind'], error['type'], error['filename'],
+                   error['lineno'])
+            if (key not in self.error_summary and
+                    len(self.error_summary) >= self.max_signatures):
+                key = error['kind'], None, None, None
+            self.error_summary[key] = (self.error_summary.get(key, 0) +
+                                       error['count'])
+
+    def startTest(self, test, *args, **kw):
+        self.testsRun += 1
+        status = getattr(test, 'loads_status', None)
+        if isinstance(status, LoadsStatus):
+            test.loads_snapshot = status.copy()
+        elif status is not None:
+            test.loads_snapshot = LoadsStatus.from_dict(status)
+        self._stream('startTest', test, kw)
+
+    def stopTest(self, test, *args, **kw):
+        self._stream('stopTest', test, kw)
+
+    def addError(self, test, exc_info, *args, **kw):
+        if self._keep_sample('error', exc_info):
+            unittest.TestResult.addError(self, test, exc_info)
+        self._stream('addError', test, kw)
+        self.nb_errors += 1
+
+    def addFailure(self, test, exc_info, *args, **kw):
+        if self._keep_sample('failure', exc_info):
+            unittest.TestResult.addFailure(self, test, exc_info)
+        self._stream('addFailure', test, kw)
+        self.nb_failures += 1
+
+    def addSuccess(self, test, *args, **kw):
+        self._stream('addSuccess', test, kw)
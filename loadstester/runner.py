@@ -1,14 +1,37 @@
+import heapq
+import multiprocessing
 import os
-import subprocess
+import select
+import signal
 import sys
+import threading
+import time
 
 import gevent
+from gevent.pool import Pool
+from gevent.queue import Empty
 
-from loadstester.util import (resolve_name, logger, pack_include_files,
-                              unpack_include_files)
-from loadstester.results import Results
+from loadstester.util import (resolve_name, logger, sync_include_files,
+                              user_cache_dir, ImportProfile)
+from loadstester.results import Results, LoadResults
+from loadstester.capacity import (CapacitySearch, CapacityProbe, DEFAULT_SLO,
+                                  report)
 from loadstester.case import TestCase
-from loadstester.streamer import StdoutStreamer
+from loadstester.connections import get_strategy, reset_strategies
+from loadstester.deps import DepsCache, parse_deps
+from loadstester.engines import get_engine
+from loadstester.metrics import LiveMetrics
+from loadstester.profiler import SamplingProfiler
+from loadstester.records import LoadsStatus
+from loadstester.replay import Replayer, REPLAY_FQN
+from loadstester.scenarios import (parse_scenarios, allocate_users,
+                                   assign_users, arrival_picker)
+from loadstester.streamer import get_streamer, STREAMERS
+from loadstester.thresholds import (parse_thresholds, ThresholdMonitor,
+                                    describe, merge_results)
+from loadstester.sinks import QueuedStreamer, get_sink
+from loadstester.schedule import (parse_rate_profile, RateProfile,
+                                  parse_user_profile, ramp_profile)
 
 
 DEFAULT_LOGFILE = os.path.join('/tmp', 'loads-worker.log')
@@ -51,6 +74,169 @@ def _compute_arguments(args):
     return total, hits, duration, users, agents
 
 
+def _compute_rate_profile(args):
+    """Builds the RateProfile of an open-model run from the *rate_profile*
+    option, or from the *rate* and *duration* ones.
+
+    Returns None for the usual closed-model runs.
+    """
+    profile = args.get('rate_profile')
+    if profile is None:
+        rate = args.get('rate')
+        if rate is None:
+            return None
+        if args.get('duration') is None:
+            raise ValueError('A duration is needed to run at a fixed rate')
+        profile = [[args['duration'], rate]]
+    return RateProfile(parse_rate_profile(profile))
+
+
+def _compute_user_profile(args, users, duration):
+    """Builds the users profile from the *user_profile* option, or from the
+    *ramp* one, applied to each level of :param users:.
+
+    Returns None when the users groups are run one after the other.
+    """
+    profile = args.get('user_profile')
+    if profile is not None:
+        return parse_user_profile(profile)
+    ramp = args.get('ramp')
+    if ramp is None:
+        return None
+    if duration is None:
+        raise ValueError('A duration is needed to hold each users level')
+    return ramp_profile(users, ramp, duration)
+
+
+def _split_users(users, processes):
+    """Shards each group of :param users: across :param processes:.
+
+    Returns, for each process, the list of (offset, users) it runs for
+    each group. The offset is the number of users of that group run by
+    the previous processes.
+    """
+    shards = [[] for i in range(processes)]
+    for user in users:
+        offset = 0
+        for index, shard in enumerate(shards):
+            count = user // processes + (index < user % processes and 1 or 0)
+            shard.append((offset, count))
+            offset += count
+    return shards
+
+
+class _User(object):
+    """A virtual user of a users profile run."""
+
+    def __init__(self, index, test, scenario=None):
+        self.index = index
+        self.test = test
+        self.scenario = scenario
+        self.stopped = False
+        self.greenlet = None
+
+
+class _UserPool(object):
+    """The virtual users of a users profile run.
+
+    Each user loops over the test until it's removed, when it finishes its
+    current hit. Its test case, and with it the session and connection
+    pool, is kept and given to the next user added to the same scenario.
+
+    With scenarios, the users are shared among them at each resize.
+    """
+    def __init__(self, runner):
+        self.runner = runner
+        self.active = []
+        self.idle = {}
+        self.greenlets = []
+        self._next_index = 0
+        self._free_indexes = []
+
+    def __len__(self):
+        return len(self.active)
+
+    def _targets(self, size):
+        scenarios = self.runner.scenarios
+        if scenarios is None:
+            return [(None, size)]
+        return zip(scenarios, allocate_users(scenarios, size))
+
+    def _new_index(self):
+        if self._free_indexes:
+            return heapq.heappop(self._free_indexes)
+        self._next_index += 1
+        return self._next_index - 1
+
+    def release(self, user):
+        """Keeps the test of a stopped user for the next ones."""
+        self.idle.setdefault(user.scenario, []).append(user.test)
+
+    def resize(self, size):
+        for scenario, target in self._targets(size):
+            users = [user for user in self.active
+                     if user.scenario is scenario]
+            idle = self.idle.get(scenario)
+
+            for i in range(len(users), target):
+                if idle:
+                    test = idle.pop()
+                else:
+                    test = self.runner._new_test(scenario)
+                user = _User(self._new_index(), test, scenario)
+                user.greenlet = gevent.spawn(self.runner._active,
+                                             self.runner._run_user, user,
+                                             self)
+                self.active.append(user)
+                self.greenlets.append(user.greenlet)
+
+            for user in reversed(users[target:]):
+                user.stopped = True
+                self.active.remove(user)
+                heapq.heappush(self._free_indexes, user.index)
+
+        self.greenlets = [greenlet for greenlet in self.greenlets
+                          if not greenlet.dead]
+
+    def join(self, timeout=None):
+        gevent.joinall(self.greenlets, timeout=timeout)
+
+
+class _IdleUsers(object):
+    """The users of an arrival rate run waiting for their next test, with
+    their test case, per scenario.
+
+    There are at most *size* users: past it, the user of a scenario without
+    an idle one takes the index of the oldest idle user of another
+    scenario, whose test is dropped.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.tests = {}
+        self._next_index = 0
+        self._free_indexes = []
+
+    def take(self, scenario):
+        """Returns the index of a user of *scenario* and its test, or None
+        when it needs a new one.
+        """
+        tests = self.tests.setdefault(scenario, [])
+        if tests:
+            return tests.pop()
+        if self._next_index >= self.size:
+            for other in self.tests.values():
+                if other:
+                    heapq.heappush(self._free_indexes, other.pop(0)[0])
+                    break
+        if self._free_indexes:
+            return heapq.heappop(self._free_indexes), None
+        self._next_index += 1
+        return self._next_index - 1, None
+
+    def release(self, user, test, scenario):
+        self.tests.setdefault(scenario, []).append((user, test))
+
+
 class Runner(object):
     """Local tests runner.
 
@@ -62,17 +248,63 @@ class Runner(object):
 
     def __init__(self, args):
         self.args = args
-        self.fqn = args.get('fqn',
-                            'loadstester.tests.dummy.TestDummy.test_dummy')
+        self.replay = args.get('replay')
+        if self.replay:
+            default_fqn = REPLAY_FQN
+        else:
+            default_fqn = 'loadstester.tests.dummy.TestDummy.test_dummy'
+        self.fqn = args.get('fqn', default_fqn)
         self.test = None
         self.run_id = None
         self.project_name = args.get('project_name', 'N/A')
         self._test_result = None
         self.outputs = []
         self.stop = False
+        self.failed_processes = 0
+        self.active_users = 0
+        self.thresholds = parse_thresholds(args.get('thresholds'))
+        self.failed_thresholds = []
+        self._active_lock = threading.Lock()
+
+        if args.get('scenarios'):
+            self.scenarios = parse_scenarios(args['scenarios'])
+            if 'users' not in args and not [
+                    scenario for scenario in self.scenarios
+                    if scenario.users is None]:
+                args['users'] = sum([scenario.users
+                                     for scenario in self.scenarios])
+        else:
+            self.scenarios = None
+
+        processes = args.get('processes', 1)
+        if processes in ('auto', 0):
+            processes = multiprocessing.cpu_count()
+        self.processes = int(processes)
 
         (self.total, self.hits,
          self.duration, self.users, self.agents) = _compute_arguments(args)
+        self.user_offsets = [0] * len(self.users)
+        self.group_sizes = list(self.users)
+        self.rate_profile = _compute_rate_profile(args)
+        self.user_profile = _compute_user_profile(args, self.users,
+                                                  self.duration)
+        self.capacity = args.get('capacity')
+        if self.capacity not in (None, 'users', 'rate'):
+            raise ValueError('The capacity search is on users or rate, not '
+                             '%r' % self.capacity)
+        if self.capacity is not None and self.processes > 1:
+            raise ValueError('The capacity search runs in one process')
+        self.capacity_report = None
+        self.pool_size = int(args.get('pool_size', max(self.users)))
+        self.engine = get_engine(args.get('engine', 'gevent'))
+        if self.engine.name != 'gevent' and (
+                self.rate_profile is not None or
+                self.user_profile is not None or self.replay or
+                self.capacity is not None):
+            raise ValueError('The %s engine only runs groups of users' %
+                             self.engine.name)
+        # seconds spent in each startup step, sent with startTestRun
+        self.startup_timing = {}
 
         self.args['hits'] = self.hits
         self.args['users'] = self.users
@@ -80,68 +312,68 @@ class Runner(object):
         self.args['total'] = self.total
 
     def _resolve_name(self):
-        if self.fqn is not None:
-            try:
-                self.test = resolve_name(self.fqn)
-                if not hasattr(self.test, 'im_class'):
-                    raise ValueError("The FQN of the test doesn't point "
-                                     " to a test class (%s)." % self.test)
-            except Exception:
-                self.test = TestCase()
-                raise
+        if self.fqn is not None or self.scenarios is not None:
+            if self.args.get('profile_imports'):
+                with ImportProfile() as profile:
+                    self._resolve_test()
+                self.startup_timing['imports'] = profile.top()
+            else:
+                self._resolve_test()
+
+    def _resolve_test(self):
+        try:
+            if self.scenarios is not None:
+                for scenario in self.scenarios:
+                    scenario.test = self._resolve_fqn(scenario.fqn)
+                self.test = self.scenarios[0].test
+            else:
+                self.test = self._resolve_fqn(self.fqn)
+        except Exception:
+            self.test = TestCase()
+            raise
+
+    def _resolve_fqn(self, fqn):
+        test = resolve_name(fqn)
+        if not hasattr(test, 'im_class'):
+            raise ValueError("The FQN of the test doesn't point "
+                             " to a test class (%s)." % test)
+        return test
 
     @property
     def test_result(self):
         if self._test_result is None:
-            self._test_result = Results(streamer=StdoutStreamer(),
-                                        args=self.args)
+            sinks = self.args.get('sinks')
+            if sinks:
+                streamer = QueuedStreamer(
+                    [get_sink(sink, self.args.get('process_index'))
+                     for sink in sinks],
+                    maxsize=self.args.get('queue_size', 10000),
+                    policy=self.args.get('backpressure', 'block'))
+            else:
+                streamer = get_streamer(self.args.get('streamer', 'json'))
+            if self.args.get('full_results'):
+                klass = Results
+            else:
+                klass = LoadResults
+            self._test_result = self.engine.synchronize(
+                klass(streamer=streamer, args=self.args))
         return self._test_result
 
     def _deploy_python_deps(self, deps=None):
-        # XXX pip hack to avoid uninstall
         # deploy python deps if asked
         deps = deps or self.args.get('python_dep', [])
         if deps == []:
             return
 
         # accepting lists and list of comma-separated values
-        pydeps = []
-        for dep in deps:
-            dep = [d.strip() for d in dep.split(',')]
-            for d in dep:
-                if d == '':
-                    continue
-                pydeps.append(d)
-
-        build_dir = os.path.join(self.args['test_dir'],
-                                 'build-', str(os.getpid()))
-        nil = "lambda *args, **kw: None"
-        code = ["from pip.req import InstallRequirement",
-                "InstallRequirement.uninstall = %s" % nil,
-                "InstallRequirement.commit_uninstall = %s" % nil,
-                "import pip", "pip.main()"]
-
-        cmd = [sys.executable, '-c', '"%s"' % ';'.join(code),
-               'install', '-t', 'deps', '-I', '-b', build_dir]
-
-        for dep in pydeps:
-            logger.debug('Deploying %r in %r' % (dep, os.getcwd()))
-            process = subprocess.Popen(' '.join(cmd + [dep]), shell=True,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE)
-            stdout, stderr = process.communicate()
-
-            # XXX see https://github.com/mozilla-services/loads/issues/253
-            if 'Successfully installed' not in stdout:
-                logger.debug('Failed to deploy %r' % dep)
-                logger.debug('Error: %s' % str(stderr))
-                logger.debug('Stdout: %s' % str(stdout))
-                logger.debug("Command used: %s" % str(' '.join(cmd + [dep])))
-                raise Exception(stderr)
-            else:
-                logger.debug('Successfully deployed %r' % dep)
+        pydeps = parse_deps(deps)
+        if not pydeps:
+            return
 
-        sys.path.insert(0, 'deps')
+        cache = DepsCache(self.args.get('deps_cache'))
+        paths, warm = cache.get(pydeps)
+        self.startup_timing['deps_cache'] = warm and 'warm' or 'cold'
+        sys.path[:0] = paths
 
     def _func2test(self, test):
         # creating the test case instance
@@ -151,13 +383,20 @@ class Runner(object):
                              test_result=self.test_result,
                              config=self.args)
 
+    def _new_test(self, scenario=None):
+        """Creates a test case instance, of a scenario if given."""
+        if scenario is None:
+            return self._func2test(self.test)
+        return self._func2test(scenario.test)
+
     def execute(self):
         """The method to start the load runner."""
         old_location = os.getcwd()
         self.running = True
         try:
             self._execute()
-            if self.test_result.nb_errors + self.test_result.nb_failures:
+            if (self.test_result.nb_errors + self.test_result.nb_failures or
+                    self.failed_processes or self.failed_thresholds):
                 return 1
         except Exception:
             test = self._func2test(self.test)
@@ -168,17 +407,28 @@ class Runner(object):
             os.chdir(old_location)
 
     def _status(self, current_hit=0, nb_hits=0, current_user=0, nb_users=0):
-        return {'current_hit': current_hit,
-                'current_user': current_user,
-                'nb_users': nb_users,
-                'nb_hits': nb_hits}
+        return LoadsStatus(current_hit=current_hit, nb_hits=nb_hits,
+                           current_user=current_user, nb_users=nb_users)
+
+    def _active(self, func, *args):
+        """Runs the user *func*, counted in *active_users* meanwhile."""
+        with self._active_lock:
+            self.active_users += 1
+        try:
+            return func(*args)
+        finally:
+            with self._active_lock:
+                self.active_users -= 1
 
-    def _run(self, current_user, nb_users):
+    def _run(self, current_user, nb_users, scenario=None, deadline=None):
         """This method is actually spawned by gevent so there is more than
         one actual test suite running in parallel.
+
+        In duration mode, the user starts hits until the *deadline* of its
+        group, and the one in flight then finishes.
         """
         # creating the test case instance
-        test = self._func2test(self.test)
+        test = self._new_test(scenario)
 
         if self.stop:
             return
@@ -186,33 +436,302 @@ class Runner(object):
         # starting to count at 1 for stats purposes.
         current_user += 1
 
-        loads_status = self.args.get('loads_status',
-                                     self._status(current_user=current_user,
-                                                  nb_users=nb_users))
+        # each user has its own status, even when given in the options
+        if 'loads_status' in self.args:
+            loads_status = LoadsStatus.from_dict(self.args['loads_status'])
+        else:
+            loads_status = self._status(current_user=current_user,
+                                        nb_users=nb_users)
+        think_time = 0
+        if scenario is not None:
+            loads_status['scenario'] = scenario.name
+            think_time = scenario.think_time
 
         if self.duration is None:
             for nb_hits in self.hits:
-                gevent.sleep(0)
+                self.engine.sleep(0)
                 loads_status['nb_hits'] = nb_hits
 
                 for current_hit in range(nb_hits):
+                    if self.stop:
+                        return
                     loads_status['current_hit'] += 1
                     test(loads_status=loads_status)
-                    gevent.sleep(0)
+                    self.engine.sleep(think_time)
         else:
-            def spawn_test():
-                while True:
-                    loads_status['current_hit'] += 1
-                    loads_status['nb_hits '] = loads_status['current_hit']
-                    test(loads_status=loads_status)
-                    gevent.sleep(0)
+            while not self.stop and time.time() < deadline:
+                loads_status['current_hit'] += 1
+                loads_status['nb_hits'] = loads_status['current_hit']
+                test(loads_status=loads_status)
+                self.engine.sleep(min(think_time,
+                                      max(deadline - time.time(), 0)))
+
+    def _run_group(self, index):
+        """Runs the users of the group at *index* until they're done or,
+        in duration mode, until the deadline of the group.
+
+        Past the deadline, the hits in flight get *grace_period* seconds
+        to finish, then are killed.
+        """
+        if self.replay:
+            return self._run_replay(index)
+
+        user = self.users[index]
+        offset = self.user_offsets[index]
+        nb_users = self.group_sizes[index]
+        if self.scenarios is not None:
+            assigned = assign_users(self.scenarios, nb_users)
+        deadline = None
+        if self.duration is not None:
+            deadline = time.time() + float(self.duration)
+
+        group = []
+        for i in range(user):
+            scenario = None
+            if self.scenarios is not None:
+                if offset + i >= len(assigned):
+                    break
+                scenario = assigned[offset + i]
+            group.append(self.engine.spawn(self._active, self._run,
+                                           offset + i, nb_users, scenario,
+                                           deadline))
+            self.engine.sleep(0)
+        self._join_group(group, deadline)
+
+    def _join_group(self, group, deadline):
+        if deadline is None:
+            self.engine.join(group)
+            return
 
-            spawned_test = gevent.spawn(spawn_test)
-            timer = gevent.Timeout(self.duration).start()
+        grace_period = float(self.args.get('grace_period', 5))
+        self.engine.join(group, timeout=max(deadline + grace_period -
+                                            time.time(), 0))
+        running = self.engine.running(group)
+        if running:
+            logger.debug('Killing %d users still running after the grace '
+                         'period' % len(running))
+            self.engine.kill(running)
+
+    def _run_replay(self, index):
+        """Replays the recorded requests of the *replay* option with the
+        users of the group at *index*. See :mod:`loadstester.replay`.
+        """
+        offset = self.user_offsets[index]
+        users = range(offset, offset + self.users[index])
+        nb_users = self.group_sizes[index]
+        deadline = None
+        if self.duration is not None:
+            deadline = time.time() + float(self.duration)
+
+        replayer = Replayer(self.replay, users, nb_users,
+                            speed=float(self.args.get('replay_speed', 1)),
+                            queue_size=int(self.args.get('replay_queue', 100)))
+        group = [gevent.spawn(self._active, self._replay_user, user,
+                              nb_users, replayer.queues[user])
+                 for user in users]
+        group.append(gevent.spawn(replayer.run, deadline,
+                                  lambda: self.stop))
+        self._join_group(group, deadline)
+
+    def _replay_user(self, user, nb_users, queue):
+        test = self._new_test()
+        loads_status = LoadsStatus.from_dict(
+            self.args.get('loads_status', {}))
+        loads_status.update(self._status(current_user=user + 1,
+                                         nb_users=nb_users))
+        while not self.stop:
             try:
-                spawned_test.join(timeout=timer)
-            except (gevent.Timeout, KeyboardInterrupt):
-                pass
+                item = queue.get(timeout=.1)
+            except Empty:
+                continue
+            if item is None:
+                break
+            record, intended = item
+            loads_status['current_hit'] += 1
+            loads_status['nb_hits'] = loads_status['current_hit']
+            if intended is not None:
+                loads_status['lag'] = time.time() - intended
+            test.replay_record = record
+            test(loads_status=loads_status)
+
+    def _run_user_profile(self, pool=None):
+        """Runs the stages of the users profile.
+
+        The users are added or removed one at a time, evenly over the
+        duration of each stage.
+        """
+        if pool is None:
+            pool = _UserPool(self)
+
+        for duration, target in self.user_profile:
+            initial = len(pool)
+            start = time.time()
+            if target != initial:
+                step = duration / abs(target - initial)
+            else:
+                step = duration
+
+            while not self.stop:
+                elapsed = time.time() - start
+                if elapsed >= duration:
+                    break
+                pool.resize(initial + int((target - initial) *
+                                          elapsed / duration))
+                gevent.sleep(min(step, duration - elapsed))
+
+            if self.stop:
+                break
+            pool.resize(target)
+
+        pool.resize(0)
+        pool.join()
+
+    def _run_user(self, user, pool):
+        loads_status = LoadsStatus.from_dict(
+            self.args.get('loads_status', {}))
+        loads_status.update(self._status(current_user=user.index + 1,
+                                         nb_users=len(pool)))
+        think_time = 0
+        if user.scenario is not None:
+            loads_status['scenario'] = user.scenario.name
+            think_time = user.scenario.think_time
+        try:
+            while not user.stopped and not self.stop:
+                loads_status['current_hit'] += 1
+                loads_status['nb_users'] = len(pool)
+                user.test(loads_status=loads_status)
+                gevent.sleep(think_time)
+        finally:
+            pool.release(user)
+
+    def _run_arrivals(self, profile=None, pool=None, idle=None):
+        """Runs the tests at the arrival rate of the profile (open model).
+
+        Each test starts at its intended time, from a pool of at most
+        *pool_size* concurrent users. When all of them are busy the next
+        tests start late: the lag between the intended and the actual start
+        is sent in the loads status of each test as *lag*.
+
+        With scenarios, each arrival runs the test of a scenario picked
+        in proportion to their shares.
+
+        A *profile* other than the one of the options can be given, with
+        the *pool* and the *idle* tests of a previous one to reuse.
+        """
+        if profile is None:
+            profile = self.rate_profile
+        if pool is None:
+            pool = Pool(self.pool_size)
+        if idle is None:
+            idle = _IdleUsers(self.pool_size)
+        nb_hits = int(round(profile.total))
+        start = time.time()
+        if self.scenarios is not None:
+            picker = arrival_picker(self.scenarios)
+        else:
+            picker = None
+
+        for current_hit, offset in enumerate(profile.arrivals()):
+            if self.stop:
+                break
+            delay = start + offset - time.time()
+            gevent.sleep(max(delay, 0))
+            pool.wait_available()
+            scenario = picker and picker.next()
+            user, test = idle.take(scenario)
+            if test is None:
+                test = self._new_test(scenario)
+            pool.spawn(self._active, self._run_arrival, test, user,
+                       idle, start + offset, current_hit + 1,
+                       nb_hits, scenario)
+
+        pool.join()
+
+    def _run_capacity(self):
+        """Searches the capacity of the target, see
+        :mod:`loadstester.capacity`.
+        """
+        args = self.args
+        rate_mode = self.capacity == 'rate'
+        maximum = args.get('capacity_max')
+        if maximum is not None:
+            maximum = float(maximum)
+        start = float(args.get('capacity_start', rate_mode and 10 or 1))
+        factor = float(args.get('capacity_factor', 2))
+        warmup = float(args.get('capacity_warmup', 2))
+        duration = float(args.get('capacity_step', 10))
+        floor = None
+        if rate_mode:
+            # at least a hit per step
+            floor = max(start / factor ** 3, 1. / duration)
+        search = CapacitySearch(
+            start=start, factor=factor, maximum=maximum,
+            precision=float(args.get('capacity_precision', .05)),
+            integer=not rate_mode, floor=floor)
+        probe = CapacityProbe(args.get('capacity_slo', DEFAULT_SLO))
+        max_steps = int(args.get('capacity_steps', 20))
+        self.test_result.observers.append(probe)
+
+        if rate_mode:
+            pool, idle = Pool(self.pool_size), _IdleUsers(self.pool_size)
+        else:
+            pool = _UserPool(self)
+        steps = []
+        try:
+            while not self.stop and len(steps) < max_steps:
+                level = search.next_level()
+                if level is None:
+                    break
+                if rate_mode:
+                    profile = RateProfile([(warmup + duration, level, level)])
+                    arrivals = gevent.spawn(self._run_arrivals, profile,
+                                            pool, idle)
+                else:
+                    pool.resize(level)
+                gevent.sleep(warmup)
+                probe.start()
+                gevent.sleep(duration)
+                if rate_mode:
+                    arrivals.join()
+                step = probe.stop(level, rate_mode and level or None)
+                search.record(level, step['passed'])
+                steps.append(step)
+                logger.info('Capacity step at %g %s: %.1f rps, p95 %s ms, '
+                            '%.2f%% errors, %s' % (
+                                level, self.capacity, step['rps'],
+                                step['p95'], step['error_rate'],
+                                step['passed'] and 'passed' or 'failed ' +
+                                ', '.join(step['failed'])))
+        finally:
+            self.test_result.observers.remove(probe)
+            if not rate_mode:
+                pool.resize(0)
+            pool.join()
+
+        self.capacity_report = report(self.capacity, steps)
+        if self.capacity_report['level'] is None:
+            logger.info('Capacity: no sustainable level')
+        else:
+            logger.info('Capacity: %s %s, %.1f rps' % (
+                self.capacity_report['level'], self.capacity,
+                self.capacity_report['max_rps']))
+        self.test_result.add_capacity_report(self.capacity_report)
+
+    def _run_arrival(self, test, user, idle, intended, current_hit, nb_hits,
+                     scenario=None):
+        loads_status = LoadsStatus.from_dict(
+            self.args.get('loads_status', {}))
+        loads_status.update(self._status(current_hit=current_hit,
+                                         nb_hits=nb_hits,
+                                         current_user=user + 1,
+                                         nb_users=self.pool_size))
+        loads_status['lag'] = time.time() - intended
+        if scenario is not None:
+            loads_status['scenario'] = scenario.name
+        try:
+            test(loads_status=loads_status)
+        finally:
+            idle.release(user, test, scenario)
 
     def _prepare_filesystem(self):
         test_dir = self.args.get('test_dir')
@@ -226,13 +745,18 @@ class Runner(object):
                 os.makedirs(test_dir)
 
             # Copy over the include files, if any.
-            # It's inefficient to package them up and then immediately
-            # unpackage them, but this has the advantage of ensuring
-            # consistency with how it's done in the distributed case.
+            # The contents go through the same cache than the bundles of
+            # the distributed case, and the unchanged files are not copied
+            # again.
             includes = self.args.get('include_file', [])
             logger.debug("unpacking %s" % str(includes))
-            filedata = pack_include_files(includes)
-            unpack_include_files(filedata, test_dir)
+            cache_dir = self.args.get('include_cache')
+            if cache_dir is None:
+                cache_dir = user_cache_dir('loads-include-cache')
+            written, skipped = sync_include_files(includes, test_dir,
+                                                  cache_dir)
+            logger.debug('%d include files written, %d unchanged' %
+                         (written, skipped))
 
             # change to execution directory if asked
             logger.debug('chdir %r' % test_dir)
@@ -241,55 +765,278 @@ class Runner(object):
     def _execute(self):
         """Spawn all the tests needed and wait for them to finish.
         """
-        self._prepare_filesystem()
-        self._deploy_python_deps()
+        self._timed('filesystem', self._prepare_filesystem)
+        self._timed('deps', self._deploy_python_deps)
         self._run_python_tests()
 
+    def _timed(self, step, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.startup_timing[step] = time.time() - start
+
     def _run_python_tests(self):
         # resolve the name now
         logger.debug('Resolving the test fqn')
-        self._resolve_name()
+        self._timed('resolve', self._resolve_name)
+
+        if self.processes > 1:
+            return self._run_processes()
+
+        # the connection stats are the ones of this run
+        reset_strategies()
         logger.debug('Ready to spawn greenlets for testing.')
         agent_id = self.args.get('agent_id')
         exception = None
+        metrics = monitor = profiler = None
         try:
-            if not self.args.get('no_patching', False):
-                logger.debug('Gevent monkey patches the stdlib')
-                from gevent import monkey
-                monkey.patch_all()
-
-            gevent.spawn(self._grefresh)
+            self.engine.setup(self.args)
+            if self.args.get('profile'):
+                profiler = SamplingProfiler(
+                    interval=float(self.args.get('profile_interval', 5)) /
+                    1000,
+                    block_threshold=float(self.args.get('profile_block',
+                                                        100)) / 1000)
+                profiler.start()
+            if self.args.get('metrics_port') is not None:
+                metrics = self._serve_metrics()
+            if self.thresholds:
+                monitor = ThresholdMonitor(
+                    self, self.thresholds,
+                    window=self.args.get('threshold_window', 10),
+                    sustain=self.args.get('threshold_sustain', 5),
+                    abort=self.args.get('threshold_abort', True))
+                self.test_result.observers.append(monitor)
+                self.outputs.append(monitor)
+            self.engine.spawn(self._grefresh)
 
             if not self.args.get('externally_managed'):
-                self.test_result.startTestRun(agent_id)
+                self.test_result.startTestRun(
+                    agent_id, startup=self.startup_timing)
+
+            if self.rate_profile is not None:
+                self._run_arrivals()
+            elif self.user_profile is not None:
+                self._run_user_profile()
+            elif self.capacity is not None:
+                self._run_capacity()
 
-            for user in self.users:
-                if self.stop:
+            for index in range(len(self.users)):
+                if (self.stop or self.rate_profile is not None or
+                        self.user_profile is not None or
+                        self.capacity is not None):
                     break
 
-                group = []
-                for i in range(user):
-                    group.append(gevent.spawn(self._run, i, user))
-                    gevent.sleep(0)
+                self._run_group(index)
 
-                gevent.joinall(group)
+            self.engine.sleep(0)
+            # the users still running start no more hits, and don't add
+            # to the final events
+            self.stop = True
+            self.engine.close(self.test_result)
+            if monitor is not None:
+                self._check_thresholds(monitor)
 
-            gevent.sleep(0)
+            stats = get_strategy(self.args).get_stats()
+            self.test_result.add_connection_stats(**stats)
 
             if not self.args.get('externally_managed'):
                 self.test_result.stopTestRun(agent_id)
+            else:
+                self.test_result.add_error_summary()
+                self.test_result.add_queue_stats()
+            self.test_result.flush()
         except KeyboardInterrupt:
             pass
         except Exception as e:
             exception = e
         finally:
             logger.debug('Test over - cleaning up')
+            if metrics is not None:
+                metrics.stop()
+                self.outputs.remove(metrics)
+            if monitor is not None:
+                self.outputs.remove(monitor)
+            if profiler is not None:
+                profiler.stop()
+                path = self.args['profile']
+                if 'process_index' in self.args:
+                    path += '.%d' % self.args['process_index']
+                try:
+                    profiler.write(path)
+                except IOError:
+                    logger.exception('Could not write the profile')
+            self.engine.shutdown()
             if exception:
                 logger.debug('We had an exception, re-raising it')
                 raise exception
 
+    def _check_thresholds(self, monitor):
+        results = monitor.results()
+        self._log_thresholds(results)
+        self.test_result.add_threshold_results(results)
+
+    def _log_thresholds(self, results):
+        self.failed_thresholds = [result for result in results
+                                  if not result['passed']]
+        for result in results:
+            if result['passed']:
+                logger.info(describe(result))
+            else:
+                logger.error(describe(result))
+
+    def _serve_metrics(self):
+        """Serves the live metrics of the run, see :mod:`loadstester.metrics`.
+
+        Each worker process serves on the *metrics_port* plus its index.
+        """
+        metrics = LiveMetrics(self, window=self.args.get('metrics_window', 10))
+        port = int(self.args['metrics_port'])
+        if port:
+            port += self.args.get('process_index', 0)
+        host = self.args.get('metrics_host', '127.0.0.1')
+        metrics.start(host, port)
+        logger.info('Serving the live metrics on http://%s:%d/metrics' %
+                    (host, metrics.port))
+        self.test_result.observers.append(metrics)
+        self.outputs.append(metrics)
+        return metrics
+
+    def _run_processes(self):
+        """Forks one worker process per shard of the users.
+
+        Each worker runs its own gevent hub and streams its results on a
+        pipe. The records are forwarded on stdout as they complete, between
+        a single startTestRun/stopTestRun pair. The stopTestRun event holds
+        the merged error summaries and threshold results of the workers.
+        """
+        agent_id = self.args.get('agent_id')
+        if not self.args.get('externally_managed'):
+            self.test_result.startTestRun(agent_id,
+                                          startup=self.startup_timing)
+        self.test_result.flush()
+        sys.stdout.flush()
+
+        workers = {}
+        shards = _split_users(self.users, self.processes)
+        for index, shard in enumerate(shards):
+            if (self.rate_profile is None and self.user_profile is None and
+                    not any([count for offset, count in shard])):
+                continue
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                sys.stdout = os.fdopen(write_fd, 'w', 64 * 1024)
+                self._run_worker(index, shard)
+            os.close(write_fd)
+            workers[read_fd] = pid
+            logger.debug('Worker %d started (pid %d)' % (index, pid))
+
+        streamer = STREAMERS[self.args.get('streamer', 'json')]
+        split = streamer.split
+        buffers = dict([(fd, '') for fd in workers])
+        threshold_results = []
+        while buffers:
+            for fd in select.select(list(buffers), [], [])[0]:
+                data = os.read(fd, 64 * 1024)
+                if data:
+                    data, buffers[fd] = split(buffers[fd] + data)
+                else:
+                    os.close(fd)
+                    data = buffers.pop(fd)
+                sys.stdout.write(data)
+                if 'error_summary' in data or 'thresholds' in data:
+                    self._read_worker_events(streamer.decode(data),
+                                             threshold_results, workers)
+            sys.stdout.flush()
+
+        for pid in workers.values():
+            status = os.waitpid(pid, 0)[1]
+            if status:
+                logger.debug('Worker %d exited with %d' % (pid, status))
+                self.failed_processes += 1
+
+        kw = {}
+        if threshold_results:
+            kw['thresholds'] = merge_results(self.thresholds,
+                                             threshold_results)
+            self._log_thresholds(kw['thresholds'])
+        if not self.args.get('externally_managed'):
+            self.test_result.stopTestRun(agent_id, **kw)
+        self.test_result.flush()
+
+    def _read_worker_events(self, events, threshold_results, workers):
+        """Merges the error summaries of the workers, and keeps their
+        threshold results. A worker stopped by a breach stops the others.
+        """
+        for event in events:
+            if event['action'] == 'error_summary':
+                self.test_result.merge_error_summary(event['error_summary'])
+            elif event['action'] == 'thresholds':
+                results = event['thresholds']
+                threshold_results.append(results)
+                if (self.args.get('threshold_abort', True) and
+                        [result for result in results
+                         if 'breached' in result]):
+                    self._stop_workers(workers)
+
+    def _stop_workers(self, workers):
+        if self.stop:
+            return
+        self.stop = True
+        logger.error('Stopping the workers')
+        for pid in workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _stopped(self, signum, frame):
+        self.stop = True
+
+    def _run_worker(self, index, shard):
+        """Runs the tests of a worker process, then exits it."""
+        status = 1
+        try:
+            # the parent stops the workers on a breach in another one
+            signal.signal(signal.SIGTERM, self._stopped)
+            self.args = dict(self.args)
+            self.args['externally_managed'] = True
+            self.args['process_index'] = index
+            self.user_offsets = [offset for offset, count in shard]
+            self.users = [count for offset, count in shard]
+            if self.rate_profile is not None:
+                self.rate_profile = self.rate_profile.scaled(
+                    1. / self.processes)
+                self.pool_size = max(self.pool_size // self.processes, 1)
+            self.thresholds = [threshold.scaled(1. / self.processes)
+                               for threshold in self.thresholds]
+            if self.args.get('sample_budget'):
+                self.args['sample_budget'] = (
+                    float(self.args['sample_budget']) / self.processes)
+            if self.user_profile is not None:
+                targets = [target for duration, target in self.user_profile]
+                targets = _split_users(targets, self.processes)[index]
+                self.user_profile = [
+                    (duration, target) for (duration, old), (offset, target)
+                    in zip(self.user_profile, targets)]
+            self.processes = 1
+            self._test_result = None
+            self._run_python_tests()
+            status = int(bool(self.test_result.nb_errors +
+                              self.test_result.nb_failures or
+                              self.failed_thresholds))
+        except BaseException:
+            logger.exception('Worker %d failed' % index)
+        finally:
+            sys.stdout.flush()
+            os._exit(status)
+
     def refresh(self):
         if not self.stop:
+            self.test_result.refresh()
             for output in self.outputs:
                 if hasattr(output, 'refresh'):
                     output.refresh(self.run_id)
@@ -297,4 +1044,4 @@ class Runner(object):
     def _grefresh(self):
         self.refresh()
         if not self.stop:
-            gevent.spawn_later(.1, self._grefresh)
+            self.engine.spawn_later(.1, self._grefresh)
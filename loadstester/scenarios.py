@@ -0,0 +1,149 @@
+"""Mixes of several tests, run by the same runner.
+
+The *scenarios* option lists the tests to run, each one as a dict with:
+
+- *fqn*: the test to run.
+- *weight*: its share of the users, or *users*: its fixed number of users,
+  taken out of the users of the run. Defaults to a weight of 1.
+- *think_time*: the seconds a user waits between two hits, 0 by default.
+- *name*: the name the results are tagged with, the fqn by default.
+
+For example::
+
+    [{"fqn": "shop.Browse.test_browse", "weight": 70},
+     {"fqn": "shop.Search.test_search", "weight": 25},
+     {"fqn": "shop.Buy.test_checkout", "weight": 5, "think_time": 2}]
+
+The scenario of each event is given in its loads status as *scenario*.
+"""
+
+
+class Scenario(object):
+    """One test of a mix, see the module documentation."""
+
+    def __init__(self, fqn, weight=None, users=None, think_time=0,
+                 name=None):
+        if weight is not None and users is not None:
+            raise ValueError('The scenario %r has both a weight and a number '
+                             'of users' % fqn)
+        if users is None and weight is None:
+            weight = 1
+        if (weight is not None and weight < 0) or (users is not None and
+                                                   users < 0):
+            raise ValueError('The scenario %r has a negative share' % fqn)
+        self.fqn = fqn
+        self.weight = weight
+        self.users = users
+        self.think_time = float(think_time)
+        self.name = name or fqn
+        # the test method, once resolved by the runner
+        self.test = None
+
+    def __repr__(self):
+        return '<Scenario %s>' % self.name
+
+
+def parse_scenarios(scenarios):
+    """Returns the Scenario objects of the *scenarios* option."""
+    if not scenarios:
+        raise ValueError('No scenarios given')
+
+    parsed = []
+    for scenario in scenarios:
+        if isinstance(scenario, Scenario):
+            parsed.append(scenario)
+            continue
+        scenario = dict(scenario)
+        try:
+            fqn = scenario.pop('fqn')
+        except KeyError:
+            raise ValueError('A scenario has no fqn: %r' % scenario)
+        parsed.append(Scenario(fqn, **scenario))
+
+    names = [item.name for item in parsed]
+    if len(set(names)) != len(names):
+        raise ValueError('The scenarios names are not unique: %s' %
+                         ', '.join(names))
+    return parsed
+
+
+def allocate_users(scenarios, total):
+    """Returns the number of users of each scenario, out of *total* users.
+
+    The scenarios with a fixed number of users get them first, and the
+    others share the remaining users by weight, the remainders going to
+    the largest fractions.
+    """
+    counts = [0] * len(scenarios)
+    left = total
+    for index, scenario in enumerate(scenarios):
+        if scenario.users is not None:
+            counts[index] = min(scenario.users, left)
+            left -= counts[index]
+
+    weighted = [(index, scenario.weight)
+                for index, scenario in enumerate(scenarios)
+                if scenario.weight]
+    total_weight = float(sum([weight for index, weight in weighted]))
+    if not left or not total_weight:
+        return counts
+
+    remainders = []
+    for index, weight in weighted:
+        share = left * weight / total_weight
+        counts[index] = int(share)
+        remainders.append((share - int(share), -index))
+    for remainder, index in sorted(remainders, reverse=True)[
+            :total - sum(counts)]:
+        counts[-index] += 1
+    return counts
+
+
+class WeightedPicker(object):
+    """Picks the items in proportion to their weights, spreading them
+    evenly (smooth weighted round-robin).
+    """
+    def __init__(self, items, weights):
+        self.items = items
+        self.weights = weights
+        self.total = sum(weights)
+        self.current = [0] * len(items)
+        if self.total <= 0:
+            raise ValueError('The weights sum to %r' % self.total)
+
+    def next(self):
+        best = None
+        for index, weight in enumerate(self.weights):
+            self.current[index] += weight
+            if best is None or self.current[index] > self.current[best]:
+                best = index
+        self.current[best] -= self.total
+        return self.items[best]
+
+
+def assign_users(scenarios, total):
+    """Returns the scenario of each of *total* users.
+
+    The scenarios are interleaved, so a contiguous range of the users, like
+    the ones of a worker process, gets about the same mix.
+    """
+    counts = allocate_users(scenarios, total)
+    if not sum(counts):
+        return []
+    picker = WeightedPicker(scenarios, counts)
+    return [picker.next() for i in range(sum(counts))]
+
+
+def arrival_picker(scenarios):
+    """Returns a WeightedPicker of the scenarios of each arrival.
+
+    The fixed numbers of users are used as weights, as the arrivals do not
+    depend on the number of users.
+    """
+    weights = []
+    for scenario in scenarios:
+        if scenario.users is not None:
+            weights.append(scenario.users)
+        else:
+            weights.append(scenario.weight)
+    return WeightedPicker(scenarios, weights)
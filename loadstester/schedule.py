@@ -0,0 +1,114 @@
+import math
+
+
+def parse_rate_profile(profile):
+    """Parses a rate profile into a list of (duration, start, end) stages.
+
+    The rates are in requests per second and change linearly from *start*
+    to *end* over the *duration* of the stage, in seconds. A profile is
+    either a list of ``[duration, rate]`` or ``[duration, start, end]``
+    stages, or a string of comma-separated ``duration:rate`` or
+    ``duration:start-end`` stages, e.g. ``"60:0-100,120:100,10:500"`` for
+    a ramp, a steady state and a spike.
+    """
+    if isinstance(profile, basestring):
+        stages = []
+        for stage in profile.split(','):
+            duration, rates = stage.split(':')
+            stages.append([duration] + rates.split('-'))
+    else:
+        stages = profile
+
+    parsed = []
+    for stage in stages:
+        if len(stage) == 2:
+            duration, start = stage
+            end = start
+        elif len(stage) == 3:
+            duration, start, end = stage
+        else:
+            raise ValueError('Invalid rate profile stage %r' % (stage,))
+        duration, start, end = float(duration), float(start), float(end)
+        if duration <= 0 or start < 0 or end < 0:
+            raise ValueError('Invalid rate profile stage %r' % (stage,))
+        parsed.append((duration, start, end))
+    return parsed
+
+
+class RateProfile(object):
+    """Computes the intended start time of each request of a rate profile.
+
+    The start times are derived from the profile itself and not from the
+    previous requests, so a late request does not delay the next ones.
+    """
+    def __init__(self, stages):
+        self.stages = stages
+        self.duration = sum([duration for duration, start, end in stages])
+        self.total = sum([(start + end) / 2. * duration
+                          for duration, start, end in stages])
+
+    def scaled(self, factor):
+        """Returns the same profile with all the rates multiplied by
+        :param factor:.
+        """
+        return RateProfile([(duration, start * factor, end * factor)
+                            for duration, start, end in self.stages])
+
+    def arrivals(self):
+        """Yields the start time of each request, in seconds from the
+        start of the run.
+        """
+        offset = 0.
+        before = 0.    # number of requests expected before the stage
+        current = 1
+        for duration, start, end in self.stages:
+            slope = (end - start) / duration
+            total = before + (start + end) / 2. * duration
+            while current <= total + 1e-9:
+                # solves start * x + slope / 2 * x ** 2 = requests left
+                left = current - before
+                if slope:
+                    delta = max(start * start + 2 * slope * left, 0)
+                    elapsed = (math.sqrt(delta) - start) / slope
+                else:
+                    elapsed = left / start
+                yield offset + min(elapsed, duration)
+                current += 1
+            offset += duration
+            before = total
+
+
+def parse_user_profile(profile):
+    """Parses a users profile into a list of (duration, users) stages.
+
+    During each stage the number of users changes linearly, from the
+    number reached at the end of the previous stage (0 at first) to
+    *users*, over *duration* seconds. A stage keeping the same number of
+    users holds that level. A profile is either a list of
+    ``[duration, users]`` stages or a string of comma-separated
+    ``duration:users`` stages, e.g. ``"30:100,300:100,30:0"``.
+    """
+    if isinstance(profile, basestring):
+        profile = [stage.split(':') for stage in profile.split(',')]
+
+    parsed = []
+    for stage in profile:
+        if len(stage) != 2:
+            raise ValueError('Invalid users profile stage %r' % (stage,))
+        duration, users = float(stage[0]), int(stage[1])
+        if duration < 0 or users < 0:
+            raise ValueError('Invalid users profile stage %r' % (stage,))
+        parsed.append((duration, users))
+    return parsed
+
+
+def ramp_profile(users, ramp, duration):
+    """Builds a users profile going through each level of :param users:,
+    reaching it in :param ramp: seconds then holding it for
+    :param duration: seconds.
+    """
+    profile = []
+    for level in users:
+        profile.append((float(ramp), level))
+        profile.append((float(duration), level))
+    return profile
@@ -0,0 +1,287 @@
+"""A warm worker: a long-lived runner process serving runs over a socket.
+
+The server imports the heavy modules once, and keeps the test classes it
+resolved. For each run, it forks a child that inherits them, so the runs
+skip the interpreter start-up and the imports.
+
+The protocol, on a Unix socket:
+
+- the client sends its options as one JSON line, with the *cwd* to run
+  from. The server reads the requests of all the clients as they come, and
+  drops the ones not complete after *REQUEST_TIMEOUT* seconds.
+- the server sends back the results stream as frames: a big-endian
+  unsigned int length, then the data. An empty frame ends the stream, and
+  is followed by the exit status of the run, as a big-endian int.
+"""
+import errno
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+from loadstester.util import logger, resolve_name, ImportProfile
+
+
+_LENGTH = struct.Struct('>I')
+_STATUS = struct.Struct('>i')
+
+REQUEST_TIMEOUT = 10
+
+# the modules imported by every run
+DEFAULT_PRELOAD = ('gevent', 'gevent.monkey', 'requests', 'webtest',
+                   'wsgiproxy', 'loadstester.runner')
+
+
+class _FramedWriter(object):
+    """A buffered file-like object sending frames on a socket."""
+
+    def __init__(self, sock, buffer_size=64 * 1024):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        if not data:
+            return
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._size:
+            return
+        data = ''.join(self._buffer)
+        self._buffer, self._size = [], 0
+        self.sock.sendall(_LENGTH.pack(len(data)) + data)
+
+    def close(self, status):
+        self.flush()
+        self.sock.sendall(_LENGTH.pack(0) + _STATUS.pack(status))
+
+
+def _recv_exactly(sock, size):
+    data = []
+    while size:
+        chunk = sock.recv(min(size, 64 * 1024))
+        if not chunk:
+            raise IOError('The warm worker closed the connection')
+        data.append(chunk)
+        size -= len(chunk)
+    return ''.join(data)
+
+
+def run_remote(address, options, stream=None):
+    """Runs a test on the warm worker listening on :param address:.
+
+    The results stream is written on :param stream:, stdout by default.
+    Returns the exit status of the run.
+    """
+    if stream is None:
+        stream = sys.stdout
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    try:
+        request = {'options': options, 'cwd': os.getcwd()}
+        sock.sendall(json.dumps(request) + '\n')
+        while True:
+            size = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))[0]
+            if size == 0:
+                break
+            stream.write(_recv_exactly(sock, size))
+        stream.flush()
+        return _STATUS.unpack(_recv_exactly(sock, _STATUS.size))[0]
+    finally:
+        sock.close()
+
+
+class WarmServer(object):
+    """Serves the runs on the Unix socket :param address:.
+
+    The :param preload: modules are imported when the server starts, and
+    the time spent importing each module is kept in *import_profile*.
+    """
+    def __init__(self, address, preload=DEFAULT_PRELOAD):
+        self.address = address
+        self.children = set()
+        self.running = False
+        # the connections whose request is being read, with its chunks and
+        # when they connected
+        self._pending = {}
+        # the resolved tests, and the mtime of their module
+        self._modules = {}
+
+        start = time.time()
+        with ImportProfile() as profile:
+            for name in preload:
+                try:
+                    __import__(name)
+                except ImportError:
+                    logger.debug('Could not preload %r' % name)
+        self.preload_time = time.time() - start
+        self.import_profile = profile.top()
+
+        # imported here so it's part of the preload profile
+        from loadstester.runner import Runner
+        self._runner_class = Runner
+
+    def _module_file(self, module):
+        filename = getattr(module, '__file__', None)
+        if filename is None:
+            return None
+        if filename.endswith(('.pyc', '.pyo')):
+            filename = filename[:-1]
+        return filename
+
+    def _warm(self, fqn):
+        """Resolves the test in the server, so the runs inherit it.
+
+        The modules of the tests are reloaded when their file changed.
+        """
+        for name, mtime in self._modules.items():
+            module = sys.modules.get(name)
+            filename = self._module_file(module)
+            try:
+                changed = filename and os.stat(filename).st_mtime != mtime
+            except OSError:
+                changed = True
+            if changed:
+                logger.debug('Reloading %r' % name)
+                del self._modules[name]
+                try:
+                    reload(module)
+                except Exception:
+                    logger.debug('Could not reload %r' % name)
+
+        try:
+            test = resolve_name(fqn)
+        except Exception:
+            # the run will report it
+            return
+        name = getattr(getattr(test, 'im_class', test), '__module__', None)
+        filename = self._module_file(sys.modules.get(name))
+        if filename is not None and name not in self._modules:
+            try:
+                self._modules[name] = os.stat(filename).st_mtime
+            except OSError:
+                pass
+
+    def _run(self, conn, request):
+        """Runs a test in the forked child, then exits it."""
+        status = 1
+        writer = _FramedWriter(conn)
+        try:
+            os.chdir(request.get('cwd', '.'))
+            sys.stdout = writer
+            runner = self._runner_class(request['options'])
+            runner.startup_timing['preload'] = self.preload_time
+            status = runner.execute() or 0
+        except BaseException:
+            logger.exception('The run failed')
+        finally:
+            try:
+                sys.stdout.flush()
+                writer.close(status)
+            finally:
+                os._exit(status)
+
+    def _receive(self, conn):
+        """Reads the data the connection sent, and handles its request
+        once complete.
+        """
+        data = self._pending[conn][0]
+        try:
+            chunk = conn.recv(64 * 1024)
+        except socket.error:
+            chunk = None
+        if not chunk:
+            logger.error('Incomplete request')
+            del self._pending[conn]
+            conn.close()
+            return
+        data.append(chunk)
+        if chunk.endswith('\n'):
+            del self._pending[conn]
+            self.handle(conn, ''.join(data))
+
+    def _expire(self):
+        now = time.time()
+        for conn, (data, since) in self._pending.items():
+            if now - since > REQUEST_TIMEOUT:
+                logger.error('No request after %ds, closing the '
+                             'connection' % REQUEST_TIMEOUT)
+                del self._pending[conn]
+                conn.close()
+
+    def handle(self, conn, data):
+        try:
+            request = json.loads(data)
+            options = request['options']
+            fqns = [scenario.get('fqn')
+                    for scenario in options.get('scenarios') or []]
+            fqns.append(options.get('fqn'))
+            old_location = os.getcwd()
+            os.chdir(request.get('cwd', '.'))
+            try:
+                for fqn in fqns:
+                    if fqn:
+                        self._warm(fqn)
+            finally:
+                os.chdir(old_location)
+        except Exception:
+            logger.exception('Invalid request')
+            conn.close()
+            return
+
+        pid = os.fork()
+        if pid == 0:
+            for other in self._pending:
+                other.close()
+            self._run(conn, request)
+        self.children.add(pid)
+        conn.close()
+
+    def _reap(self):
+        for pid in list(self.children):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                done = pid
+            if done:
+                self.children.discard(pid)
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.address)
+        sock.listen(16)
+        logger.info('Warm worker listening on %r' % self.address)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    readable = select.select([sock] + list(self._pending),
+                                             [], [], .5)[0]
+                except select.error, exc:
+                    if exc.args[0] != errno.EINTR:
+                        raise
+                    readable = []
+                for ready in readable:
+                    if ready is sock:
+                        conn, addr = sock.accept()
+                        self._pending[conn] = [], time.time()
+                    else:
+                        self._receive(ready)
+                self._expire()
+                self._reap()
+        finally:
+            for conn in self._pending:
+                conn.close()
+            self._pending.clear()
+            sock.close()
+            os.remove(self.address)
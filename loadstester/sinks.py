@@ -0,0 +1,470 @@
+"""Outputs of the results, written by a dedicated writer.
+
+With the *sinks* option, the events are not written by the users when they
+push them, but put in a bounded queue emptied by a writer thread into each
+sink. A slow consumer then only fills the queue, and the *backpressure*
+option tells what happens when it's full:
+
+- ``block``: the users wait for some room in the queue.
+- ``drop-oldest``: the oldest event is dropped, but never a startTestRun
+  or stopTestRun one.
+- ``sample``: past half of the queue, only a part of the hits are kept,
+  fewer as the queue fills up. The other events are always kept.
+
+The number of dropped events is sent in the stopTestRun event as
+*dropped_events*, and by each worker process in a *queue* event.
+
+Each sink is given by its name, or by a dict with its *type* and options::
+
+    ["stdout", {"type": "file", "path": "/tmp/loads.json"},
+     {"type": "statsd", "host": "127.0.0.1", "port": 8125}]
+
+With several processes, the file sinks of each worker write in their own
+file, the index of the worker appended to the path.
+"""
+import atexit
+import collections
+import os
+import socket
+import time
+
+from gevent import monkey
+
+from loadstester.records import Hit, LoadsStatus, merge_status
+from loadstester.streamer import BaseStreamer, get_streamer
+from loadstester.util import logger, total_seconds
+
+
+# the writer is a real thread even when gevent patched the threading
+# module, so blocking writes do not block the users. It shares nothing
+# but the queue with them, and polls it.
+_start_thread = monkey.get_original('thread', 'start_new_thread')
+_allocate_lock = monkey.get_original('thread', 'allocate_lock')
+_sleep = monkey.get_original('time', 'sleep')
+# the sinks are used by the writer thread: their sockets can't be the
+# gevent ones, bound to the loop of the main thread
+_socket = monkey.get_original('socket', 'socket')
+
+_LIFECYCLE = ('startTestRun', 'stopTestRun')
+
+
+class BaseSink(object):
+    """Base class of the outputs of a QueuedStreamer. A sink receives each
+    event through its ``emit(action, data)`` method.
+    """
+    def emit_hit(self, hit):
+        """Emits a :class:`loadstester.records.Hit`."""
+        self.emit('hit', hit.as_dict())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class StreamerSink(BaseSink):
+    """Encodes the events with a streamer, on *stream*."""
+
+    def __init__(self, stream=None, streamer='json'):
+        self.stream = stream
+        self.streamer = get_streamer(streamer, stream=stream)
+
+    def emit(self, action, data):
+        self.streamer.push(action, **data)
+
+    def emit_hit(self, hit):
+        self.streamer.push_hit(hit)
+
+    def flush(self):
+        self.streamer.flush()
+
+    def close(self):
+        self.streamer.close()
+        if self.stream is not None:
+            self.stream.close()
+
+
+class StdoutSink(StreamerSink):
+    """Writes the events on stdout, like the runner does without sinks."""
+
+    def __init__(self, streamer='json'):
+        super(StdoutSink, self).__init__(streamer=streamer)
+
+    def close(self):
+        self.streamer.close()
+
+
+class _RotatingFile(object):
+    """A file renamed to *path*.1, *path*.2... once *max_bytes* long.
+
+    The file only rotates between two writes, so the records written
+    whole stay whole.
+    """
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = open(path, 'ab')
+        self.size = self._file.tell()
+
+    def rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = '%s.%d' % (self.path, index)
+            if os.path.exists(source):
+                os.rename(source, '%s.%d' % (self.path, index + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + '.1')
+            self._file = open(self.path, 'ab')
+        else:
+            self._file = open(self.path, 'wb')
+        self.size = 0
+
+    def write(self, data):
+        if self.size and self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self._file.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class FileSink(StreamerSink):
+    """Writes the events in the file at *path*, rotated once it reaches
+    *max_bytes*, keeping *backup_count* of the previous ones.
+    """
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, backup_count=5,
+                 streamer='json'):
+        stream = _RotatingFile(path, max_bytes, backup_count)
+        super(FileSink, self).__init__(stream=stream, streamer=streamer)
+
+
+class _SocketFile(object):
+    """Sends what's written on a Unix socket, connecting when needed.
+
+    The data written while the socket can't be reached is lost, and
+    counted in *errors*.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.errors = 0
+        self._sock = None
+
+    def write(self, data):
+        try:
+            if self._sock is None:
+                self._sock = _socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.connect(self.path)
+            self._sock.sendall(data)
+        except socket.error:
+            logger.debug('Could not write on %r' % self.path)
+            self.errors += 1
+            self.close()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class UnixSocketSink(StreamerSink):
+    """Sends the events on the Unix stream socket at *path*."""
+
+    def __init__(self, path, streamer='json'):
+        super(UnixSocketSink, self).__init__(stream=_SocketFile(path),
+                                             streamer=streamer)
+
+
+def _elapsed_ms(elapsed):
+    if isinstance(elapsed, (int, long)):
+        return elapsed / 1e6
+    if hasattr(elapsed, 'days'):
+        return total_seconds(elapsed) * 1000
+    return elapsed * 1000
+
+
+class StatsdSink(BaseSink):
+    """Sends metrics in the statsd line protocol, over UDP.
+
+    - the hits as a *hits.<status>* counter and a *hit_time* timer, with
+      the sample rate of the sampled hits.
+    - the histogram snapshots as the same counters, and *hit_time.p50*,
+      *p90* and *p99* gauges.
+    - the successes, errors and failures as counters.
+
+    The metrics are grouped in packets of at most *packet_size* bytes.
+    """
+    counters = {'addSuccess': 'successes', 'addError': 'errors',
+                'addFailure': 'failures'}
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='loads',
+                 packet_size=512):
+        self.address = host, port
+        self.prefix = prefix
+        self.packet_size = packet_size
+        self.lines = []
+        self.sock = _socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, action, data):
+        prefix = self.prefix
+        if action == 'hit':
+            # the sampled hits are sent with their sample rate
+            weight = data.get('weight', 1)
+            rate = weight != 1 and '|@%g' % (1. / weight) or ''
+            self.lines.append('%s.hits.%s:1|c%s' % (prefix, data.get('status'),
+                                                    rate))
+            self.lines.append('%s.hit_time:%.3f|ms%s' %
+                              (prefix, _elapsed_ms(data['elapsed']), rate))
+        elif action == 'histogram':
+            self.lines.append('%s.hits.%s:%d|c' % (prefix, data['status'],
+                                                   data['count']))
+            for percent in ('p50', 'p90', 'p99'):
+                self.lines.append('%s.hit_time.%s:%.3f|g' %
+                                  (prefix, percent, data[percent] * 1000))
+        elif action in self.counters:
+            self.lines.append('%s.%s:1|c' % (prefix, self.counters[action]))
+
+    def flush(self):
+        packet, size = [], 0
+        for line in self.lines:
+            if packet and size + len(line) + 1 > self.packet_size:
+                self._send(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send(packet)
+        self.lines = []
+
+    def _send(self, packet):
+        try:
+            self.sock.sendto('\n'.join(packet), self.address)
+        except socket.error:
+            logger.debug('Could not send the metrics to %s:%d' %
+                         self.address)
+
+    def close(self):
+        self.flush()
+        self.sock.close()
+
+
+SINKS = {'stdout': StdoutSink,
+         'file': FileSink,
+         'statsd': StatsdSink,
+         'unix': UnixSocketSink}
+
+
+def get_sink(config, process_index=None):
+    """Returns the sink of a *sinks* option item: a name, or a dict with
+    the *type* of the sink and its options.
+
+    The file sinks of the worker processes write in their own file, with
+    the *process_index* of the worker appended to the path.
+    """
+    if isinstance(config, basestring):
+        config = {'type': config}
+    options = dict([(str(key), value) for key, value in config.items()])
+    name = options.pop('type', None)
+    if name == 'file' and process_index is not None and 'path' in options:
+        options['path'] = '%s.%d' % (options['path'], process_index)
+    try:
+        klass = SINKS[name]
+    except KeyError:
+        raise ValueError('Unknown sink %r, choose one of %s' %
+                         (name, ', '.join(sorted(SINKS))))
+    return klass(**options)
+
+
+class _Marker(object):
+    """Put in the queue to know when the events before it are written."""
+
+    def __init__(self):
+        self.done = False
+
+
+class QueuedStreamer(BaseStreamer):
+    """Puts the events in a queue of at most *maxsize* ones, written in
+    the *sinks* by a writer thread. See the module documentation for the
+    *policy* when the queue is full.
+    """
+    policies = ('block', 'drop-oldest', 'sample')
+
+    def __init__(self, sinks, maxsize=10000, policy='block'):
+        if policy not in self.policies:
+            raise ValueError('Unknown backpressure policy %r, choose one of '
+                             '%s' % (policy, ', '.join(self.policies)))
+        self.sinks = sinks
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.errors = 0
+        self._queue = collections.deque()
+        # held to take items out of the queue, by the writer or to drop them
+        self._lock = _allocate_lock()
+        self._registered = False
+        self._writing = False
+        self._pid = None
+        self._sampled = 0
+        self._stopping = False
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._stopping = False
+        self._writing = True
+        _start_thread(self._write, ())
+        # a thread still running when the interpreter shuts down fails
+        # noisily. The forked workers inherit the registration.
+        if not self._registered:
+            atexit.register(self._stop)
+            self._registered = True
+
+    def _stop(self):
+        if not self._writing or self._pid != os.getpid():
+            return
+        self._stopping = True
+        end = time.time() + 1
+        while self._writing and time.time() < end:
+            _sleep(.001)
+
+    def _put(self, item):
+        self._queue.append(item)
+
+    def _keep_hit(self):
+        """Tells if a hit is kept, with the sample policy."""
+        size = len(self._queue)
+        half = self.maxsize // 2
+        if size < half:
+            return True
+        if size >= self.maxsize:
+            return False
+        # 1 of 2 hits at half of the queue, 1 of 16 near the end
+        self._sampled += 1
+        step = 2 ** (1 + 3 * (size - half) // max(self.maxsize - half, 1))
+        return self._sampled % step == 0
+
+    def push(self, action, **data):
+        self.push_event(action, None, **data)
+
+    def push_event(self, action, status, **data):
+        # the nested dicts and the status change after the push. The
+        # status is kept as a snapshot, merged in the event by the writer.
+        for key, value in data.items():
+            if isinstance(value, dict):
+                data[key] = dict(value)
+            elif isinstance(value, LoadsStatus):
+                data[key] = value.copy()
+        if isinstance(status, LoadsStatus):
+            status = status.copy()
+        elif status is not None:
+            status = dict(status)
+        self._push(action, data, status)
+
+    def push_hit(self, hit):
+        status = hit.loads_status
+        if isinstance(status, dict):
+            hit.loads_status = dict(status)
+        elif isinstance(status, LoadsStatus):
+            hit.loads_status = status.copy()
+        self._push('hit', hit)
+
+    def _push(self, action, data, status=None):
+        if self._pid != os.getpid():
+            # first event, or the first one in a forked worker
+            self._queue.clear()
+            self._start()
+
+        if action in _LIFECYCLE:
+            pass
+        elif self.policy == 'block':
+            while len(self._queue) >= self.maxsize:
+                time.sleep(.001)
+        elif self.policy == 'drop-oldest':
+            if len(self._queue) >= self.maxsize and self._drop_oldest():
+                self.dropped += 1
+        elif action == 'hit' and not self._keep_hit():
+            self.dropped += 1
+            return
+
+        self._put((action, data, status))
+
+    def _drop_oldest(self):
+        """Drops the oldest event but the lifecycle ones and the flush
+        markers, and tells if there was one.
+        """
+        queue = self._queue
+        with self._lock:
+            for index, item in enumerate(queue):
+                if not isinstance(item, _Marker) and item[0] not in _LIFECYCLE:
+                    del queue[index]
+                    return True
+        return False
+
+    def _emit(self, action, data, status):
+        if status is not None:
+            merge_status(status, data)
+        for sink in self.sinks:
+            try:
+                if isinstance(data, Hit):
+                    sink.emit_hit(data)
+                elif len(self.sinks) > 1:
+                    sink.emit(action, dict(data))
+                else:
+                    sink.emit(action, data)
+            except Exception:
+                logger.exception('The sink %r failed' % sink)
+                self.errors += 1
+
+    def _flush_sinks(self):
+        for sink in self.sinks:
+            try:
+                sink.flush()
+            except Exception:
+                logger.exception('The sink %r failed' % sink)
+                self.errors += 1
+
+    def _write(self):
+        queue = self._queue
+        try:
+            while True:
+                written = False
+                while queue:
+                    with self._lock:
+                        item = queue.popleft()
+                    if isinstance(item, _Marker):
+                        self._flush_sinks()
+                        item.done = True
+                        written = False
+                    else:
+                        self._emit(*item)
+                        written = True
+                if written:
+                    self._flush_sinks()
+                if self._stopping:
+                    return
+                if not queue:
+                    _sleep(.005)
+        finally:
+            self._writing = False
+
+    def flush(self):
+        """Waits until the events pushed so far are written."""
+        if not self._writing or self._pid != os.getpid():
+            return
+        marker = _Marker()
+        self._put(marker)
+        while not marker.done and self._writing:
+            time.sleep(.001)
+
+    def close(self):
+        self.flush()
+        self._stop()
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,327 @@
+import math
+import re
+import time
+from array import array
+
+
+# Values are recorded in microseconds. Each power of two is split in
+# SUB_BUCKETS linear buckets, so the error on any value stays under
+# 1 / SUB_BUCKETS (~1.5%), like an HDR histogram with two significant
+# digits. MAX_VALUE caps the recorded values at a bit more than an hour.
+SUB_BITS = 6
+SUB_BUCKETS = 2 ** SUB_BITS
+MAX_VALUE = 2 ** 32 - 1
+NB_BUCKETS = (32 - SUB_BITS + 1) * SUB_BUCKETS
+
+
+def bucket_index(value):
+    """Returns the index of the bucket *value* falls in."""
+    if value < SUB_BUCKETS:
+        return max(int(value), 0)
+    value = min(int(value), MAX_VALUE)
+    shift = math.frexp(value)[1] - SUB_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_value(index):
+    """Returns the value in the middle of the bucket at *index*."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    low = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+    return low + ((1 << shift) - 1) // 2
+
+
+class LatencyHistogram(object):
+    """A fixed-size, log-bucketed histogram of latencies in microseconds."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = array('L', [0]) * NB_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = self.max = None
+
+    def add(self, value, count=1):
+        self.counts[bucket_index(value)] += count
+        self.count += count
+        self.total += value * count
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.max is None or value > self.max:
+                    self.max = value
+                if self.min is None or value < self.min:
+                    self.min = value
+
+    def percentiles(self, *percents):
+        """Returns the values at each of the given *percents*, in a list.
+
+        The values are clamped between the min and max recorded, and the
+        values falling in the last bucket are the max.
+        """
+        if not self.count:
+            return [None] * len(percents)
+        thresholds = [max(self.count * percent / 100., 1)
+                      for percent in percents]
+        results = [None] * len(percents)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            for i, threshold in enumerate(thresholds):
+                if results[i] is None and seen >= threshold:
+                    if seen == self.count:
+                        results[i] = self.max
+                    else:
+                        value = bucket_value(index)
+                        results[i] = min(max(value, self.min), self.max)
+            if None not in results:
+                break
+        return results
+
+    def percentile(self, percent):
+        return self.percentiles(percent)[0]
+
+
+class RollingHistogram(object):
+    """The latencies and errors of the last *window* seconds.
+
+    They're added in slots of one second. Each :meth:`tick` past the end
+    of the current slot merges the slots in *histogram* and *errors*, then
+    starts a new one, so reading them never rescans the hits. *seconds* is
+    the number of full seconds they cover, at most *window*.
+    """
+    def __init__(self, window=10, now=None):
+        self.window = int(window)
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.seconds = 0
+        self._slots = [[LatencyHistogram(), 0] for i in range(self.window)]
+        self._slot = 0
+        if now is None:
+            now = time.time()
+        self._slot_end = now + 1
+
+    def add(self, value, error=False):
+        slot = self._slots[self._slot]
+        slot[0].add(value)
+        if error:
+            slot[1] += 1
+
+    def _next_slot(self):
+        self._slot = (self._slot + 1) % self.window
+        self._slots[self._slot] = [LatencyHistogram(), 0]
+
+    def tick(self, now=None):
+        """Rotates the slots if the current one is over, and tells if it
+        did.
+        """
+        if now is None:
+            now = time.time()
+        if now < self._slot_end:
+            return False
+
+        # the seconds without any tick get empty slots
+        missed = int(now - self._slot_end)
+        for i in range(min(missed, self.window)):
+            self._next_slot()
+        self._slot_end += missed + 1
+        self.seconds = min(self.seconds + missed + 1, self.window)
+
+        histogram = LatencyHistogram()
+        errors = 0
+        for slot_histogram, slot_errors in self._slots:
+            histogram.merge(slot_histogram)
+            errors += slot_errors
+        self.histogram, self.errors = histogram, errors
+        self._next_slot()
+        return True
+
+    def rate(self):
+        """Returns the number of hits per second."""
+        if not self.seconds:
+            return 0.
+        return self.histogram.count / float(self.seconds)
+
+    def error_ratio(self):
+        if not self.histogram.count:
+            return 0.
+        return self.errors / float(self.histogram.count)
+
+
+_ID = re.compile(r'^(\d+|[0-9a-fA-F-]{8,})$')
+_DIGIT = re.compile(r'\d')
+
+
+def url_template(url):
+    """Turns an url into a template by dropping the query string and
+    replacing the ids found in its path (numbers, hashes and uuids) by
+    ``{id}``.
+    """
+    url = url.split('?', 1)[0].split('#', 1)[0]
+    scheme, sep, rest = url.partition('://')
+    if not sep:
+        scheme, rest = '', url
+    parts = rest.split('/')
+    for i, part in enumerate(parts[1:]):
+        if _ID.match(part) and _DIGIT.search(part):
+            parts[i + 1] = '{id}'
+    return scheme + sep + '/'.join(parts)
+
+
+class HitAggregator(object):
+    """Aggregates the hits in a latency histogram per (method, url template,
+    status) key.
+
+    Memory stays bounded: urls are templated and, past *max_keys*
+    different keys, the new ones are all aggregated under the ``other``
+    url.
+    """
+    percents = (50, 90, 99, 99.9)
+
+    def __init__(self, max_keys=1000):
+        self.max_keys = max_keys
+        self.histograms = {}
+        self._templates = {}
+
+    def _template(self, url):
+        template = self._templates.get(url)
+        if template is None:
+            if len(self._templates) > self.max_keys * 10:
+                self._templates.clear()
+            template = self._templates[url] = url_template(url)
+        return template
+
+    def add(self, method, url, status, elapsed, scenario=None):
+        """Records a hit whose *elapsed* time is given in microseconds."""
+        key = method, self._template(url), status, scenario
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            if len(self.histograms) >= self.max_keys:
+                key = method, 'other', status, scenario
+                histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+        histogram.add(elapsed)
+
+    def snapshot(self, reset=True):
+        """Returns the stats of each key, latencies in seconds.
+
+        With *reset*, the histograms start over so each snapshot covers
+        the hits recorded since the previous one.
+        """
+        snapshots = []
+        for key, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            method, url, status, scenario = key
+            p50, p90, p99, p999 = histogram.percentiles(*self.percents)
+            errors = status is None or status >= 400
+            snapshot = {
+                'method': method, 'url': url, 'status': status,
+                'count': histogram.count,
+                'errors': errors and histogram.count or 0,
+                'mean': histogram.total / float(histogram.count) / 10 ** 6,
+                'min': histogram.min / float(10 ** 6),
+                'p50': p50 / float(10 ** 6),
+                'p90': p90 / float(10 ** 6),
+                'p99': p99 / float(10 ** 6),
+                'p999': p999 / float(10 ** 6),
+                'max': histogram.max / float(10 ** 6)}
+            if scenario is not None:
+                snapshot['scenario'] = scenario
+            snapshots.append(snapshot)
+            if reset:
+                histogram.reset()
+        return snapshots
+
+
+class HitSampler(object):
+    """Picks the hits worth streaming, to stay under *budget* hits per
+    second.
+
+    - the errors (no status, or a status >= 400) are always kept.
+    - the slow outliers are always kept: the hits slower than the
+      *outlier_percentile* of the latencies of the previous *window*.
+    - the other hits are sampled systematically, one every 1 / rate, with
+      a rate adjusted every *window* seconds so the kept hits fit the
+      budget left by the errors and outliers.
+
+    :meth:`sample` returns the weight of a kept hit, the number of hits it
+    stands for, or 0 for a dropped hit. Summing the weights gives unbiased
+    counts.
+    """
+    def __init__(self, budget, window=1., outlier_percentile=99,
+                 min_samples=100):
+        self.budget = float(budget)
+        self.window = window
+        self.outlier_percentile = outlier_percentile
+        self.min_samples = min_samples
+        self.rate = 1.
+        self.threshold = None
+        self.dropped = 0
+        self._histogram = LatencyHistogram()
+        self._credit = 0.
+        self._window_end = None
+        self._sampled = self._kept = 0
+        self._expected = None
+
+    def _next_window(self, now):
+        window = self.window
+        elapsed = window
+        if self._window_end is not None:
+            elapsed += now - self._window_end
+        self._window_end = now + window
+
+        if self._histogram.count >= self.min_samples:
+            self.threshold = self._histogram.percentile(
+                self.outlier_percentile)
+        self._histogram.reset()
+
+        # the successes seen per second, smoothed over the windows
+        seen = self._sampled / elapsed
+        if self._expected is None:
+            self._expected = seen
+        else:
+            self._expected = (self._expected + seen) / 2
+        budget = max(self.budget - self._kept / elapsed, self.budget * .1)
+        if self._expected > 0:
+            self.rate = min(budget / self._expected, 1.)
+        self._sampled = self._kept = 0
+
+    def sample(self, status, elapsed, now):
+        """Returns the weight of a hit of *elapsed* microseconds at the
+        time *now*, or 0 if it's not kept.
+        """
+        if self._window_end is None or now >= self._window_end:
+            self._next_window(now)
+        self._histogram.add(elapsed)
+
+        if status is None or status >= 400:
+            self._kept += 1
+            return 1
+        if self.threshold is not None and elapsed > self.threshold:
+            self._kept += 1
+            return 1
+
+        self._sampled += 1
+        self._credit += self.rate
+        if self._credit >= 1:
+            self._credit -= 1
+            return 1. / self.rate
+        self.dropped += 1
+        return 0
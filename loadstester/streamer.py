@@ -1,10 +1,514 @@
-from loadstester.util import DateTimeJSONEncoder
+import datetime
 import json
+import struct
+import sys
+import time
 
+from loadstester.records import LoadsStatus, merge_status
+from loadstester.util import DateTimeJSONEncoder, ns_to_datetime
+
+
+def format_hit(data):
+    """Converts in place the *started* and *elapsed* fields of a hit, when
+    given as nanoseconds, to the ISO date and the number of seconds
+    consumers get in the stream.
+    """
+    started = data.get('started')
+    if isinstance(started, (int, long)):
+        data['started'] = ns_to_datetime(started).isoformat()
+    elapsed = data.get('elapsed')
+    if isinstance(elapsed, (int, long)):
+        data['elapsed'] = elapsed / 1e9
+    return data
+
+
+class BaseStreamer(object):
+    """Base class of the objects the Results instance pushes its events to.
+
+    A streamer receives each event through its ``push(action, **data)``
+    method. Buffering streamers emit pending data on :meth:`flush`, which
+    is also called by :meth:`close` at the end of the run.
+
+    The streamers of :data:`STREAMERS` also have two static methods, used
+    to forward an encoded stream without interleaving partial records
+    coming from several producers: ``split(data)`` splits *data* into
+    complete records and the trailing remainder, and ``decode(data)``
+    returns the events of complete records.
+    """
+    def push_hit(self, hit):
+        """Pushes a :class:`loadstester.records.Hit`."""
+        self.push('hit', **hit.as_dict())
+
+    def push_event(self, action, status, **data):
+        """Pushes an event of a test, with the fields of its *status*."""
+        self.push(action, **merge_status(status, data))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class StdoutStreamer(BaseStreamer):
+    """Emits one JSON document per line. This is the compatibility mode."""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._encoder = DateTimeJSONEncoder()
+
+    def push(self, action, **data):
+        if action == 'hit':
+            format_hit(data)
+        data['action'] = action
+        stream = self.stream or sys.stdout
+        stream.write(self._encoder.encode(data) + '\n')
+
+    def push_hit(self, hit):
+        status = hit.loads_status
+        if isinstance(status, LoadsStatus):
+            status = status.as_dict()
+        data = {'action': 'hit', 'started': hit.started,
+                'elapsed': hit.elapsed, 'status': hit.status,
+                'url': hit.url, 'method': hit.method,
+                'loads_status': status}
+        if hit.time is not None:
+            data['time'] = hit.time
+        if hit.phases is not None:
+            data['phases'] = hit.phases
+        if hit.weight is not None:
+            data['weight'] = hit.weight
+        format_hit(data)
+        stream = self.stream or sys.stdout
+        stream.write(self._encoder.encode(data) + '\n')
+
+    def flush(self):
+        (self.stream or sys.stdout).flush()
+
+    @staticmethod
+    def split(data):
+        pos = data.rfind('\n') + 1
+        return data[:pos], data[pos:]
+
+    @staticmethod
+    def decode(data):
+        return [json.loads(line) for line in data.splitlines() if line]
+
+
+# Binary stream layout
+#
+# The stream is a sequence of frames. Each frame is a big-endian unsigned
+# int giving the payload length, followed by the payload:
+#
+#   - the string table: an unsigned short count, then for each string an
+#     unsigned int length and the utf-8 bytes.
+#   - the records: an unsigned int count, then for each record the string
+#     index of the action, an unsigned short number of fields, and for each
+#     field the string index of its name followed by its tagged value.
+#
+# Strings (names, methods, urls...) are stored once per frame and
+# referenced by their index in the table. A frame holds at most
+# _MAX_STRINGS of them: the streamer starts a new frame before, and an
+# event needing more raises a ValueError.
+
+_FRAME = struct.Struct('>I')
+_USHORT = struct.Struct('>H')
+_UINT = struct.Struct('>I')
+_LONG = struct.Struct('>q')
+_DOUBLE = struct.Struct('>d')
+_RECORD = struct.Struct('>HH')
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MAX_STRINGS = 0xffff
+_INTEGERS = (int, long)
+_MIN_LONG, _MAX_LONG = -2 ** 63, 2 ** 63 - 1
+
+
+def _timedelta_us(td):
+    return (td.days * 86400 + td.seconds) * 10 ** 6 + td.microseconds
+
+
+class _TableFull(ValueError):
+    pass
+
+
+class BinaryStreamer(BaseStreamer):
+    """Buffers the events and writes them in length-prefixed binary frames.
+
+    A frame is written once it reaches *batch_size* bytes, once
+    *flush_interval* seconds went by since the last one, or when the run
+    stops. Use :class:`BinaryDecoder` to read the stream back.
+    """
+    flush_actions = ('stopTestRun',)
+
+    def __init__(self, stream=None, batch_size=64 * 1024,
+                 flush_interval=.5):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._structs = {}
+        self._encoders = {
+            type(None): self._encode_none,
+            bool: self._encode_bool,
+            int: self._encode_int,
+            long: self._encode_int,
+            float: self._encode_float,
+            str: self._encode_str,
+            unicode: self._encode_str,
+            list: self._encode_list,
+            tuple: self._encode_list,
+            dict: self._encode_dict,
+            datetime.datetime: self._encode_datetime,
+            datetime.timedelta: self._encode_timedelta,
+            LoadsStatus: self._encode_status}
+        self._reset()
+
+    def _reset(self):
+        self._strings = {}
+        self._table = []
+        self._records = []
+        self._size = 0
+        self._last_flush = time.time()
+
+    def _index(self, value):
+        index = self._strings.get(value)
+        if index is None:
+            if isinstance(value, unicode):
+                encoded = value.encode('utf8')
+            else:
+                encoded = value
+            if len(self._table) >= _MAX_STRINGS:
+                raise _TableFull('A frame of the binary streamer holds at '
+                                 'most %d strings' % _MAX_STRINGS)
+            index = self._strings[value] = len(self._table)
+            self._table.append(_UINT.pack(len(encoded)) + encoded)
+            self._size += len(encoded) + 4
+        return index
+
+    def _encode_none(self, value):
+        return 'N'
+
+    def _encode_bool(self, value):
+        return value and 'T' or 'F'
+
+    def _encode_int(self, value):
+        if _MIN_LONG <= value <= _MAX_LONG:
+            return 'i' + _LONG.pack(value)
+        return self._encode_json(value)
+
+    def _encode_float(self, value):
+        return 'd' + _DOUBLE.pack(value)
+
+    def _encode_str(self, value):
+        return 's' + _USHORT.pack(self._index(value))
+
+    def _encode_list(self, value):
+        # lists of integers, like the phases of the hits, in one call. The
+        # bools and floats would be packed as integers: they're encoded
+        # one by one.
+        if not [item for item in value if type(item) not in _INTEGERS]:
+            try:
+                return self._pack(('>cI',) + ('cq',) * len(value),
+                                  ['l', len(value)] +
+                                  [item for int_ in value
+                                   for item in ('i', int_)])
+            except struct.error:
+                pass
+        return 'l' + _UINT.pack(len(value)) + ''.join(
+            [self._encode(item) for item in value])
+
+    def _encode_status(self, value):
+        index = self._index
+        if (value.extra is not None or value.lag is not None or
+                value.scenario is not None):
+            return self._encode_dict(value.as_dict())
+        try:
+            return self._pack(('>cI', 'Hcq' * 4),
+                              ('m', 4, index('current_hit'), 'i',
+                               value.current_hit, index('nb_hits'), 'i',
+                               value.nb_hits, index('current_user'), 'i',
+                               value.current_user, index('nb_users'), 'i',
+                               value.nb_users))
+        except struct.error:
+            return self._encode_dict(value.as_dict())
+
+    def _encode_dict(self, value):
+        return 'm' + _UINT.pack(len(value)) + ''.join(
+            [_USHORT.pack(self._index(key)) + self._encode(item)
+             for key, item in value.iteritems()])
+
+    def _encode_datetime(self, value):
+        if value.tzinfo is not None:
+            return self._encode_str(value.isoformat())
+        return 't' + _LONG.pack(_timedelta_us(value - _EPOCH))
+
+    def _encode_timedelta(self, value):
+        return 'D' + _LONG.pack(_timedelta_us(value))
+
+    def _encode_json(self, value):
+        return 'j' + _USHORT.pack(self._index(
+            json.dumps(value, cls=DateTimeJSONEncoder)))
+
+    def _encode(self, value):
+        encoder = self._encoders.get(type(value), self._encode_json)
+        return encoder(value)
+
+    def _pack(self, fmt, values):
+        fmt = ''.join(fmt)
+        packer = self._structs.get(fmt)
+        if packer is None:
+            if len(self._structs) > 1024:
+                self._structs.clear()
+            packer = self._structs[fmt] = struct.Struct(fmt)
+        return packer.pack(*values)
 
-class StdoutStreamer(object):
     def push(self, action, **data):
-        res = {'action': action}
-        res.update(data)
-        # use sys.stdout
-        print(json.dumps(res, cls=DateTimeJSONEncoder))
+        if len(self._table) + len(data) * 2 + 1 >= _MAX_STRINGS:
+            self.flush()
+        self._retry(action, data.items())
+
+    def push_hit(self, hit):
+        if len(self._table) + 32 >= _MAX_STRINGS:
+            self.flush()
+        items = [('started', hit.started), ('elapsed', hit.elapsed),
+                 ('status', hit.status), ('url', hit.url),
+                 ('method', hit.method), ('loads_status', hit.loads_status)]
+        if hit.time is not None:
+            items.append(('time', hit.time))
+        if hit.phases is not None:
+            items.append(('phases', hit.phases))
+        if hit.weight is not None:
+            items.append(('weight', hit.weight))
+        self._retry('hit', items)
+
+    def _retry(self, action, items):
+        """Pushes the record, in a new frame if its strings don't fit in
+        the current one.
+        """
+        try:
+            self._push(action, items, len(items))
+            return
+        except _TableFull:
+            if not self._records:
+                self._reset()
+                raise
+        self.flush()
+        try:
+            self._push(action, items, len(items))
+        except _TableFull:
+            self._reset()
+            raise
+
+    def _push(self, action, items, nfields):
+        # the scalar fields, by far the most common ones, are packed
+        # with a single struct call. Other values are encoded apart.
+        index, strings = self._index, self._strings
+        chunks = []
+        fmt = ['>HH']
+        values = [index(action), nfields]
+
+        for name, value in items:
+            key = strings.get(name)
+            if key is None:
+                key = index(name)
+            kind = type(value)
+            if kind is int:
+                fmt.append('Hcq')
+                values += (key, 'i', value)
+            elif kind is float:
+                fmt.append('Hcd')
+                values += (key, 'd', value)
+            elif kind is str or kind is unicode:
+                value_index = strings.get(value)
+                if value_index is None:
+                    value_index = index(value)
+                fmt.append('HcH')
+                values += (key, 's', value_index)
+            elif kind is datetime.datetime and value.tzinfo is None:
+                fmt.append('Hcq')
+                values += (key, 't', _timedelta_us(value - _EPOCH))
+            elif kind is datetime.timedelta:
+                fmt.append('Hcq')
+                values += (key, 'D', _timedelta_us(value))
+            else:
+                fmt.append('H')
+                values.append(key)
+                chunks.append(self._pack(fmt, values))
+                chunks.append(self._encode(value))
+                fmt = ['>']
+                values = []
+
+        if values:
+            chunks.append(self._pack(fmt, values))
+        record = ''.join(chunks)
+        self._records.append(record)
+        self._size += len(record)
+
+        if (self._size >= self.batch_size or action in self.flush_actions or
+                time.time() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        payload = ''.join([_USHORT.pack(len(self._table))] + self._table +
+                          [_UINT.pack(len(self._records))] + self._records)
+        stream = self.stream or sys.stdout
+        stream.write(_FRAME.pack(len(payload)) + payload)
+        stream.flush()
+        self._reset()
+
+    @staticmethod
+    def split(data):
+        pos = 0
+        while len(data) - pos >= _FRAME.size:
+            end = pos + _FRAME.size + _FRAME.unpack_from(data, pos)[0]
+            if end > len(data):
+                break
+            pos = end
+        return data[:pos], data[pos:]
+
+    @staticmethod
+    def decode(data):
+        return BinaryDecoder().feed(data)
+
+
+class BinaryDecoder(object):
+    """Decodes the stream produced by :class:`BinaryStreamer`.
+
+    Feed it with the raw bytes as they arrive; it returns the events of
+    every complete frame, as the same dicts a JSON line would decode to.
+    The hits keep their timings in nanoseconds in the frames, and are
+    converted here.
+    """
+    def __init__(self):
+        self._buffer = ''
+        self._decoders = {
+            'N': self._decode_none,
+            'T': self._decode_true,
+            'F': self._decode_false,
+            'i': self._decode_int,
+            'd': self._decode_float,
+            's': self._decode_str,
+            'l': self._decode_list,
+            'm': self._decode_dict,
+            't': self._decode_datetime,
+            'D': self._decode_timedelta,
+            'j': self._decode_json}
+
+    def feed(self, data):
+        self._buffer += data
+        frames, self._buffer = BinaryStreamer.split(self._buffer)
+        events = []
+        pos = 0
+        while pos < len(frames):
+            size = _FRAME.unpack_from(frames, pos)[0]
+            pos += _FRAME.size
+            events.extend(self._decode_frame(frames[pos:pos + size]))
+            pos += size
+        return events
+
+    def _decode_frame(self, payload):
+        count = _USHORT.unpack_from(payload, 0)[0]
+        pos = _USHORT.size
+        table = []
+        for i in range(count):
+            size = _UINT.unpack_from(payload, pos)[0]
+            pos += _UINT.size
+            table.append(payload[pos:pos + size].decode('utf8'))
+            pos += size
+
+        self._table = table
+        count = _UINT.unpack_from(payload, pos)[0]
+        pos += _UINT.size
+        events = []
+        for i in range(count):
+            action, nfields = _RECORD.unpack_from(payload, pos)
+            pos += _RECORD.size
+            event = {}
+            for j in range(nfields):
+                key = table[_USHORT.unpack_from(payload, pos)[0]]
+                event[key], pos = self._decode(payload, pos + _USHORT.size)
+            event['action'] = table[action]
+            if event['action'] == 'hit':
+                format_hit(event)
+            events.append(event)
+        return events
+
+    def _decode(self, payload, pos):
+        return self._decoders[payload[pos]](payload, pos + 1)
+
+    def _decode_none(self, payload, pos):
+        return None, pos
+
+    def _decode_true(self, payload, pos):
+        return True, pos
+
+    def _decode_false(self, payload, pos):
+        return False, pos
+
+    def _decode_int(self, payload, pos):
+        return _LONG.unpack_from(payload, pos)[0], pos + _LONG.size
+
+    def _decode_float(self, payload, pos):
+        return _DOUBLE.unpack_from(payload, pos)[0], pos + _DOUBLE.size
+
+    def _decode_str(self, payload, pos):
+        index = _USHORT.unpack_from(payload, pos)[0]
+        return self._table[index], pos + _USHORT.size
+
+    def _decode_list(self, payload, pos):
+        count = _UINT.unpack_from(payload, pos)[0]
+        pos += _UINT.size
+        items = []
+        for i in range(count):
+            item, pos = self._decode(payload, pos)
+            items.append(item)
+        return items, pos
+
+    def _decode_dict(self, payload, pos):
+        count = _UINT.unpack_from(payload, pos)[0]
+        pos += _UINT.size
+        items = {}
+        for i in range(count):
+            key = self._table[_USHORT.unpack_from(payload, pos)[0]]
+            items[key], pos = self._decode(payload, pos + _USHORT.size)
+        return items, pos
+
+    def _decode_datetime(self, payload, pos):
+        value = _LONG.unpack_from(payload, pos)[0]
+        value = _EPOCH + datetime.timedelta(microseconds=value)
+        return value.isoformat(), pos + _LONG.size
+
+    def _decode_timedelta(self, payload, pos):
+        value = _LONG.unpack_from(payload, pos)[0]
+        return value / float(10 ** 6), pos + _LONG.size
+
+    def _decode_json(self, payload, pos):
+        value, pos = self._decode_str(payload, pos)
+        return json.loads(value), pos
+
+
+def decode_stream(fileobj, chunk_size=64 * 1024):
+    """Iterates over the events of a binary stream read from *fileobj*."""
+    decoder = BinaryDecoder()
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            break
+        for event in decoder.feed(data):
+            yield event
+
+
+STREAMERS = {'json': StdoutStreamer,
+             'binary': BinaryStreamer}
+
+
+def get_streamer(name='json', **options):
+    """Returns an instance of the streamer registered under *name*."""
+    try:
+        klass = STREAMERS[name]
+    except KeyError:
+        raise ValueError('Unknown streamer %r, choose one of %s' %
+                         (name, ', '.join(sorted(STREAMERS))))
+    return klass(**options)
@@ -0,0 +1,39 @@
+import unittest
+import urllib2
+
+from loadstester import bench
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self.process, self.server_url = bench.start_server()
+
+    def tearDown(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def test_server(self):
+        self.assertEqual(urllib2.urlopen(self.server_url + '/fast').read(),
+                         'OK')
+        self.assertEqual(
+            urllib2.urlopen(self.server_url + '/slow?ms=1').read(), 'OK')
+        self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                          self.server_url + '/nope')
+
+    def test_run_bench(self):
+        report = bench.run_bench({'users': 2, 'hits': 5,
+                                  'no_patching': True}, self.server_url)
+        self.assertEqual(report['hits'], 10)
+        self.assertEqual(report['errors'], 0)
+        self.assertTrue(report['output_bytes'] > 0)
+        self.assertTrue(report['streamer_events'] > 10)
+
+    def test_rss(self):
+        rss = bench._rss_kb()
+        self.assertTrue(rss > 0)
+        # the current memory, which goes down when it's freed
+        data = 'x' * (64 * 1024 * 1024)
+        self.assertTrue(bench._rss_kb() > rss + 32 * 1024)
+        del data
+        self.assertTrue(bench._rss_kb() < rss + 32 * 1024)
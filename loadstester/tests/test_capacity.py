@@ -0,0 +1,100 @@
+import unittest
+
+import gevent
+
+from loadstester.capacity import CapacitySearch, report
+from loadstester.case import TestCase
+from loadstester.records import Hit
+from loadstester.tests.test_runner import run, actions
+
+
+class KneeCase(TestCase):
+    __test__ = False
+
+    def test_knee(self):
+        # the latency grows by 10ms with each user
+        users = self.loads_status['nb_users']
+        self._test_result.add_hit_record(
+            Hit(0, users * 10 ** 7, 200, 'http://example.com', 'GET'))
+        gevent.sleep(.01)
+
+
+def _search(search, capacity):
+    levels = []
+    level = search.next_level()
+    while level is not None:
+        levels.append(level)
+        search.record(level, level <= capacity)
+        level = search.next_level()
+    return levels
+
+
+class TestCapacity(unittest.TestCase):
+
+    def test_search(self):
+        self.assertEqual(_search(CapacitySearch(), 5), [1, 2, 4, 8, 6, 5])
+        self.assertEqual(_search(CapacitySearch(), 0), [1])
+        self.assertEqual(_search(CapacitySearch(start=3, maximum=10), 100),
+                         [3, 6, 10])
+        levels = _search(CapacitySearch(start=10, integer=False), 55)
+        self.assertEqual(levels[:4], [10, 20, 40, 80])
+        self.assertTrue(52 <= levels[-1] <= 58)
+        self.assertRaises(ValueError, CapacitySearch, factor=1)
+
+    def test_nothing_passes(self):
+        self.assertEqual(_search(CapacitySearch(start=10, integer=False), 0),
+                         [10, 5., 2.5, 1.25])
+        self.assertEqual(_search(CapacitySearch(start=10, integer=False,
+                                                floor=4), 0), [10, 5.])
+        self.assertEqual(_search(CapacitySearch(start=4), 0), [4, 2, 1])
+
+    def test_report(self):
+        steps = [{'level': 1, 'rps': 10, 'passed': True},
+                 {'level': 2, 'rps': 15, 'passed': True},
+                 {'level': 4, 'rps': 12, 'passed': False}]
+        self.assertEqual(report('users', steps),
+                         {'mode': 'users', 'level': 2, 'max_rps': 15,
+                          'steps': steps})
+        self.assertEqual(report('users', steps[2:])['level'], None)
+
+    def test_users(self):
+        fqn = 'loadstester.tests.test_capacity.KneeCase.test_knee'
+        res, events = run(fqn=fqn, capacity='users', capacity_slo='p95<55',
+                          capacity_warmup=.05, capacity_step=.2)
+        self.assertEqual(res, None)
+        capacity = actions(events, 'capacity')[0]
+        self.assertEqual(capacity['level'], 5)
+        steps = capacity['steps']
+        self.assertEqual([step['level'] for step in steps],
+                         [1, 2, 4, 8, 6, 5])
+        self.assertEqual([step['p50'] for step in steps],
+                         [10, 20, 40, 80, 60, 50])
+        self.assertEqual(steps[3]['failed'], ['p95<55'])
+        self.assertTrue(steps[-1]['rps'] > 0)
+        self.assertEqual(capacity['max_rps'],
+                         max([step['rps'] for step in steps
+                              if step['passed']]))
+
+    def test_rate(self):
+        fqn = 'loadstester.tests.test_capacity.KneeCase.test_knee'
+        res, events = run(fqn=fqn, capacity='rate', capacity_start=20,
+                          capacity_warmup=.05, capacity_step=.5,
+                          capacity_steps=1, pool_size=10)
+        steps = actions(events, 'capacity')[0]['steps']
+        self.assertEqual(len(steps), 1)
+        self.assertEqual(steps[0]['level'], 20)
+        self.assertTrue(steps[0]['hits'] > 0)
+        self.assertEqual(steps[0]['p50'], 100)
+        # every step fails
+        res, events = run(fqn=fqn, capacity='rate', capacity_start=20,
+                          capacity_warmup=0, capacity_step=.1,
+                          capacity_slo='p50<1', pool_size=10)
+        capacity = actions(events, 'capacity')[0]
+        self.assertEqual(capacity['level'], None)
+        self.assertEqual([step['level'] for step in capacity['steps']],
+                         [20, 10])
+        self.assertFalse([step for step in capacity['steps']
+                          if step['passed']])
+
+        self.assertRaises(ValueError, run, capacity='load')
+        self.assertRaises(ValueError, run, capacity='users', processes=2)
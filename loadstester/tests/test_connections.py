@@ -0,0 +1,104 @@
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from requests.sessions import Session
+
+from loadstester.connections import (SharedStrategy, FixedPoolStrategy,
+                                     PerUserStrategy, get_strategy,
+                                     reset_strategies)
+from loadstester.measure import Session as LoadsSession
+from loadstester.results import Results
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('OK')
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestConnections(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _hit(self, strategy, sessions=1, hits=5):
+        for i in range(sessions):
+            session = Session()
+            session.mount('http://', strategy.get_adapter())
+            for j in range(hits):
+                self.assertEqual(session.get(self.url).content, 'OK')
+        return strategy.get_stats()
+
+    def test_per_user(self):
+        stats = self._hit(PerUserStrategy(), sessions=2)
+        self.assertEqual(stats['connections'], 2)
+        self.assertEqual(stats['reused'], 8)
+
+    def test_shared(self):
+        stats = self._hit(SharedStrategy(), sessions=2)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 9)
+        self.assertEqual(stats['strategy'], 'process')
+
+    def test_fixed_pool_max_requests(self):
+        stats = self._hit(FixedPoolStrategy(pool_size=1, max_requests=2))
+        self.assertEqual(stats['connections'], 3)
+        self.assertEqual(stats['reused'], 2)
+
+    def test_get_strategy(self):
+        config = {'connection_strategy': 'fixed'}
+        strategy = get_strategy(config)
+        self.assertTrue(strategy is get_strategy(config))
+        self.assertEqual(strategy.pool_size, 10)
+        self.assertRaises(ValueError, get_strategy,
+                          {'connection_strategy': 'h3'})
+        reset_strategies()
+        self.assertFalse(strategy is get_strategy(config))
+
+    def test_max_con(self):
+        from loadstester.case import MAX_CON
+        self.assertEqual(PerUserStrategy().pool_size, MAX_CON)
+
+    def test_phases(self):
+        hits = []
+
+        class FakeResults(Results):
+            def add_hit_record(self, hit):
+                hits.append(hit.as_dict())
+
+        session = LoadsSession(test=None, test_result=FakeResults())
+        session.mount('http://', PerUserStrategy().get_adapter())
+        session.get(self.url)
+        session.get(self.url)
+
+        for hit in hits:
+            self.assertEqual(len(hit['phases']), 5)
+            self.assertTrue(hit['elapsed'] >= sum(hit['phases'][1:]))
+            self.assertTrue(hit['started'] > 10 ** 18)
+
+        dns, connect, tls, ttfb, body = hits[0]['phases']
+        self.assertTrue(dns > 0 and connect > 0 and ttfb > 0)
+        self.assertEqual(tls, 0)
+        # the connection is reused
+        self.assertEqual(hits[1]['phases'][1], 0)
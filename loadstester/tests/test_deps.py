@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from loadstester.deps import DepsCache, parse_deps
+
+
+class FakeCache(DepsCache):
+    def __init__(self, *args, **kw):
+        super(FakeCache, self).__init__(*args, **kw)
+        self.installed = []
+
+    def _install(self, dep, target, build_dir):
+        self.installed.append(dep)
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        # the later requirements override the earlier ones
+        with open(os.path.join(target, 'common.py'), 'w') as f:
+            f.write(dep)
+        with open(os.path.join(target, dep + '.py'), 'w') as f:
+            f.write('')
+
+
+class TestDepsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for root, dirnames, filenames in os.walk(self.tmp):
+            os.chmod(root, 0755)
+        shutil.rmtree(self.tmp)
+
+    def test_parse_deps(self):
+        self.assertEqual(parse_deps(['b, a', 'a,,c']), ['b', 'a', 'c'])
+
+    def test_get(self):
+        cache = FakeCache(os.path.join(self.tmp, 'cache'))
+        paths, warm = cache.get(['two', 'one'])
+        self.assertFalse(warm)
+        self.assertEqual(cache.installed, ['two', 'one'])
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(sorted(os.listdir(paths[0])),
+                         ['common.py', 'one.py', 'two.py'])
+        with open(os.path.join(paths[0], 'common.py')) as f:
+            self.assertEqual(f.read(), 'one')
+        self.assertEqual(os.stat(paths[0]).st_mode & 0222, 0)
+
+        self.assertEqual(cache.get(['two', 'one']), (paths, True))
+        self.assertEqual(len(cache.installed), 2)
+        # another order is another environment
+        other, warm = cache.get(['one', 'two'])
+        self.assertFalse(warm)
+        self.assertNotEqual(other, paths)
+        self.assertEqual(len(cache.installed), 4)
+
+    def test_concurrent_get(self):
+        cache = FakeCache(os.path.join(self.tmp, 'cache'))
+        results = []
+
+        def get():
+            results.append(cache.get(['one'])[1])
+
+        threads = [threading.Thread(target=get) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.installed, ['one'])
+        self.assertEqual(sorted(results), [False, True, True, True])
+
+    def test_failed_install(self):
+        class FailingCache(FakeCache):
+            def _install(self, dep, target, build_dir):
+                raise Exception('nope')
+
+        cache = FailingCache(os.path.join(self.tmp, 'cache'))
+        self.assertRaises(Exception, cache.get, ['one'])
+        self.assertEqual([name for name in os.listdir(cache.cache_dir)
+                          if not name.endswith('.lock')], [])
+
+    def test_shared_cache(self):
+        path = os.path.join(self.tmp, 'cache')
+        os.mkdir(path)
+        os.chmod(path, 0777)
+        self.assertRaises(ValueError, FakeCache(path).get, ['one'])
+
+        os.chmod(path, 0755)
+        self.assertEqual(FakeCache(path).get(['one'])[1], False)
+        self.assertTrue(DepsCache().cache_dir.endswith(
+            os.path.join('.cache', 'loads-deps')))
@@ -0,0 +1,145 @@
+import socket
+import ssl
+import threading
+import time
+import unittest
+
+try:
+    import h2.connection
+    import h2.events
+    import requests
+    from loadstester.http2 import HTTP2Strategy, _ssl_context
+except ImportError:
+    h2 = None
+
+from loadstester.connections import get_strategy
+from loadstester.measure import Session
+from loadstester.results import Results
+
+
+class H2Server(object):
+    """A HTTP/2 server answering 'OK' once *batch* requests are pending,
+    or after half a second.
+    """
+    def __init__(self, batch):
+        self.batch = batch
+        self.connections = 0
+        self.max_streams = 0
+        self.authorities = set()
+        self.conns = []
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn = self.sock.accept()[0]
+            except socket.error:
+                return
+            self.connections += 1
+            self.conns.append(conn)
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, sock):
+        conn = h2.connection.H2Connection(client_side=False)
+        conn.initiate_connection()
+        sock.settimeout(.5)
+        pending = []
+        while True:
+            try:
+                sock.sendall(conn.data_to_send())
+                data = sock.recv(65535)
+            except socket.timeout:
+                data = None
+            except socket.error:
+                break
+            else:
+                if not data:
+                    break
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        pending.append(event.stream_id)
+                        self.authorities.add(dict(event.headers)[':authority'])
+            self.max_streams = max(self.max_streams, len(pending))
+            if pending and (data is None or len(pending) >= self.batch):
+                for stream_id in pending:
+                    conn.send_headers(stream_id, [(':status', '200'),
+                                                  ('content-length', '2')])
+                    conn.send_data(stream_id, 'OK', end_stream=True)
+                pending = []
+        sock.close()
+
+    def close(self):
+        self.sock.close()
+        for conn in self.conns:
+            conn.close()
+
+
+@unittest.skipIf(h2 is None, 'needs the hyper library')
+class TestHTTP2(unittest.TestCase):
+
+    def test_multiplexing(self):
+        server = H2Server(batch=5)
+        self.addCleanup(server.close)
+        url = 'http://127.0.0.1:%d/' % server.port
+        strategy = HTTP2Strategy(pool_size=1)
+        hits = []
+
+        class FakeResults(Results):
+            def add_hit_record(self, hit):
+                hits.append(hit)
+
+        def user():
+            session = Session(test=None, test_result=FakeResults(),
+                              dns_resolve=False)
+            session.mount('http://', strategy.get_adapter())
+            self.assertEqual(session.get(url).content, 'OK')
+
+        users = [threading.Thread(target=user) for i in range(5)]
+        start = time.time()
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+
+        # the 5 requests were in flight together, on one connection
+        self.assertTrue(time.time() - start < .5)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(server.max_streams, 5)
+        stats = strategy.get_stats()
+        self.assertEqual((stats['connections'], stats['reused']), (1, 4))
+        self.assertEqual(len(hits), 5)
+        for hit in hits:
+            self.assertEqual(hit.status, 200)
+            self.assertEqual(len(hit.phases), 5)
+
+    def test_authority(self):
+        server = H2Server(batch=1)
+        self.addCleanup(server.close)
+        session = Session(test=None, test_result=None)
+        session.mount('http://', get_strategy(
+            {'connection_strategy': 'http2'}).get_adapter())
+        session.get('http://localhost:%d/' % server.port)
+        # the host name, not the address it was resolved to
+        self.assertEqual(server.authorities, set(['localhost']))
+
+    def test_timeout_and_verify(self):
+        # the server waits for a second request before answering
+        server = H2Server(batch=2)
+        self.addCleanup(server.close)
+        session = Session(test=None, test_result=None, dns_resolve=False)
+        session.mount('http://', HTTP2Strategy().get_adapter())
+        self.assertRaises(requests.exceptions.Timeout, session.get,
+                          'http://127.0.0.1:%d/' % server.port, timeout=.1)
+
+        self.assertTrue(_ssl_context(None, True) is None)
+        context = _ssl_context(None, False)
+        self.assertEqual(context.verify_mode, ssl.CERT_NONE)
+        self.assertFalse(context.check_hostname)
@@ -0,0 +1,106 @@
+import httplib
+import unittest
+
+from loadstester.case import TestCase
+from loadstester.metrics import LiveMetrics
+from loadstester.records import Hit
+from loadstester.tests.test_runner import run
+
+
+class FakeResults(object):
+    in_flight = 2
+
+
+class FakeRunner(object):
+    active_users = 3
+    test_result = FakeResults()
+
+
+class ScrapeCase(TestCase):
+    __test__ = False
+    scraped = []
+
+    def test_scrape(self):
+        # the run is live: the test is counted, not yet added
+        metrics = self._test_result.observers[0]
+        conn = httplib.HTTPConnection('127.0.0.1', metrics.port)
+        metrics.refresh()
+        conn.request('GET', '/metrics')
+        self.scraped.append(conn.getresponse().read())
+        conn.close()
+
+
+def _values(text):
+    values = {}
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+
+class TestLiveMetrics(unittest.TestCase):
+
+    def test_rolling(self):
+        metrics = LiveMetrics(FakeRunner(), window=2)
+        for status, elapsed in ((200, 10 ** 6), (200, 3 * 10 ** 6),
+                                (500, 10 ** 7), (None, 10 ** 5)):
+            metrics.add_hit(Hit(0, elapsed, status, '/', 'GET'))
+        metrics.add_event('addSuccess')
+        metrics.add_event('startTest')
+
+        # no percentiles until the first second is over
+        values = _values(metrics.render())
+        self.assertEqual(values['loads_hits_total'], 4)
+        self.assertEqual(values['loads_hit_errors_total'], 2)
+        self.assertEqual(values['loads_tests_total{result="success"}'], 1)
+        self.assertEqual(values['loads_requests_per_second'], 0)
+        self.assertEqual(values['loads_requests_in_flight'], 2)
+        self.assertEqual(values['loads_active_users'], 3)
+        self.assertFalse([name for name in values
+                          if name.startswith('loads_latency_seconds')])
+
+        metrics.rolling.tick(metrics.rolling._slot_end)
+        values = _values(metrics.render())
+        self.assertEqual(values['loads_requests_per_second'], 4)
+        self.assertEqual(values['loads_error_ratio'], .5)
+        self.assertEqual(values['loads_latency_seconds{quantile="0.99"}'],
+                         .01)
+        self.assertTrue(values['process_cpu_seconds_total'] > 0)
+        self.assertTrue('python_gc_objects_pending{generation="0"}' in values)
+
+        # the hits leave the window
+        metrics.rolling.tick(metrics.rolling._slot_end + 5)
+        values = _values(metrics.render())
+        self.assertEqual(values['loads_requests_per_second'], 0)
+        self.assertEqual(values['loads_hits_total'], 4)
+
+    def test_serve(self):
+        metrics = LiveMetrics(FakeRunner())
+        port = metrics.start()
+        try:
+            conn = httplib.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', '/metrics')
+            resp = conn.getresponse()
+            self.assertEqual(resp.status, 200)
+            self.assertTrue('loads_active_users 3' in resp.read())
+            conn.close()
+
+            conn = httplib.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', '/other')
+            self.assertEqual(conn.getresponse().status, 404)
+            conn.close()
+        finally:
+            metrics.stop()
+
+    def test_runner(self):
+        del ScrapeCase.scraped[:]
+        fqn = 'loadstester.tests.test_metrics.ScrapeCase.test_scrape'
+        res, events = run(fqn=fqn, users='2', hits='2', metrics_port=0)
+        self.assertEqual(res, None)
+        self.assertEqual(len(ScrapeCase.scraped), 4)
+        scraped = [_values(text) for text in ScrapeCase.scraped]
+        self.assertEqual(max([values['loads_active_users']
+                              for values in scraped]), 2)
+        self.assertEqual(scraped[-1]['loads_tests_total{result="success"}'],
+                         3)
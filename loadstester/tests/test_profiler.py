@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import gevent
+
+from loadstester.profiler import SamplingProfiler
+from loadstester.tests.test_runner import run
+
+
+def _block_the_loop():
+    # a real sleep, the loop can't run meanwhile
+    time.sleep(.1)
+
+
+def _read(path):
+    with open(path) as f:
+        return [line.rsplit(' ', 1) for line in f.read().splitlines()]
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_blocking(self):
+        profiler = SamplingProfiler(interval=.002, block_threshold=.02)
+        profiler.start()
+        try:
+            gevent.spawn(_block_the_loop).join()
+            gevent.sleep(.05)
+        finally:
+            profiler.stop()
+        self.assertTrue(profiler.nb_samples > 10)
+        self.assertEqual(profiler.nb_blocks, 1)
+
+        path = os.path.join(self.dir, 'profile')
+        profiler.write(path)
+        stacks = _read(path)
+        self.assertTrue([stack for stack, count in stacks
+                         if stack.startswith('hub;')])
+        blocking = [stack for stack, count in stacks if stack.startswith(
+            'greenlet;') and '_block_the_loop' in stack]
+        self.assertTrue(blocking)
+
+        blocks = _read(path + '.blocking')
+        self.assertEqual(len(blocks), 1)
+        stack, ms = blocks[0]
+        self.assertTrue(stack.endswith(
+            'loadstester.tests.test_profiler:_block_the_loop'))
+        self.assertTrue(80 <= int(ms) < 200)
+
+    def test_runner(self):
+        path = os.path.join(self.dir, 'profile')
+        res, events = run(users='2', hits='5', profile=path)
+        self.assertEqual(res, None)
+        self.assertTrue(os.path.exists(path))
+
+        # the loop runs long enough to be sampled
+        res, events = run(users='2', duration=.5, profile=path,
+                          profile_interval=2)
+        self.assertEqual(res, None)
+        self.assertTrue([stack for stack, count in _read(path)
+                         if stack.startswith('hub;')])
+        self.assertTrue(os.path.exists(path + '.blocking'))
@@ -0,0 +1,42 @@
+import unittest
+
+from loadstester.records import LoadsStatus, Hit
+
+
+class TestRecords(unittest.TestCase):
+
+    def test_status(self):
+        status = LoadsStatus(current_user=2, nb_users=5)
+        status['current_hit'] += 1
+        status['scenario'] = 'browse'
+        status['custom'] = 'value'
+        self.assertEqual(status['current_hit'], 1)
+        self.assertEqual(status.get('lag'), None)
+        self.assertFalse('lag' in status)
+        self.assertTrue('custom' in status)
+        self.assertRaises(KeyError, status.__getitem__, 'missing')
+        self.assertEqual(status, {'current_hit': 1, 'nb_hits': 0,
+                                  'current_user': 2, 'nb_users': 5,
+                                  'scenario': 'browse', 'custom': 'value'})
+
+        copy = status.copy()
+        status['current_hit'] += 1
+        status['custom'] = 'changed'
+        self.assertEqual(copy['current_hit'], 1)
+        self.assertEqual(copy['custom'], 'value')
+        self.assertEqual(LoadsStatus.from_dict(copy), copy)
+
+        data = {'action': 'startTest'}
+        copy.merge_into(data)
+        self.assertEqual(data['current_user'], 2)
+        self.assertEqual(data['action'], 'startTest')
+
+    def test_hit(self):
+        status = LoadsStatus(1, 10, 1, 1)
+        hit = Hit(1380000001250000000, 10 ** 6, 200, '/', 'GET',
+                  loads_status=status)
+        self.assertFalse(hasattr(hit, '__dict__'))
+        data = hit.as_dict()
+        self.assertEqual(data['loads_status'], status.as_dict())
+        self.assertFalse('time' in data or 'phases' in data)
+        self.assertTrue('time' in hit.stamp().as_dict())
@@ -0,0 +1,84 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from loadstester import replay
+from loadstester.replay import read_records, shard
+from loadstester.tests.test_runner import run, actions
+
+
+REPLAYED = []
+
+
+class RecordingCase(replay.ReplayCase):
+    # only run by the runner
+    __test__ = False
+
+    def replay(self, record):
+        REPLAYED.append((self.loads_status['current_user'], record))
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        del REPLAYED[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, records, name='records.jsonl', opener=open):
+        path = os.path.join(self.dir, name)
+        f = opener(path, 'wb')
+        try:
+            for record in records:
+                f.write(json.dumps(record) + '\n\n')
+        finally:
+            f.close()
+        return path
+
+    def test_read_records(self):
+        records = [{'url': '/%d' % i} for i in range(3)]
+        for name, opener in (('plain.jsonl', open),
+                             ('gzipped.jsonl.gz', gzip.open)):
+            path = self._write(records, name, opener)
+            self.assertEqual(list(read_records(path)), records)
+
+        path = self._write([{'method': 'GET'}])
+        self.assertRaises(ValueError, list, read_records(path))
+
+    def test_shard(self):
+        self.assertEqual(shard({'url': '/'}, 7, 3), 1)
+        users = set([shard({'session': 'abc'}, index, 5)
+                     for index in range(10)])
+        self.assertEqual(len(users), 1)
+        self.assertEqual(shard({'session': u'abc'}, 0, 5), users.pop())
+
+    def test_replay(self):
+        records = []
+        for i in range(20):
+            records.append({'url': '/%d' % i, 'session': 's%d' % (i % 4),
+                            'time': 1000 + i * .01})
+        path = self._write(records)
+        res, events = run(replay=path, users='3', replay_speed=2,
+                          fqn='loadstester.tests.test_replay.RecordingCase'
+                              '.test_replay')
+        self.assertEqual(res, None)
+        self.assertEqual(len(actions(events, 'addSuccess')), 20)
+        self.assertEqual(sorted([record['url'] for user, record in REPLAYED]),
+                         sorted([record['url'] for record in records]))
+
+        # each session is replayed in order by a single user
+        sessions = {}
+        for user, record in REPLAYED:
+            sessions.setdefault(record['session'], []).append((user, record))
+        for replayed in sessions.values():
+            self.assertEqual(len(set([user for user, record in replayed])), 1)
+            times = [record['time'] for user, record in replayed]
+            self.assertEqual(times, sorted(times))
+
+        lags = [event['lag'] for event in actions(events, 'startTest')]
+        self.assertTrue(max(lags) < .1, lags)
@@ -0,0 +1,78 @@
+import sys
+import unittest
+from StringIO import StringIO
+
+from loadstester.case import TestCase
+from loadstester.results import LoadResults
+from loadstester.runner import Runner
+from loadstester.streamer import decode_stream
+from loadstester.tests.test_runner import run, actions
+from loadstester.tests.test_stats import FakeStreamer
+
+
+class MyCase(TestCase):
+    def failing(self):
+        {}['missing']
+
+
+class TestLoadResults(unittest.TestCase):
+
+    def test_bounded_errors(self):
+        streamer = FakeStreamer()
+        results = LoadResults(streamer=streamer, max_signatures=1)
+        test = MyCase('failing', test_result=results)
+        status = {'current_hit': 1}
+
+        for i in range(10):
+            test(loads_status=status)
+            status['current_hit'] += 1
+
+        def raise_value_error():
+            raise ValueError()
+
+        for i in range(3):
+            try:
+                raise_value_error()
+            except ValueError:
+                results.addError(test, sys.exc_info())
+
+        self.assertEqual(results.nb_errors, 13)
+        self.assertEqual(len(results.errors), 3)
+        self.assertFalse(results.wasSuccessful())
+
+        results.stopTestRun('agent')
+        summary = streamer.events[-1][1]['error_summary']
+        counts = sorted([(error['type'], error['count'])
+                         for error in summary])
+        self.assertEqual(counts, [(None, 3), ('KeyError', 10)])
+
+        # each event carries the status at the start of its test
+        hits = [data['current_hit'] for action, data in streamer.events
+                if action == 'addError']
+        self.assertEqual(hits[:10], range(1, 11))
+
+    def test_processes(self):
+        # each worker streams the summary of its errors
+        fqn = 'loadstester.tests.test_results.MyCase.failing'
+        res, events = run(fqn=fqn, users='3', hits='2', processes=2)
+        self.assertEqual(res, 1)
+        summaries = actions(events, 'error_summary')
+        self.assertEqual(len(summaries), 2)
+        self.assertEqual(sum([summary['error_summary'][0]['count']
+                              for summary in summaries]), 6)
+        self.assertEqual(events[-1]['action'], 'stopTestRun')
+        # and the parent merges them
+        summary = events[-1]['error_summary']
+        self.assertEqual([(error['type'], error['count'])
+                          for error in summary], [('KeyError', 6)])
+
+        # in the binary stream too
+        old_stream, sys.stdout = sys.stdout, StringIO()
+        try:
+            Runner({'fqn': fqn, 'users': '3', 'hits': '2', 'processes': 2,
+                    'streamer': 'binary', 'no_patching': True}).execute()
+        finally:
+            output, sys.stdout = sys.stdout, old_stream
+        output.seek(0)
+        events = list(decode_stream(output))
+        self.assertEqual(events[-1]['error_summary'][0]['count'], 6)
@@ -0,0 +1,219 @@
+import json
+import sys
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+import gevent
+
+from loadstester.case import TestCase
+from loadstester.engines import ThreadEngine
+from loadstester.runner import Runner, _split_users, _UserPool, _IdleUsers
+
+
+class NoopCase(TestCase):
+    def test_noop(self):
+        self.incr_counter('noop')
+
+    def test_other(self):
+        self.incr_counter('other')
+
+
+class SlowCase(TestCase):
+    def slow(self):
+        # the first hit of each user ends in time, the second is killed
+        hits = self.loads_status['current_hit']
+        gevent.sleep(hits == 1 and .05 or 1)
+
+
+def run(**options):
+    args = {'fqn': 'loadstester.tests.test_runner.NoopCase.test_noop',
+            'no_patching': True}
+    args.update(options)
+
+    old_stream = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        res = Runner(args).execute()
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout = old_stream
+
+    events = [json.loads(line) for line in output.splitlines()]
+    return res, events
+
+
+def actions(events, action):
+    return [event for event in events if event['action'] == action]
+
+
+class TestRunner(unittest.TestCase):
+
+    def test_split_users(self):
+        self.assertEqual(_split_users([5, 1], 2),
+                         [[(0, 3), (0, 1)], [(3, 2), (1, 0)]])
+
+    def test_processes(self):
+        res, events = run(users='5', hits='3', processes=2)
+        self.assertEqual(res, None)
+        self.assertEqual(events[0]['action'], 'startTestRun')
+        self.assertEqual(events[-1]['action'], 'stopTestRun')
+        self.assertEqual(len(actions(events, 'startTestRun')), 1)
+        self.assertTrue('resolve' in events[0]['startup'])
+        self.assertEqual(len(actions(events, 'addSuccess')), 15)
+        users = set([event['current_user']
+                     for event in actions(events, 'incr')])
+        self.assertEqual(users, set(range(1, 6)))
+
+    def test_arrival_rate(self):
+        res, events = run(rate_profile='0.2:0-100,0.1:100', pool_size=3)
+        self.assertEqual(len(actions(events, 'addSuccess')), 20)
+        lags = [event['lag'] for event in actions(events, 'incr')]
+        self.assertEqual(len(lags), 20)
+        self.assertTrue(max(lags) < .1)
+        users = set([event['current_user']
+                     for event in actions(events, 'incr')])
+        self.assertTrue(users <= set([1, 2, 3]))
+
+    def test_idle_users(self):
+        idle = _IdleUsers(2)
+        self.assertEqual(idle.take('a'), (0, None))
+        self.assertEqual(idle.take('a'), (1, None))
+        idle.release(1, 'test 1', 'a')
+        idle.release(0, 'test 0', 'a')
+        self.assertEqual(idle.take('a'), (0, 'test 0'))
+
+        # the other scenario takes the index of the idle user
+        self.assertEqual(idle.take('b'), (1, None))
+        self.assertEqual(idle.tests, {'a': [], 'b': []})
+        idle.release(1, 'test 1', 'b')
+        idle.release(0, 'test 0', 'a')
+        self.assertEqual(idle.take('b'), (1, 'test 1'))
+
+    def test_user_profile(self):
+        created = []
+
+        class CountingRunner(Runner):
+            def _func2test(self, test):
+                created.append(test)
+                return Runner._func2test(self, test)
+
+        args = {'fqn': 'loadstester.tests.test_runner.NoopCase.test_noop',
+                'no_patching': True,
+                'user_profile': '0.1:3,0.1:3,0.05:1,0.1:3,0:0'}
+        old_stream = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            CountingRunner(args).execute()
+        finally:
+            output = sys.stdout.getvalue()
+            sys.stdout = old_stream
+
+        events = [json.loads(line) for line in output.splitlines()]
+        users = set([event['current_user']
+                     for event in actions(events, 'incr')])
+        self.assertEqual(users, set([1, 2, 3]))
+        self.assertEqual(len(actions(events, 'startTestRun')), 1)
+        # the users removed during the ramp down are reused
+        self.assertEqual(len(created), 3)
+
+    def _scenarios(self):
+        fqn = 'loadstester.tests.test_runner.NoopCase.test_'
+        return [{'fqn': fqn + 'noop', 'weight': 3, 'name': 'noop'},
+                {'fqn': fqn + 'other', 'users': 1}]
+
+    def _count(self, events):
+        counts = {}
+        for event in actions(events, 'incr'):
+            counts[event['scenario']] = counts.get(event['scenario'], 0) + 1
+        return counts
+
+    def test_scenarios(self):
+        other = 'loadstester.tests.test_runner.NoopCase.test_other'
+        res, events = run(users='5', hits='2', scenarios=self._scenarios(),
+                          processes=2)
+        self.assertEqual(res, None)
+        self.assertEqual(self._count(events), {'noop': 8, other: 2})
+
+        res, events = run(rate_profile='0.2:0-50', scenarios=self._scenarios())
+        self.assertEqual(self._count(events), {'noop': 4, other: 1})
+
+    def test_scenarios_user_pool(self):
+        runner = Runner({'scenarios': self._scenarios(), 'no_patching': True})
+        runner._resolve_name()
+        runner._run_user = lambda user, pool: None
+        pool = _UserPool(runner)
+        pool.resize(5)
+        self.assertEqual([user.scenario.name for user in pool.active],
+                         ['noop'] * 4 + [runner.scenarios[1].name])
+        pool.resize(2)
+        self.assertEqual(sorted([user.index for user in pool.active]),
+                         [0, 4])
+        pool.resize(3)
+        self.assertEqual(sorted([user.index for user in pool.active]),
+                         [0, 1, 4])
+
+    def test_sinks(self):
+        res, events = run(users='2', hits='3', sinks=['stdout'],
+                          backpressure='drop-oldest')
+        self.assertEqual(len(actions(events, 'addSuccess')), 6)
+        self.assertEqual(events[-1]['action'], 'stopTestRun')
+        self.assertEqual(events[-1]['dropped_events'], 0)
+
+    def test_duration(self):
+        start = time.time()
+        res, events = run(users='3', duration=.2)
+        self.assertTrue(time.time() - start < .5)
+        hits = actions(events, 'incr')
+        self.assertTrue(hits)
+        for user in (1, 2, 3):
+            user_hits = [event for event in hits
+                         if event['current_user'] == user]
+            self.assertEqual([event['current_hit'] for event in user_hits],
+                             range(1, len(user_hits) + 1))
+            self.assertEqual([event['nb_hits'] for event in user_hits],
+                             range(1, len(user_hits) + 1))
+        self.assertFalse([event for event in events if 'nb_hits ' in event])
+
+    def test_grace_period(self):
+        start = time.time()
+        res, events = run(users='2', duration=.1, grace_period=.1,
+                          fqn='loadstester.tests.test_runner.SlowCase.slow')
+        self.assertEqual(res, 1)
+        self.assertEqual(len(actions(events, 'addError')), 2)
+        self.assertEqual(len(actions(events, 'addSuccess')), 2)
+        self.assertTrue(time.time() - start < .5)
+
+    def test_threads_engine(self):
+        res, events = run(users='4', hits='5', engine='threads')
+        self.assertEqual(res, None)
+        self.assertEqual(len(actions(events, 'addSuccess')), 20)
+        users = set([event['current_user']
+                     for event in actions(events, 'incr')])
+        self.assertEqual(users, set(range(1, 5)))
+        self.assertEqual(events[-1]['action'], 'stopTestRun')
+
+        res, events = run(users='2', duration=.1, engine='threads')
+        self.assertTrue(actions(events, 'addSuccess'))
+        self.assertRaises(ValueError, run, rate_profile='10:0-10',
+                          engine='threads')
+
+    def test_threads_engine_close(self):
+        engine = ThreadEngine()
+        calls = []
+
+        class Results(object):
+            def add(self, value):
+                calls.append(value)
+
+        results = engine.synchronize(Results())
+        results.add(1)
+        engine.close(results)
+
+        # a user left running after the end of the run
+        thread = threading.Thread(target=results.add, args=(2,))
+        thread.start()
+        thread.join()
+        results.add(3)
+        self.assertEqual(calls, [1, 3])
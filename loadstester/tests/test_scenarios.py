@@ -0,0 +1,44 @@
+import unittest
+
+from loadstester.scenarios import (Scenario, parse_scenarios, allocate_users,
+                                   assign_users, WeightedPicker)
+
+
+class TestScenarios(unittest.TestCase):
+
+    def test_parse(self):
+        scenarios = parse_scenarios([{'fqn': 'a.B.test_c'},
+                                     {'fqn': 'a.B.test_d', 'users': 2,
+                                      'think_time': '1.5'}])
+        self.assertEqual(scenarios[0].weight, 1)
+        self.assertEqual(scenarios[1].think_time, 1.5)
+        self.assertEqual(scenarios[1].name, 'a.B.test_d')
+        self.assertRaises(ValueError, parse_scenarios, [])
+        self.assertRaises(ValueError, parse_scenarios, [{'weight': 1}])
+        self.assertRaises(ValueError, parse_scenarios,
+                          [{'fqn': 'a', 'weight': 1, 'users': 1}])
+        self.assertRaises(ValueError, parse_scenarios,
+                          [{'fqn': 'a'}, {'fqn': 'a'}])
+
+    def test_allocate_users(self):
+        scenarios = [Scenario('browse', weight=70),
+                     Scenario('search', weight=25),
+                     Scenario('checkout', weight=5)]
+        self.assertEqual(allocate_users(scenarios, 100), [70, 25, 5])
+        self.assertEqual(allocate_users(scenarios, 10), [7, 3, 0])
+        self.assertEqual(allocate_users(scenarios, 1), [1, 0, 0])
+
+        scenarios.append(Scenario('admin', users=2))
+        self.assertEqual(allocate_users(scenarios, 12), [7, 3, 0, 2])
+        self.assertEqual(allocate_users(scenarios, 1), [0, 0, 0, 1])
+
+    def test_assign_users(self):
+        scenarios = [Scenario('a', weight=2), Scenario('b', weight=1)]
+        names = [scenario.name for scenario in assign_users(scenarios, 6)]
+        self.assertEqual(names, ['a', 'b', 'a', 'a', 'b', 'a'])
+
+    def test_weighted_picker(self):
+        picker = WeightedPicker(['a', 'b', 'c'], [5, 1, 1])
+        picks = [picker.next() for i in range(7)]
+        self.assertEqual(picks, ['a', 'a', 'b', 'a', 'c', 'a', 'a'])
+        self.assertRaises(ValueError, WeightedPicker, ['a'], [0])
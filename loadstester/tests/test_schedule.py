@@ -0,0 +1,36 @@
+import unittest
+
+from loadstester.schedule import (parse_rate_profile, RateProfile,
+                                  parse_user_profile, ramp_profile)
+
+
+class TestRateProfile(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_rate_profile('60:0-100,120:100'),
+                         [(60., 0., 100.), (120., 100., 100.)])
+        self.assertEqual(parse_rate_profile([[10, 5], [1, 5, 50]]),
+                         [(10., 5., 5.), (1., 5., 50.)])
+        self.assertRaises(ValueError, parse_rate_profile, [[10, 1, 2, 3]])
+        self.assertRaises(ValueError, parse_rate_profile, '0:10')
+
+    def test_arrivals(self):
+        profile = RateProfile(parse_rate_profile('10:0-10,5:10'))
+        arrivals = list(profile.arrivals())
+        self.assertEqual(profile.total, 100)
+        self.assertEqual(len(arrivals), 100)
+        self.assertEqual(arrivals, sorted(arrivals))
+
+        # during the ramp the arrivals get closer and closer,
+        # then they are evenly spaced
+        self.assertAlmostEqual(arrivals[49], 10., places=6)
+        self.assertAlmostEqual(arrivals[50] - arrivals[49], .1, places=6)
+        self.assertAlmostEqual(arrivals[-1], 15., places=6)
+        self.assertEqual(len(list(profile.scaled(.5).arrivals())), 50)
+
+    def test_user_profile(self):
+        self.assertEqual(parse_user_profile('30:100,60:100,30:0'),
+                         [(30., 100), (60., 100), (30., 0)])
+        self.assertRaises(ValueError, parse_user_profile, [[10, -1]])
+        self.assertEqual(ramp_profile([10, 50], 5, 60),
+                         [(5., 10), (60., 10), (5., 50), (60., 50)])
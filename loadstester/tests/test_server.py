@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+from loadstester.server import WarmServer, run_remote
+
+
+class TestWarmServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.address = os.path.join(self.tmp, 'socket')
+        self.server = WarmServer(self.address, preload=['json'])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        for i in range(100):
+            if os.path.exists(self.address):
+                break
+            time.sleep(.01)
+
+    def tearDown(self):
+        self.server.running = False
+        self.thread.join()
+        shutil.rmtree(self.tmp)
+
+    def _run(self, **options):
+        args = {'fqn': 'loadstester.tests.test_runner.NoopCase.test_noop',
+                'no_patching': True}
+        args.update(options)
+        stream = StringIO()
+        status = run_remote(self.address, args, stream)
+        return status, [json.loads(line)
+                        for line in stream.getvalue().splitlines()]
+
+    def test_runs(self):
+        for i in range(2):
+            status, events = self._run(users='2', hits='3',
+                                       profile_imports=True)
+            self.assertEqual(status, 0)
+            self.assertEqual(events[0]['action'], 'startTestRun')
+            self.assertTrue('preload' in events[0]['startup'])
+            self.assertTrue('imports' in events[0]['startup'])
+            self.assertEqual(events[-1]['action'], 'stopTestRun')
+            self.assertEqual(len([event for event in events
+                                  if event['action'] == 'addSuccess']), 6)
+        self.assertEqual(self.server._modules.keys(),
+                         ['loadstester.tests.test_runner'])
+
+    def test_failed_run(self):
+        status, events = self._run(fqn='loadstester.tests.nope.Case.test')
+        self.assertEqual(status, 1)
+
+    def test_slow_client(self):
+        # a client not sending its request doesn't block the others
+        slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        slow.connect(self.address)
+        slow.sendall('{"options": ')
+        try:
+            status, events = self._run(users='1', hits='1')
+            self.assertEqual(status, 0)
+        finally:
+            slow.close()
@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from loadstester.records import LoadsStatus
+from loadstester.sinks import (BaseSink, FileSink, QueuedStreamer, StatsdSink,
+                               get_sink)
+
+
+class ListSink(BaseSink):
+    def __init__(self, blocked=False):
+        self.events = []
+        self.flushes = 0
+        self.started = threading.Event()
+        self.unblocked = threading.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    def emit(self, action, data):
+        self.started.set()
+        self.unblocked.wait(5)
+        self.events.append((action, data))
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TestQueuedStreamer(unittest.TestCase):
+
+    def _fill(self, policy, count):
+        sink = ListSink(blocked=True)
+        streamer = QueuedStreamer([sink], maxsize=8, policy=policy)
+        streamer.push('startTestRun')
+        sink.started.wait(5)
+        # the writer is blocked on the first event, the queue fills up
+        for i in range(count):
+            streamer.push('hit', index=i)
+        streamer.push('stopTestRun')
+        sink.unblocked.set()
+        streamer.flush()
+        return streamer, sink.events
+
+    def test_push(self):
+        sink = ListSink()
+        streamer = QueuedStreamer([sink, ListSink()])
+        status = {'current_hit': 1}
+        streamer.push('hit', loads_status=status, url='/')
+        status['current_hit'] = 2
+        streamer.flush()
+        self.assertEqual(sink.events,
+                         [('hit', {'loads_status': {'current_hit': 1},
+                                   'url': '/'})])
+        self.assertTrue(sink.flushes)
+        self.assertEqual(streamer.dropped, 0)
+
+    def test_push_event(self):
+        sink = ListSink()
+        streamer = QueuedStreamer([sink])
+        status = LoadsStatus(1, 10, 2, 5)
+        streamer.push_event('addSuccess', status, time=1.)
+        status.current_hit = 2
+        streamer.flush()
+        self.assertEqual(sink.events,
+                         [('addSuccess', {'current_hit': 1, 'nb_hits': 10,
+                                          'current_user': 2, 'nb_users': 5,
+                                          'time': 1.})])
+
+    def test_drop_oldest(self):
+        streamer, events = self._fill('drop-oldest', 10)
+        self.assertEqual(streamer.dropped, 2)
+        self.assertEqual([data.get('index') for action, data in events],
+                         [None, 2, 3, 4, 5, 6, 7, 8, 9, None])
+
+    def test_drop_oldest_keeps_markers(self):
+        sink = ListSink(blocked=True)
+        streamer = QueuedStreamer([sink], maxsize=4, policy='drop-oldest')
+        streamer.push('startTestRun')
+        sink.started.wait(5)
+        flushing = threading.Thread(target=streamer.flush)
+        flushing.start()
+        while not streamer._queue:
+            flushing.join(.001)
+
+        # the pending flush marker is the oldest item, it's not dropped
+        for i in range(10):
+            streamer.push('hit', index=i)
+        streamer.push('stopTestRun')
+        sink.unblocked.set()
+        flushing.join(5)
+        self.assertFalse(flushing.is_alive())
+        streamer.flush()
+        self.assertEqual([data.get('index') for action, data in sink.events],
+                         [None, 7, 8, 9, None])
+        self.assertEqual(streamer.dropped, 7)
+
+    def test_sample(self):
+        streamer, events = self._fill('sample', 20)
+        actions = [action for action, data in events]
+        self.assertEqual(actions[0], 'startTestRun')
+        self.assertEqual(actions[-1], 'stopTestRun')
+        self.assertEqual(streamer.dropped + len(actions), 22)
+        self.assertTrue(4 <= streamer.dropped < 20)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, QueuedStreamer, [], policy='nope')
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_file_rotation(self):
+        path = os.path.join(self.tmp, 'loads.json')
+        sink = get_sink({'type': 'file', 'path': path, 'max_bytes': 100,
+                         'backup_count': 2})
+        self.assertTrue(isinstance(sink, FileSink))
+        for i in range(20):
+            sink.emit('hit', {'index': i, 'url': '/some/url'})
+        sink.close()
+
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['loads.json', 'loads.json.1', 'loads.json.2'])
+        for name in os.listdir(self.tmp):
+            with open(os.path.join(self.tmp, name)) as f:
+                for line in f:
+                    self.assertEqual(json.loads(line)['action'], 'hit')
+        with open(path) as f:
+            self.assertEqual(json.loads(f.readlines()[-1])['index'], 19)
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            sink = StatsdSink(port=server.getsockname()[1], packet_size=50)
+            sink.emit('hit', {'status': 200, 'elapsed': 12500000})
+            sink.emit('addError', {})
+            sink.close()
+            packets = [server.recv(1024) for i in range(2)]
+        finally:
+            server.close()
+        self.assertEqual(packets, ['loads.hits.200:1|c\nloads.hit_time:'
+                                   '12.500|ms', 'loads.errors:1|c'])
+
+    def test_worker_file(self):
+        path = os.path.join(self.tmp, 'loads.json')
+        sink = get_sink({'type': 'file', 'path': path}, process_index=2)
+        sink.close()
+        self.assertEqual(os.listdir(self.tmp), ['loads.json.2'])
+
+    def test_unknown_sink(self):
+        self.assertRaises(ValueError, get_sink, 'nope')
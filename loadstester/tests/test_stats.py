@@ -0,0 +1,108 @@
+import datetime
+import random
+import unittest
+
+from loadstester.results import Results
+from loadstester.stats import (LatencyHistogram, bucket_index, bucket_value,
+                               url_template, HitSampler)
+
+
+class FakeStreamer(object):
+    def __init__(self):
+        self.events = []
+
+    def push(self, action, **data):
+        self.events.append((action, data))
+
+    def flush(self):
+        pass
+
+
+class TestStats(unittest.TestCase):
+
+    def test_buckets(self):
+        for value in (0, 1, 63, 64, 65, 127, 128, 1000, 123456, 10 ** 9):
+            found = bucket_value(bucket_index(value))
+            self.assertTrue(abs(found - value) <= value / 64., value)
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        values = range(1, 100001)
+        random.shuffle(values)
+        for value in values:
+            histogram.add(value)
+
+        p50, p99, p100 = histogram.percentiles(50, 99, 100)
+        self.assertAlmostEqual(p50, 50000, delta=50000 / 64.)
+        self.assertAlmostEqual(p99, 99000, delta=99000 / 64.)
+        self.assertEqual(p100, 100000)
+        self.assertEqual(histogram.max, 100000)
+
+    def test_url_template(self):
+        self.assertEqual(url_template('http://127.0.0.1:80/users/12/?x=1'),
+                         'http://127.0.0.1:80/users/{id}/')
+        self.assertEqual(
+            url_template('/a/8c3e0f4a-7a1b-4f1e-9c2d-3e4f5a6b7c8d/b'),
+            '/a/{id}/b')
+        self.assertEqual(url_template('/static/deadbeef'),
+                         '/static/deadbeef')
+
+    def test_aggregated_results(self):
+        streamer = FakeStreamer()
+        results = Results(streamer=streamer,
+                          args={'aggregate': True, 'snapshot_interval': 60})
+        for i in range(100):
+            results.add_hit(elapsed=datetime.timedelta(milliseconds=i + 1),
+                            started=datetime.datetime.utcnow(),
+                            status=i < 90 and 200 or 503,
+                            url='http://127.0.0.1:80/item/%d' % i,
+                            method='GET', loads_status=None)
+        self.assertEqual(streamer.events, [])
+
+        results.stopTestRun('agent')
+        snapshots = dict((data['status'], data)
+                         for action, data in streamer.events
+                         if action == 'histogram')
+        self.assertEqual(snapshots[200]['count'], 90)
+        self.assertEqual(snapshots[200]['errors'], 0)
+        self.assertEqual(snapshots[503]['errors'], 10)
+        self.assertEqual(snapshots[200]['url'],
+                         'http://127.0.0.1:80/item/{id}')
+        self.assertAlmostEqual(snapshots[200]['p50'], .045, delta=.001)
+        self.assertEqual(snapshots[503]['max'], .1)
+        self.assertEqual(streamer.events[-1][0], 'stopTestRun')
+
+    def test_sampler(self):
+        sampler = HitSampler(budget=100)
+        random.seed(1)
+        kept = []
+        # 10 seconds at 1000 hits per second, 1% errors and 0.5% slow hits
+        for i in range(10000):
+            now = 1000 + i / 1000.
+            status = i % 100 == 0 and 500 or 200
+            elapsed = i % 200 == 1 and 500000 or random.randint(1000, 2000)
+            weight = sampler.sample(status, elapsed, now)
+            if weight:
+                kept.append((i, status, elapsed, weight))
+
+        last_second = [hit for hit in kept if hit[0] >= 9000]
+        self.assertTrue(90 <= len(last_second) <= 110, len(last_second))
+        self.assertEqual(len([hit for hit in last_second if hit[1] == 500]),
+                         10)
+        self.assertEqual(len([hit for hit in last_second
+                              if hit[2] == 500000]), 5)
+        total = sum([hit[3] for hit in kept if hit[0] >= 1000])
+        self.assertAlmostEqual(total, 9000, delta=90)
+        self.assertEqual(sampler.dropped + len(kept), 10000)
+
+    def test_sampled_results(self):
+        streamer = FakeStreamer()
+        results = Results(streamer=streamer, args={'sample_budget': 10})
+        for i in range(20):
+            results.add_hit(elapsed=10 ** 6, started=0, status=200, url='/',
+                            method='GET', loads_status=None)
+        results.stopTestRun('agent')
+        weights = [data['weight'] for action, data in streamer.events
+                   if action == 'hit']
+        self.assertEqual(weights, [1.] * 20)
+        self.assertEqual(streamer.events[-1][1]['sampled_out_hits'], 0)
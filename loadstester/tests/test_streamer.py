@@ -0,0 +1,134 @@
+import datetime
+import json
+import unittest
+from StringIO import StringIO
+
+from loadstester.records import Hit, LoadsStatus
+from loadstester.streamer import (StdoutStreamer, BinaryStreamer,
+                                  BinaryDecoder, decode_stream, get_streamer)
+
+
+EVENTS = [
+    ('startTestRun', {'agent_id': None, 'time': 1380000000.5}),
+    ('hit', {'elapsed': datetime.timedelta(seconds=1, microseconds=42),
+             'started': datetime.datetime(2013, 9, 20, 12, 1, 2, 123456),
+             'status': 200, 'url': u'http://127.0.0.1:80/\xe9t\xe9',
+             'method': 'GET', 'current_hit': 2, 'nb_hits': 10,
+             'current_user': 1, 'nb_users': 1, 'time': 1380000001.25}),
+    ('hit', {'elapsed': 1234567890, 'started': 1380000001250000000,
+             'phases': [1, 2, 3, 4, 5], 'status': 404, 'url': '/',
+             'method': 'POST'}),
+    ('incr', {'loads_status': [1, 2, 3], 'counters': {'dummy': 1},
+              'big': 2 ** 70, 'ok': True, 'ko': False}),
+    ('stopTestRun', {'agent_id': 'agent1'})]
+
+
+class TestStreamers(unittest.TestCase):
+
+    def _json_events(self):
+        stream = StringIO()
+        streamer = StdoutStreamer(stream=stream)
+        for action, data in EVENTS:
+            streamer.push(action, **dict(data))
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_binary_roundtrip_matches_json(self):
+        stream = StringIO()
+        streamer = BinaryStreamer(stream=stream, flush_interval=3600)
+        for action, data in EVENTS:
+            streamer.push(action, **dict(data))
+
+        # everything fits in one frame, written by stopTestRun
+        data = stream.getvalue()
+        self.assertEqual(len(BinaryStreamer.split(data)[0]), len(data))
+
+        decoded = list(decode_stream(StringIO(data), chunk_size=7))
+        self.assertEqual(decoded, self._json_events())
+        self.assertEqual(decoded[2]['started'], '2013-09-24T05:20:01.250000')
+        self.assertEqual(decoded[2]['elapsed'], 1.23456789)
+
+    def test_push_hit(self):
+        statuses = [LoadsStatus(1, 10, 2, 5), LoadsStatus(2, 10, 2, 5),
+                    {'current_hit': 3}]
+        statuses[1]['scenario'] = 'browse'
+        hits = [Hit(1380000001250000000, 1234567890, 200, '/', 'GET',
+                    [1, 2, 3, 4, 5], status, weight=2.) for status in statuses]
+        hits[0].stamp()
+
+        stream = StringIO()
+        streamer = StdoutStreamer(stream=stream)
+        expected = StringIO()
+        reference = StdoutStreamer(stream=expected)
+        binary = StringIO()
+        binary_streamer = BinaryStreamer(stream=binary, flush_interval=3600)
+        for hit in hits:
+            streamer.push_hit(hit)
+            reference.push('hit', **hit.as_dict())
+            binary_streamer.push_hit(hit)
+        binary_streamer.close()
+
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(events, [json.loads(line) for line in
+                                  expected.getvalue().splitlines()])
+        self.assertEqual(events[1]['loads_status']['scenario'], 'browse')
+        self.assertEqual(events[0]['elapsed'], 1.23456789)
+        self.assertEqual(list(decode_stream(StringIO(binary.getvalue()))),
+                         events)
+
+    def test_binary_lists(self):
+        data = {'values': [1.5, 2.5], 'flags': [True, False],
+                'mixed': [1, 2.5, True, None, 'a', 2 ** 70],
+                'ints': [1, 2L, -3], 'empty': []}
+        stream = StringIO()
+        streamer = BinaryStreamer(stream=stream)
+        streamer.push('incr', **dict(data))
+        streamer.close()
+        decoded = list(decode_stream(StringIO(stream.getvalue())))[0]
+        del decoded['action']
+        self.assertEqual(decoded, data)
+        self.assertEqual([type(flag) for flag in decoded['flags']],
+                         [bool, bool])
+        self.assertEqual(type(decoded['values'][0]), float)
+
+    def test_binary_batching(self):
+        stream = StringIO()
+        streamer = BinaryStreamer(stream=stream, batch_size=200,
+                                  flush_interval=3600)
+        for i in range(10):
+            streamer.push('hit', status=200, url='http://example.com/%d' % i)
+        self.assertTrue(stream.getvalue())
+        streamer.close()
+
+        decoder = BinaryDecoder()
+        data = stream.getvalue()
+        events = decoder.feed(data[:-3]) + decoder.feed(data[-3:])
+        self.assertEqual([event['url'] for event in events],
+                         ['http://example.com/%d' % i for i in range(10)])
+
+    def test_binary_limits(self):
+        stream = StringIO()
+        streamer = BinaryStreamer(stream=stream, flush_interval=3600)
+        # more than 255 fields
+        fields = dict([('field%d' % i, i) for i in range(300)])
+        streamer.push('incr', **fields)
+        # strings filling the table of the frame: a new one is started
+        strings = ['string %d' % i for i in range(40000)]
+        streamer.push('incr', strings=strings)
+        streamer.push('incr', strings=strings[::-1])
+        streamer.close()
+        events = list(decode_stream(StringIO(stream.getvalue())))
+        self.assertEqual(len(events[0]), 301)
+        self.assertEqual(events[0]['field299'], 299)
+        self.assertEqual(events[2]['strings'], strings[::-1])
+
+        # an event with too many strings for any frame
+        strings = ['string %d' % i for i in range(70000)]
+        self.assertRaises(ValueError, streamer.push, 'incr', strings=strings)
+        streamer.push('incr', strings=['a'])
+        streamer.close()
+        events = list(decode_stream(StringIO(stream.getvalue())))
+        self.assertEqual(events[-1]['strings'], ['a'])
+
+    def test_get_streamer(self):
+        self.assertTrue(isinstance(get_streamer('binary'), BinaryStreamer))
+        self.assertRaises(ValueError, get_streamer, 'xml')
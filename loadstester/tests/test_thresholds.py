@@ -0,0 +1,160 @@
+import time
+import unittest
+
+import gevent
+
+from loadstester.case import TestCase
+from loadstester.records import Hit
+from loadstester.tests.test_runner import run, actions
+from loadstester.thresholds import (parse_thresholds, ThresholdMonitor,
+                                    describe, merge_results)
+
+
+class SlowHitCase(TestCase):
+    __test__ = False
+
+    def test_slow(self):
+        self._test_result.add_hit_record(
+            Hit(0, 50 * 10 ** 6, 200, 'http://example.com', 'GET'))
+        gevent.sleep(.01)
+
+
+class OneSlowUserCase(TestCase):
+    __test__ = False
+
+    def test_slow(self):
+        elapsed = 1
+        if self.loads_status['current_user'] == 1:
+            elapsed = 50
+        self._test_result.add_hit_record(
+            Hit(0, elapsed * 10 ** 6, 200, 'http://example.com', 'GET'))
+        gevent.sleep(.01)
+
+
+class FakeRunner(object):
+    stop = False
+
+
+def _hit(ms, status=200):
+    return Hit(0, ms * 10 ** 6, status, '/', 'GET')
+
+
+class TestThresholds(unittest.TestCase):
+
+    def test_parse(self):
+        thresholds = parse_thresholds('p95<200, error_rate<=1,rps>50')
+        self.assertEqual([str(threshold) for threshold in thresholds],
+                         ['p95<200', 'error_rate<=1', 'rps>50'])
+        self.assertEqual(parse_thresholds(['p99.9<1.5'])[0].measure,
+                         'p99.9')
+        self.assertEqual(parse_thresholds(None), [])
+        self.assertEqual(str(thresholds[2].scaled(.5)), 'rps>25')
+        self.assertTrue(thresholds[0].scaled(.5) is thresholds[0])
+        for spec in ('p95', 'p95=200', 'latency<200', 'rps>fast'):
+            self.assertRaises(ValueError, parse_thresholds, spec)
+
+    def test_sustain(self):
+        runner = FakeRunner()
+        thresholds = parse_thresholds('p50<20,error_rate<50,mean<100')
+        monitor = ThresholdMonitor(runner, thresholds, window=2, sustain=2)
+        now = monitor.rolling._slot_end
+
+        monitor.add_hit(_hit(10))
+        monitor.add_hit(_hit(30, 500))
+        monitor.add_hit(_hit(30))
+        monitor.rolling.tick(now)
+        monitor.check(now)
+        self.assertEqual(len(monitor.breached), 1)
+        self.assertFalse(monitor.failed)
+
+        # the breach ends before it's sustained
+        monitor.add_hit(_hit(5))
+        monitor.add_hit(_hit(5))
+        monitor.add_hit(_hit(5))
+        monitor.rolling.tick(now + 1)
+        monitor.check(now + 1)
+        self.assertFalse(monitor.breached)
+
+        for i in range(2, 6):
+            for j in range(4):
+                monitor.add_hit(_hit(40))
+            monitor.rolling.tick(now + i)
+            monitor.check(now + i)
+        self.assertEqual(monitor.failed.keys(), [thresholds[0]])
+        self.assertTrue(runner.stop)
+
+        results = monitor.results()
+        self.assertEqual([result['passed'] for result in results],
+                         [False, True, True])
+        self.assertEqual(results[0]['breached'], 40)
+        self.assertEqual(describe(results[0]),
+                         'p50<20 failed (40.00), breached at 40.00 over '
+                         'the window')
+        self.assertEqual(describe(results[1]), 'error_rate<50 passed (4.55)')
+
+    def test_no_hits(self):
+        runner = FakeRunner()
+        monitor = ThresholdMonitor(runner, parse_thresholds('p99<10,rps>1'),
+                                   window=2, sustain=0, abort=False)
+        now = monitor.rolling._slot_end
+        monitor.rolling.tick(now)
+        monitor.check(now)
+        self.assertFalse(monitor.failed)
+
+        # once the window is full
+        monitor.rolling.tick(now + 1)
+        monitor.check(now + 1)
+        self.assertEqual([str(threshold) for threshold in monitor.failed],
+                         ['rps>1'])
+        self.assertFalse(runner.stop)
+        self.assertEqual(describe(monitor.results()[0]),
+                         'p99<10 passed (no hits)')
+
+    def test_abort(self):
+        fqn = 'loadstester.tests.test_thresholds.SlowHitCase.test_slow'
+        start = time.time()
+        res, events = run(fqn=fqn, users='2', duration=10,
+                          thresholds='p50<10,error_rate<1',
+                          threshold_window=1, threshold_sustain=0)
+        self.assertEqual(res, 1)
+        self.assertTrue(time.time() - start < 5)
+        results = actions(events, 'thresholds')[0]['thresholds']
+        self.assertEqual([(result['threshold'], result['passed'])
+                          for result in results],
+                         [('p50<10', False), ('error_rate<1', True)])
+        self.assertEqual(events[-1]['action'], 'stopTestRun')
+
+        res, events = run(fqn=fqn, users='2', hits='2', thresholds='p50<100')
+        self.assertEqual(res, None)
+        self.assertTrue(actions(events, 'thresholds')[0]['thresholds'][0][
+            'passed'])
+
+    def test_processes(self):
+        # the breach of the first worker stops the second one
+        fqn = 'loadstester.tests.test_thresholds.OneSlowUserCase.test_slow'
+        start = time.time()
+        res, events = run(fqn=fqn, users='2', duration=10, processes=2,
+                          thresholds='p50<10,rps>1', threshold_window=1,
+                          threshold_sustain=0)
+        self.assertEqual(res, 1)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(len(actions(events, 'thresholds')), 2)
+        results = events[-1]['thresholds']
+        self.assertEqual([(result['threshold'], result['passed'])
+                          for result in results],
+                         [('p50<10', False), ('rps>1', True)])
+        self.assertEqual(results[0]['breached'], 50)
+        self.assertTrue(results[1]['value'] > 50)
+
+    def test_merge(self):
+        thresholds = parse_thresholds('p95<100,rps>10')
+        merged = merge_results(thresholds, [
+            [{'threshold': 'p95<100', 'value': 50, 'passed': True},
+             {'threshold': 'rps>5', 'value': 4, 'passed': False,
+              'breached': 3}],
+            [{'threshold': 'p95<100', 'value': 120, 'passed': False},
+             {'threshold': 'rps>5', 'value': 7, 'passed': True}]])
+        self.assertEqual(merged, [
+            {'threshold': 'p95<100', 'value': 120, 'passed': False},
+            {'threshold': 'rps>10', 'value': 11, 'passed': False,
+             'breached': 6}])
@@ -0,0 +1,177 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from StringIO import StringIO
+
+import mock
+
+from loadstester.util import (Resolver, sync_include_files, pack_bundle,
+                              unpack_bundle, pack_include_files,
+                              unpack_include_files, ImportProfile,
+                              resolve_name)
+
+
+def wait_refresh(resolver, host):
+    for i in range(100):
+        if not resolver._hosts[host].refreshing:
+            break
+        time.sleep(.01)
+
+
+class TestResolver(unittest.TestCase):
+
+    @mock.patch('loadstester.util.dns_resolver', None)
+    @mock.patch('socket.gethostbyname_ex')
+    def test_resolve(self, gethostbyname_ex):
+        gethostbyname_ex.return_value = ('example.com', [],
+                                         ['10.0.0.1', '10.0.0.2'])
+        resolver = Resolver()
+
+        resolved = [resolver.resolve('http://example.com/a?b=c#d')
+                    for i in range(3)]
+        self.assertEqual(resolved[0], ('http://10.0.0.1:80/a?b=c#d',
+                                       'example.com', '10.0.0.1'))
+        self.assertEqual(resolved[1][0], 'http://10.0.0.2:80/a?b=c#d')
+        self.assertEqual(resolved[2][2], '10.0.0.1')
+        self.assertEqual(resolver.resolve('http://example.com:8080')[0],
+                         'http://10.0.0.2:8080')
+        self.assertEqual(gethostbyname_ex.call_count, 1)
+
+    @mock.patch('loadstester.util.dns_resolver', None)
+    @mock.patch('socket.gethostbyname_ex')
+    def test_ttl_refresh(self, gethostbyname_ex):
+        gethostbyname_ex.return_value = ('example.com', [], ['10.0.0.1'])
+        resolver = Resolver(ttl=0, selection='least-used')
+        self.assertEqual(resolver.resolve('http://example.com/')[2],
+                         '10.0.0.1')
+
+        # the expired entry is still used while it's refreshed
+        refreshed = threading.Event()
+
+        def lookup(host):
+            refreshed.wait()
+            return ('example.com', [], ['10.0.0.3'])
+
+        gethostbyname_ex.side_effect = lookup
+        self.assertEqual(resolver.resolve('http://example.com/')[2],
+                         '10.0.0.1')
+        refreshed.set()
+        wait_refresh(resolver, 'example.com')
+        self.assertEqual(resolver.resolve('http://example.com/')[2],
+                         '10.0.0.3')
+        wait_refresh(resolver, 'example.com')
+
+    def test_unknown_selection(self):
+        self.assertRaises(ValueError, Resolver, selection='first')
+
+
+class TestIncludeFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, 'source')
+        self.cache = os.path.join(self.tmp, 'cache')
+        os.makedirs(os.path.join(self.source, 'data', 'sub'))
+        self._write('one.txt', 'one')
+        self._write('data/two.txt', 'two')
+        self._write('data/sub/same.txt', 'two')
+        os.chmod(os.path.join(self.source, 'one.txt'), 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.source, name), 'w') as f:
+            f.write(content)
+
+    def _read(self, *path):
+        with open(os.path.join(self.tmp, *path)) as f:
+            return f.read()
+
+    def test_sync(self):
+        includes = ['one.txt', 'data']
+        target = os.path.join(self.tmp, 'target')
+        self.assertEqual(sync_include_files(includes, target, self.cache,
+                                            self.source), (3, 0))
+        self.assertEqual(self._read('target', 'data', 'sub', 'same.txt'),
+                         'two')
+        # the files keep their mode, only the cached contents are read-only
+        mode = os.stat(os.path.join(target, 'one.txt')).st_mode
+        self.assertEqual(mode & 0777, 0755)
+        cached = [os.path.join(dirpath, filename)
+                  for dirpath, dirnames, filenames in os.walk(self.cache)
+                  for filename in filenames if filename != 'index.json']
+        self.assertEqual(len(cached), 2)
+        for path in cached:
+            self.assertFalse(os.stat(path).st_mode & 0222)
+        os.chmod(self.cache, 0777)
+        self.assertRaises(ValueError, sync_include_files, includes, target,
+                          self.cache, self.source)
+        os.chmod(self.cache, 0700)
+
+        # the unchanged files are skipped, the others written again
+        self._write('data/two.txt', 'three')
+        self.assertEqual(sync_include_files(includes, target, self.cache,
+                                            self.source), (1, 2))
+        self.assertEqual(self._read('target', 'data', 'two.txt'), 'three')
+
+        # a test changing its file doesn't change the cache, and gets the
+        # file back at the next run
+        with open(os.path.join(target, 'one.txt'), 'a') as f:
+            f.write(' changed')
+        other = os.path.join(self.tmp, 'other')
+        sync_include_files(includes, other, self.cache, self.source)
+        self.assertEqual(self._read('other', 'one.txt'), 'one')
+        self.assertEqual(sync_include_files(includes, target, self.cache,
+                                            self.source), (1, 2))
+        self.assertEqual(self._read('target', 'one.txt'), 'one')
+
+    def test_bundle(self):
+        bundle = StringIO()
+        manifest = pack_bundle(['*.txt', 'data'], bundle, self.source)
+        self.assertEqual(len(manifest), 3)
+
+        for cache in (None, self.cache):
+            target = os.path.join(self.tmp, 'target-%s' % bool(cache))
+            bundle.seek(0)
+            self.assertEqual(unpack_bundle(bundle, target, cache), (3, 0))
+            self.assertEqual(self._read(target, 'data', 'two.txt'), 'two')
+            self.assertEqual(self._read(target, 'one.txt'), 'one')
+
+        bundle.seek(0)
+        self.assertEqual(unpack_bundle(bundle, target, self.cache), (0, 3))
+
+    def test_raw_include_files(self):
+        target = os.path.join(self.tmp, 'target')
+        data = pack_include_files(['one.txt'], self.source, raw=True)
+        unpack_include_files(data, target)
+        self.assertEqual(self._read('target', 'one.txt'), 'one')
+
+        empty = StringIO()
+        zipfile.ZipFile(empty, 'w').close()
+        self.assertTrue(empty.getvalue().startswith('PK\x05\x06'))
+        unpack_include_files(empty.getvalue(), target)
+        unpack_include_files(empty.getvalue().encode('base64'), target)
+
+
+class TestImportProfile(unittest.TestCase):
+
+    def test_profile(self):
+        sys.modules.pop('colorsys', None)
+        with ImportProfile() as profile:
+            import colorsys    # NOQA
+        self.assertEqual([timing['module'] for timing in profile.top()],
+                         ['colorsys'])
+        self.assertTrue(__import__ is not profile._import)
+
+    def test_resolve_name(self):
+        sys.modules.pop('json.tool', None)
+        # json is imported, but not json.tool
+        self.assertEqual(resolve_name('json.tool.main').__module__,
+                         'json.tool')
+        self.assertEqual(resolve_name('json.tool.main').__name__, 'main')
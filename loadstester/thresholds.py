@@ -0,0 +1,243 @@
+"""Pass/fail thresholds of a run, given in the *thresholds* option.
+
+Each threshold compares a measure of the hits to a value, like
+``p95<200``:
+
+- ``p50``, ``p95``, ``p99.9``...: a percentile of the latencies, in ms.
+- ``mean``: the mean latency, in ms.
+- ``error_rate``: the percentage of hits without a status or with a status
+  >= 400.
+- ``rps``: the number of hits per second.
+
+They're checked at every second of the run over the last
+*threshold_window* seconds, 10 by default, the ``rps`` ones once the run
+lasted a full window. A threshold breached during
+*threshold_sustain* seconds, 5 by default, fails, and stops the run unless
+*threshold_abort* is false. At the end of the run the thresholds are also
+checked over all of its hits. The run then returns 1 if one failed, and
+the results are sent in a ``thresholds`` event.
+
+With several processes each one checks its own hits, the ``rps`` ones
+divided between them. A worker stopping on a breach stops the others, and
+the results of the workers are merged in the stopTestRun event of the run.
+"""
+import operator
+import re
+import time
+
+from loadstester.results import _elapsed_us
+from loadstester.stats import LatencyHistogram, RollingHistogram
+from loadstester.util import logger
+
+
+_SPEC = re.compile(r'^(p\d+(?:\.\d+)?|mean|error_rate|rps)'
+                   r'(<=|>=|<|>)(\d+(?:\.\d*)?)$')
+
+_OPERATORS = {'<': operator.lt, '<=': operator.le,
+              '>': operator.gt, '>=': operator.ge}
+
+
+class Threshold(object):
+    def __init__(self, measure, op, value):
+        self.measure = measure
+        self.op = op
+        self.value = value
+
+    def __str__(self):
+        return '%s%s%g' % (self.measure, self.op, self.value)
+
+    def __repr__(self):
+        return '<Threshold %s>' % self
+
+    def scaled(self, factor):
+        """Returns the threshold of a share *factor* of the hits."""
+        if self.measure != 'rps':
+            return self
+        return Threshold(self.measure, self.op, self.value * factor)
+
+    def measured(self, stats):
+        """Returns the value of the measure in *stats*, a
+        :class:`loadstester.stats.RollingHistogram` or a :class:`Totals`,
+        or None without any hit.
+        """
+        histogram = stats.histogram
+        if self.measure == 'rps':
+            return stats.rate()
+        if not histogram.count:
+            return None
+        if self.measure == 'error_rate':
+            return stats.error_ratio() * 100
+        if self.measure == 'mean':
+            return histogram.total / float(histogram.count) / 1000
+        return histogram.percentile(float(self.measure[1:])) / 1000.
+
+    def passes(self, value):
+        return value is None or _OPERATORS[self.op](value, self.value)
+
+
+def parse_thresholds(spec):
+    """Parses a list of thresholds, or a string of comma-separated ones."""
+    if not spec:
+        return []
+    if isinstance(spec, basestring):
+        spec = spec.split(',')
+    thresholds = []
+    for item in spec:
+        item = item.replace(' ', '')
+        if not item:
+            continue
+        match = _SPEC.match(item)
+        if match is None:
+            raise ValueError('Invalid threshold %r, use like p95<200, '
+                             'error_rate<1 or rps>50' % item)
+        measure, op, value = match.groups()
+        thresholds.append(Threshold(measure, op, float(value)))
+    return thresholds
+
+
+class Totals(object):
+    """The latencies and errors of all the hits since *start*."""
+
+    def __init__(self, start=None):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        if start is None:
+            start = time.time()
+        self.start = start
+        self.end = None
+
+    def add(self, value, error=False):
+        self.histogram.add(value)
+        if error:
+            self.errors += 1
+
+    def rate(self):
+        duration = (self.end or time.time()) - self.start
+        if duration <= 0:
+            return 0.
+        return self.histogram.count / duration
+
+    def error_ratio(self):
+        if not self.histogram.count:
+            return 0.
+        return self.errors / float(self.histogram.count)
+
+
+class ThresholdMonitor(object):
+    """Checks the *thresholds* on the hits of the *runner*, and stops it on
+    a breach when *abort* is true.
+    """
+    def __init__(self, runner, thresholds, window=10, sustain=5, abort=True):
+        self.runner = runner
+        self.thresholds = thresholds
+        self.sustain = float(sustain)
+        self.abort = abort
+        self.rolling = RollingHistogram(window)
+        self.totals = Totals()
+        # the time each threshold is breached since, and the value it
+        # failed with
+        self.breached = {}
+        self.failed = {}
+
+    def add_hit(self, hit):
+        value = _elapsed_us(hit.elapsed)
+        error = hit.status is None or hit.status >= 400
+        self.rolling.add(value, error)
+        self.totals.add(value, error)
+
+    def add_event(self, action):
+        pass
+
+    def refresh(self, run_id=None):
+        now = time.time()
+        if self.rolling.tick(now):
+            self.check(now)
+
+    def check(self, now):
+        for threshold in self.thresholds:
+            if threshold in self.failed:
+                continue
+            # the rate of a partial window would be too low
+            if (threshold.measure == 'rps' and
+                    self.rolling.seconds < self.rolling.window):
+                continue
+            value = threshold.measured(self.rolling)
+            if threshold.passes(value):
+                self.breached.pop(threshold, None)
+                continue
+            since = self.breached.setdefault(threshold, now)
+            if now - since < self.sustain:
+                continue
+            self.failed[threshold] = value
+            logger.error('Threshold %s breached for %ds: %.2f' %
+                         (threshold, now - since, value))
+            if self.abort and not self.runner.stop:
+                logger.error('Stopping the run')
+                self.runner.stop = True
+
+    def results(self):
+        """Returns the results of the thresholds, over the whole run."""
+        self.totals.end = time.time()
+        results = []
+        for threshold in self.thresholds:
+            value = threshold.measured(self.totals)
+            result = {'threshold': str(threshold), 'value': value,
+                      'passed': (threshold not in self.failed and
+                                 threshold.passes(value))}
+            if threshold in self.failed:
+                result['breached'] = self.failed[threshold]
+            results.append(result)
+        return results
+
+
+def _worst(threshold, values):
+    if threshold.op in ('<', '<='):
+        return max(values)
+    return min(values)
+
+
+def merge_results(thresholds, worker_results):
+    """Returns the results of the *thresholds* of a run from the lists of
+    results of its worker processes.
+
+    A threshold fails if it failed in a worker. Its value is the sum of the
+    ones of the workers for ``rps``, the worst one for the other measures.
+    """
+    merged = []
+    for i, threshold in enumerate(thresholds):
+        results = [results[i] for results in worker_results
+                   if len(results) > i]
+        values = [result['value'] for result in results
+                  if result['value'] is not None]
+        if not values:
+            value = None
+        elif threshold.measure == 'rps':
+            value = sum(values)
+        else:
+            value = _worst(threshold, values)
+        merged.append({'threshold': str(threshold), 'value': value,
+                       'passed': not [result for result in results
+                                      if not result['passed']]})
+        breached = [result['breached'] for result in results
+                    if 'breached' in result]
+        if breached:
+            value = _worst(threshold, breached)
+            if threshold.measure == 'rps':
+                # the workers checked their share of the rate
+                value *= len(worker_results)
+            merged[-1]['breached'] = value
+    return merged
+
+
+def describe(result):
+    """Returns a line explaining the *result* of a threshold."""
+    if result['value'] is None:
+        measured = 'no hits'
+    else:
+        measured = '%.2f' % result['value']
+    line = '%s %s (%s)' % (result['threshold'],
+                           result['passed'] and 'passed' or 'failed',
+                           measured)
+    if 'breached' in result:
+        line += ', breached at %.2f over the window' % result['breached']
+    return line
@@ -1,21 +1,77 @@
 from logging import handlers
+import __builtin__
 import urlparse
 import socket
 import random
+import threading
+import time
 import logging
 import sys
 import os
+import stat
 import zipfile
+import hashlib
+import shutil
 import fnmatch
 from StringIO import StringIO
 import json
 import datetime
+import ctypes
+import ctypes.util
+
+try:
+    from dns import resolver as dns_resolver
+except ImportError:
+    dns_resolver = None
 
 
-_DNS_CACHE = {}
 logger = logging.getLogger('loads')
 
 
+def _clock_gettime():
+    """Returns a function reading CLOCK_MONOTONIC in nanoseconds, or None
+    when the libc does not provide clock_gettime.
+    """
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    clock_id = sys.platform == 'darwin' and 6 or 1    # CLOCK_MONOTONIC
+
+    def monotonic_ns():
+        # a buffer per call, the threads engine reads the clock concurrently
+        spec = timespec()
+        clock_gettime(clock_id, ctypes.byref(spec))
+        return spec.tv_sec * 1000000000 + spec.tv_nsec
+
+    return monotonic_ns
+
+
+def wall_ns():
+    """Returns the wall clock time in nanoseconds since the epoch."""
+    return int(time.time() * 1000000000)
+
+
+# monotonic_ns() returns the time of a monotonic clock in nanoseconds, to
+# measure durations. It falls back to the wall clock when the platform has
+# no monotonic clock.
+monotonic_ns = (getattr(time, 'perf_counter_ns', None) or _clock_gettime() or
+                wall_ns)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def ns_to_datetime(value):
+    """Turns nanoseconds since the epoch into a naive UTC datetime."""
+    return _EPOCH + datetime.timedelta(microseconds=value // 1000)
+
+
 def total_seconds(td):
     # works for 2.7 and 2.6
     diff = (td.seconds + td.days * 24 * 3600) * 10 ** 6
@@ -29,6 +85,9 @@ class DateTimeJSONEncoder(json.JSONEncoder):
             return obj.isoformat()
         elif isinstance(obj, datetime.timedelta):
             return total_seconds(obj)
+        elif hasattr(obj, 'as_dict'):
+            # the records of loadstester.records
+            return obj.as_dict()
         else:
             return super(DateTimeJSONEncoder, self).default(obj)
 
@@ -60,6 +119,129 @@ def set_logger(debug=False, name='loads', logfile='stdout'):
         logger.addHandler(fh)
 
 
+class _HostEntry(object):
+    def __init__(self, addrs, expires):
+        self.addrs = addrs
+        self.expires = expires
+        self.refreshing = False
+        self.next = 0
+        self.uses = dict([(addr, 0) for addr in addrs])
+
+
+class Resolver(object):
+    """Resolves the hostname of the urls, caching the results.
+
+    - The addresses of a host are kept for the TTL of its DNS records when
+      dnspython is installed, for *ttl* seconds otherwise.
+    - Only the first resolution of a host blocks. Once expired, the cached
+      addresses keep being used while they are refreshed in the background.
+    - *selection* picks the address of each request among those of the
+      host: ``round-robin``, ``least-used`` or ``random``.
+    - The parsed urls are cached, up to *max_urls* of them, so resolving a
+      known url does not parse it again.
+    """
+    selections = ('round-robin', 'least-used', 'random')
+
+    def __init__(self, ttl=300, selection='round-robin', max_urls=10000):
+        if selection not in self.selections:
+            raise ValueError('Unknown address selection %r, choose one of '
+                             '%s' % (selection, ', '.join(self.selections)))
+        self.ttl = ttl
+        self.selection = selection
+        self.max_urls = max_urls
+        self._hosts = {}
+        self._urls = {}
+
+    def _parse(self, url):
+        parts = urlparse.urlsplit(url)
+        netloc = parts.netloc.rsplit(':', 1)
+        if len(netloc) == 1:
+            netloc.append('80')
+        rest = urlparse.urlunsplit(('', '') + parts[2:])
+        return parts.scheme + '://', netloc[0], ':' + netloc[1] + rest
+
+    def _lookup(self, host):
+        """Returns the addresses of *host*, and for how long to keep them.
+        """
+        if dns_resolver is not None:
+            try:
+                answer = dns_resolver.query(host, 'A')
+                return ([record.address for record in answer],
+                        answer.rrset.ttl)
+            except Exception:
+                logger.debug('dnspython could not resolve %r' % host)
+        return socket.gethostbyname_ex(host)[2], self.ttl
+
+    def _refresh(self, host, entry):
+        try:
+            addrs, ttl = self._lookup(host)
+        except Exception:
+            logger.debug('Could not refresh the addresses of %r' % host)
+            # keep the stale addresses, and retry a bit later
+            entry.expires = time.time() + min(self.ttl, 10)
+        else:
+            entry.expires = time.time() + ttl
+            if addrs != entry.addrs:
+                entry.addrs = addrs
+                entry.next = 0
+                entry.uses = dict([(addr, entry.uses.get(addr, 0))
+                                   for addr in addrs])
+        finally:
+            entry.refreshing = False
+
+    def _get_entry(self, host):
+        entry = self._hosts.get(host)
+        if entry is None:
+            addrs, ttl = self._lookup(host)
+            entry = self._hosts[host] = _HostEntry(addrs, time.time() + ttl)
+        elif not entry.refreshing and entry.expires <= time.time():
+            entry.refreshing = True
+            thread = threading.Thread(target=self._refresh,
+                                      args=(host, entry))
+            thread.daemon = True
+            thread.start()
+        return entry
+
+    def _select(self, entry):
+        addrs = entry.addrs
+        if self.selection == 'round-robin':
+            addr = addrs[entry.next % len(addrs)]
+            entry.next += 1
+        elif self.selection == 'least-used':
+            uses = entry.uses
+            addr = min(addrs, key=uses.__getitem__)
+            uses[addr] += 1
+        else:
+            addr = random.choice(addrs)
+        return addr
+
+    def resolve(self, url):
+        """Returns a 3-tuple giving: the URL with hostname replaced by the IP
+        addr, the original hostname string, and the resolved IP addr string.
+        """
+        parsed = self._urls.get(url)
+        if parsed is None:
+            if len(self._urls) >= self.max_urls:
+                self._urls.clear()
+            parsed = self._urls[url] = self._parse(url)
+
+        scheme, original, rest = parsed
+        resolved = self._select(self._get_entry(original))
+        return scheme + resolved + rest, original, resolved
+
+
+_RESOLVERS = {}
+
+
+def get_resolver(ttl=300, selection='round-robin'):
+    """Returns the resolver of the process using the given options."""
+    key = ttl, selection
+    resolver = _RESOLVERS.get(key)
+    if resolver is None:
+        resolver = _RESOLVERS[key] = Resolver(ttl=ttl, selection=selection)
+    return resolver
+
+
 def dns_resolve(url):
     """Resolve hostname in the given url, using cached results where possible.
 
@@ -68,24 +250,9 @@ def dns_resolve(url):
     the original hostname string, and the resolved IP addr string.
 
     The results of DNS resolution are cached to make sure this doesn't become
-    a bottleneck for the loadtest.  If the hostname resolves to multiple
-    addresses then a random address is chosen.
+    a bottleneck for the loadtest. See :class:`Resolver`.
     """
-    parts = urlparse.urlparse(url)
-    netloc = parts.netloc.rsplit(':')
-    if len(netloc) == 1:
-        netloc.append('80')
-
-    original = netloc[0]
-    addrs = _DNS_CACHE.get(original)
-    if addrs is None:
-        addrs = socket.gethostbyname_ex(original)[2]
-        _DNS_CACHE[original] = addrs
-
-    resolved = random.choice(addrs)
-    netloc = resolved + ':' + netloc[1]
-    parts = (parts.scheme, netloc) + parts[2:]
-    return urlparse.urlunparse(parts), original, resolved
+    return get_resolver().resolve(url)
 
 
 # taken from distutils2
@@ -117,6 +284,16 @@ def resolve_name(name):
     module_name = parts[:cursor]
     ret = ''
 
+    # the names in modules already imported are found without trying
+    # imports
+    for index in range(cursor, 0, -1):
+        module = sys.modules.get('.'.join(parts[:index]))
+        if module is not None:
+            try:
+                return reduce(getattr, parts[index:], module)
+            except AttributeError:
+                break
+
     while cursor > 0:
         try:
             ret = __import__('.'.join(module_name))
@@ -137,6 +314,50 @@ def resolve_name(name):
     return ret
 
 
+class ImportProfile(object):
+    """Records the time spent importing each module, while active.
+
+    The *total* time of a module includes the imports it triggers, its
+    *self* time does not.
+    """
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+        self._original = None
+
+    def _import(self, name, *args, **kw):
+        if sys.modules.get(name) is not None:
+            return self._original(name, *args, **kw)
+
+        self._stack.append(0.)
+        start = time.time()
+        try:
+            return self._original(name, *args, **kw)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if sys.modules.get(name) is not None:
+                total, self_ = self.timings.get(name, (0., 0.))
+                self.timings[name] = (total + elapsed,
+                                      self_ + elapsed - children)
+
+    def __enter__(self):
+        self._original = __builtin__.__import__
+        __builtin__.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc_info):
+        __builtin__.__import__ = self._original
+
+    def top(self, size=20):
+        """Returns the *size* slowest imports, by self time."""
+        timings = sorted(self.timings.items(), key=lambda item: -item[1][1])
+        return [{'module': name, 'total': total, 'self': self_}
+                for name, (total, self_) in timings[:size]]
+
+
 def glob(patterns, location='.'):
     for pattern in patterns:
         basedir, pattern = os.path.split(pattern)
@@ -146,33 +367,41 @@ def glob(patterns, location='.'):
                 yield os.path.join(basedir, file_)
 
 
-def pack_include_files(include_files, location='.'):
+def _iter_include_files(include_files, location='.'):
+    """Yields the (name, path) of the files matched by include_files."""
+    for basepath in glob(include_files, location):
+        basedir, basename = os.path.split(basepath)
+        if not os.path.isdir(basepath):
+            yield basename, basepath
+        else:
+            for root, dirnames, filenames in os.walk(basepath):
+                for filename in filenames:
+                    filepath = os.path.join(root, filename)
+                    yield filepath[len(basedir):], filepath
+
+
+def pack_include_files(include_files, location='.', raw=False):
     """Package up the specified include_files into a zipfile data bundle.
 
     This is a convenience function for packaging up data files into a binary
     blob, that can then be shipped to the different agents.  Unpack the files
     using unpack_include_files().
+
+    The blob is base64 encoded, unless *raw* is True, for the transports
+    that can carry bytes.
     """
     file_data = StringIO()
     zf = zipfile.ZipFile(file_data, "w", compression=zipfile.ZIP_DEFLATED)
 
-    def store_file(name, filepath):
+    for name, filepath in _iter_include_files(include_files, location):
         info = zipfile.ZipInfo(name)
         info.external_attr = os.stat(filepath).st_mode << 16L
         with open(filepath) as f:
             zf.writestr(info, f.read())
 
-    for basepath in glob(include_files, location):
-        basedir, basename = os.path.split(basepath)
-        if not os.path.isdir(basepath):
-            store_file(basename, basepath)
-        else:
-            for root, dirnames, filenames in os.walk(basepath):
-                for filename in filenames:
-                    filepath = os.path.join(root, filename)
-                    store_file(filepath[len(basedir):], filepath)
-
     zf.close()
+    if raw:
+        return file_data.getvalue()
     return file_data.getvalue().encode('base64')
 
 
@@ -182,14 +411,48 @@ def maybe_makedirs(dirpath):
         os.makedirs(dirpath)
 
 
+def user_cache_dir(name):
+    """Returns the directory :param name: in the cache of the user,
+    ``~/.cache`` unless XDG_CACHE_HOME is set.
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(root, name)
+
+
+def private_makedirs(dirpath):
+    """Creates :param dirpath: for the current user only if needed, and
+    checks no one else can write in it: its files are run or imported.
+
+    Raises a ValueError when it's owned by another user or writable by
+    the group or the others.
+    """
+    if not os.path.isdir(dirpath):
+        try:
+            os.makedirs(dirpath, 0700)
+        except OSError:
+            # created by another worker in the meantime
+            if not os.path.isdir(dirpath):
+                raise
+    st = os.stat(dirpath)
+    if st.st_uid != os.getuid():
+        raise ValueError('The directory %r is not owned by the current '
+                         'user' % dirpath)
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ValueError('The directory %r is writable by other users' %
+                         dirpath)
+
+
 def unpack_include_files(file_data, location='.'):
     """Unpack a blob of include_files data into the specified directory.
 
     This is a convenience function for unpackaging data files from a binary
     blob, that can be used on the different agents.  It accepts data in the
-    format produced by pack_include_files().
+    format produced by pack_include_files(), raw or base64 encoded.
     """
-    file_data = str(file_data).decode('base64')
+    file_data = str(file_data)
+    if not file_data.startswith(_ZIP_PREFIX):
+        file_data = file_data.decode('base64')
     zf = zipfile.ZipFile(StringIO(file_data))
 
     for itemname in zf.namelist():
@@ -204,3 +467,224 @@ def unpack_include_files(file_data, location='.'):
             if mode:
                 os.chmod(itempath, mode)
     zf.close()
+
+
+# Content-addressed bundles
+#
+# A bundle is a zip file holding each distinct content once, under
+# "objects/<sha1>", and a MANIFEST.json giving the name, hash and mode of
+# every file. Once unpacked, the contents are kept in a cache directory,
+# and the files of the test directory are copies of them, with the mode of
+# the original files, so the tests can change them without changing the
+# cache. The unchanged files are not written again. The cached contents
+# are read-only.
+
+# all the zip files start with it, the empty ones with 'PK\x05\x06', and
+# no base64 data does
+_ZIP_PREFIX = 'PK'
+_CHUNK_SIZE = 64 * 1024
+MANIFEST_NAME = 'MANIFEST.json'
+
+
+def file_hash(path):
+    """Returns the sha1 hex digest of the file, reading it by chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _HashIndex(object):
+    """Remembers the hashes of the files by path, size and mtime, so the
+    unchanged files are not read again to be hashed.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.hashes = {}
+        self.changed = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.hashes = json.load(f)
+            except ValueError:
+                logger.debug('Ignoring the corrupted hash index %r' % path)
+
+    def get(self, path, stat):
+        path = os.path.abspath(path)
+        key = [stat.st_size, stat.st_mtime, stat.st_ino]
+        entry = self.hashes.get(path)
+        if entry is not None and entry[:3] == key:
+            return entry[3]
+        digest = file_hash(path)
+        self.hashes[path] = key + [digest]
+        self.changed = True
+        return digest
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.hashes, f)
+        os.rename(tmp, self.path)
+        self.changed = False
+
+
+def build_manifest(include_files, location='.', index=None):
+    """Returns the manifest of the include files: a list of dicts giving
+    the *name*, *path*, *hash*, *mode* and *size* of each file.
+    """
+    if index is None:
+        index = _HashIndex()
+    manifest = []
+    for name, filepath in _iter_include_files(include_files, location):
+        stat = os.stat(filepath)
+        manifest.append({'name': name, 'path': filepath,
+                         'hash': index.get(filepath, stat),
+                         'mode': stat.st_mode & 07777,
+                         'size': stat.st_size})
+    return manifest
+
+
+def _object_path(cache_dir, digest, mode):
+    # the mode is part of the name, the files are copied with it
+    return os.path.join(cache_dir, digest[:2], '%s-%o' % (digest, mode))
+
+
+def _store_object(fileobj, object_path, mode, readonly=False):
+    """Copies :param fileobj: into the cache, atomically."""
+    maybe_makedirs(os.path.dirname(object_path))
+    tmp = '%s.%d.tmp' % (object_path, os.getpid())
+    with open(tmp, 'wb') as f:
+        shutil.copyfileobj(fileobj, f, _CHUNK_SIZE)
+    if readonly:
+        mode &= ~0222
+    os.chmod(tmp, mode)
+    os.rename(tmp, object_path)
+
+
+def _copy_object(object_path, target, digest, mode, index):
+    """Copies the cached object in :param target:, with the :param mode:
+    of the original file.
+
+    Returns True if the file was written, False if it already had that
+    content and mode.
+    """
+    # the objects cached by the previous versions kept their write bits
+    object_mode = os.stat(object_path).st_mode
+    if object_mode & 0222:
+        os.chmod(object_path, object_mode & ~0222 & 07777)
+    if os.path.exists(target):
+        # the previous versions hardlinked the files to the objects
+        stat = os.stat(target)
+        if (not os.path.samefile(object_path, target) and
+                stat.st_mode & 07777 == mode and
+                index.get(target, stat) == digest):
+            return False
+    else:
+        maybe_makedirs(os.path.dirname(target))
+    with open(object_path, 'rb') as f:
+        _store_object(f, target, mode)
+    return True
+
+
+def sync_include_files(include_files, location, cache_dir, source='.'):
+    """Copies the include files into :param location:, through the cache.
+
+    The files are hashed, only the contents missing in :param cache_dir:
+    are copied into it, and the files of the location are copied from
+    them. Files that did not change since the last run are skipped.
+
+    Returns the number of files written and skipped.
+    """
+    private_makedirs(cache_dir)
+    index = _HashIndex(os.path.join(cache_dir, 'index.json'))
+    written = skipped = 0
+
+    for entry in build_manifest(include_files, source, index):
+        object_path = _object_path(cache_dir, entry['hash'], entry['mode'])
+        if not os.path.exists(object_path):
+            with open(entry['path'], 'rb') as f:
+                _store_object(f, object_path, entry['mode'], readonly=True)
+        target = os.path.join(location, entry['name'].lstrip('/'))
+        if _copy_object(object_path, target, entry['hash'], entry['mode'],
+                        index):
+            written += 1
+        else:
+            skipped += 1
+
+    index.save()
+    return written, skipped
+
+
+def pack_bundle(include_files, fileobj, location='.'):
+    """Writes the bundle of the include files into :param fileobj:.
+
+    The files are streamed from the disk into the archive, and a content
+    is stored once however many files share it. Returns the manifest.
+    """
+    manifest = build_manifest(include_files, location)
+    zf = zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED)
+    try:
+        stored = set()
+        for entry in manifest:
+            if entry['hash'] not in stored:
+                stored.add(entry['hash'])
+                zf.write(entry['path'], 'objects/' + entry['hash'])
+            del entry['path']
+        zf.writestr(MANIFEST_NAME, json.dumps(manifest))
+    finally:
+        zf.close()
+    return manifest
+
+
+def unpack_bundle(fileobj, location='.', cache_dir=None):
+    """Unpacks a bundle written by pack_bundle() into :param location:.
+
+    With a :param cache_dir:, the contents already in the cache are not
+    extracted again, and the files are copied from the cached ones.
+
+    Returns the number of files written and skipped.
+    """
+    index = None
+    if cache_dir is not None:
+        private_makedirs(cache_dir)
+        index = _HashIndex(os.path.join(cache_dir, 'index.json'))
+    zf = zipfile.ZipFile(fileobj)
+    written = skipped = 0
+    try:
+        manifest = json.loads(zf.read(MANIFEST_NAME))
+        for entry in manifest:
+            target = os.path.join(location, entry['name'].lstrip('/'))
+            member = 'objects/' + entry['hash']
+
+            if cache_dir is None:
+                maybe_makedirs(os.path.dirname(target))
+                source = zf.open(member)
+                try:
+                    _store_object(source, target, entry['mode'])
+                finally:
+                    source.close()
+                written += 1
+                continue
+
+            object_path = _object_path(cache_dir, entry['hash'],
+                                       entry['mode'])
+            if not os.path.exists(object_path):
+                source = zf.open(member)
+                try:
+                    _store_object(source, object_path, entry['mode'],
+                                  readonly=True)
+                finally:
+                    source.close()
+            if _copy_object(object_path, target, entry['hash'],
+                            entry['mode'], index):
+                written += 1
+            else:
+                skipped += 1
+        if index is not None:
+            index.save()
+    finally:
+        zf.close()
+    return written, skipped
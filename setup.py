@@ -23,6 +23,7 @@ setup(name='loads-tester',
         "Programming Language :: Python",
       ],
       install_requires=requires,
+      extras_require={'http2': ['hyper']},
       author='Mozilla Services',
       author_email='services-dev@mozilla.org',
       url='https://github.com/mozilla-services/loads-agent',
@@ -31,4 +32,5 @@ setup(name='loads-tester',
       entry_points="""
       [console_scripts]
       loads-runner  = loadstester.main:main
+      loads-bench  = loadstester.bench:main
       """)